@@ -0,0 +1,40 @@
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from constants import INTERNED_ADDRESS_LIMIT
+
+_interned = {}  # Key and value: the same address bytes, so equal addresses share one object
+
+
+def to_address(party):
+    # Canonical, hashable form of an account: the compressed public key for
+    # wallets and the UTF-8 name for system accounts like "Network"
+    if isinstance(party, bytes):
+        return party
+    if isinstance(party, str):
+        return party.encode()
+    return party.public_bytes(serialization.Encoding.X962, serialization.PublicFormat.CompressedPoint)
+
+
+def intern_address(party):
+    # Interning only saves memory, so when decoded transactions from peers fill
+    # the table with junk addresses it is simply started over
+    address = to_address(party)
+    interned = _interned.get(address)
+    if interned is not None:
+        return interned
+    if len(_interned) >= INTERNED_ADDRESS_LIMIT:
+        _interned.clear()
+    return _interned.setdefault(address, address)
+
+
+def to_public_key(party):
+    # Public key object for a wallet address, or None for system accounts
+    if isinstance(party, ec.EllipticCurvePublicKey):
+        return party
+    address = to_address(party)
+    if len(address) != 33 or address[0] not in (2, 3):
+        return None
+    try:
+        return ec.EllipticCurvePublicKey.from_encoded_point(ec.SECP256R1(), address)
+    except ValueError:
+        return None
@@ -0,0 +1,57 @@
+from bisect import bisect_right
+from address import to_address, intern_address
+from blockfilter import build_filter, transaction_addresses
+from constants import HISTORY_PAGE_SIZE
+
+
+class AddressIndex:
+    # Address history kept in step with the main chain: for each address the
+    # (height, transaction index) of every transaction touching it, in chain
+    # order, plus each block's compact address filter for light clients. Blocks
+    # are indexed on the first query (catch_up), so opening a long chain does
+    # not read them; after that the index follows the tip block by block.
+    def __init__(self):
+        self.history = {}  # Key: address, Value: sorted list of (height, transaction index)
+        self.filters = {}  # Key: height, Value: Golomb-coded address filter
+        self.height = 0  # Blocks below this height are indexed
+
+    def catch_up(self, chain):
+        for height in range(self.height, len(chain)):
+            self.add_block(height, chain[height])
+
+    def add_block(self, height, block):
+        if height != self.height:
+            return  # Not caught up yet; catch_up will index it
+        self.height = height + 1
+        if block.transactions is None:
+            return  # Pruned: only history from its snapshot on is indexed
+        for index, transaction in enumerate(block.transactions):
+            for address in transaction_addresses(transaction):
+                entries = self.history.setdefault(intern_address(address), [])
+                if not entries or entries[-1] != (height, index):
+                    entries.append((height, index))
+        self.filters[height] = build_filter(block)
+
+    def remove_block(self, height, block):
+        # Undo add_block for the tip block, e.g. when a reorg disconnects it
+        if height >= self.height:
+            return
+        self.height = height
+        for transaction in block.transactions:
+            for address in transaction_addresses(transaction):
+                entries = self.history.get(address)
+                while entries and entries[-1][0] == height:
+                    entries.pop()
+                if entries == []:
+                    del self.history[address]
+        self.filters.pop(height, None)
+
+    def get_history(self, address, after=None, limit=HISTORY_PAGE_SIZE):
+        # One page of (height, transaction index) entries, oldest first. Pass the
+        # last entry of a page as `after` to get the next one.
+        entries = self.history.get(to_address(address), [])
+        start = 0 if after is None else bisect_right(entries, tuple(after))
+        return entries[start:start + limit]
+
+    def get_filter(self, height):
+        return self.filters.get(height)
@@ -0,0 +1,190 @@
+import numpy as np
+from address import to_address, intern_address
+
+# Asset id 0 is the chain's own coin, moved by ordinary transactions
+NATIVE_ASSET = "SimpleCoin"
+
+# Accounts and assets the balance array has room for before it first grows
+INITIAL_ACCOUNTS = 1024
+INITIAL_ASSETS = 8
+
+
+class AssetLedger:
+    # Balances of every (account, asset) pair in one dense NumPy array of whole
+    # coins. The native coin's column is the chain's confirmed balances
+    # (Ledger.confirmed reads it) and only blocks move it. Account and asset
+    # ids are handed out on first use, a batch's new ones together. Batches of
+    # transfers are applied with scatter-adds, and their overdraft check runs
+    # over the array instead of once per transfer.
+    def __init__(self, issuers=("Network",)):
+        self.account_ids = {}  # Key: address, Value: row in balances
+        self.accounts = []  # Address of each row
+        self.asset_ids = {}  # Key: asset name, Value: column in balances
+        self.assets = []  # Name of each column
+        self.balances = np.zeros((INITIAL_ACCOUNTS, INITIAL_ASSETS), dtype=np.int64)
+        # Accounts that create value and may go negative, like the reward sender
+        self.issuers = np.zeros(INITIAL_ACCOUNTS, dtype=bool)
+        self.register_asset(NATIVE_ASSET)
+        for issuer in issuers:
+            self.issuers[self.account_id(issuer)] = True
+
+    def register_asset(self, asset):
+        return self.asset_id_array([asset])[0].item()
+
+    def account_id(self, address):
+        return self.account_id_array([address])[0].item()
+
+    def asset_id_array(self, assets):
+        return self._ids(self.asset_ids, self.assets, assets)
+
+    def account_id_array(self, addresses):
+        return self._ids(self.account_ids, self.accounts, list(map(intern_address, addresses)))
+
+    def _ids(self, ids, names, keys):
+        # Ids of keys as an array, registering the unknown ones in one step
+        new = [key for key in dict.fromkeys(keys) if key not in ids]
+        if new:
+            ids.update(zip(new, range(len(names), len(names) + len(new))))
+            names.extend(new)
+            self._reserve()
+        return np.fromiter(map(ids.__getitem__, keys), dtype=np.int64, count=len(keys))
+
+    def _reserve(self):
+        # Grow the arrays, doubling, until every registered account and asset has room
+        rows, columns = self.balances.shape
+        while rows < len(self.accounts):
+            rows *= 2
+        while columns < len(self.assets):
+            columns *= 2
+        if (rows, columns) != self.balances.shape:
+            self.balances = np.pad(self.balances, ((0, rows - self.balances.shape[0]), (0, columns - self.balances.shape[1])))
+            self.issuers = np.pad(self.issuers, (0, rows - len(self.issuers)))
+
+    def get_balance(self, address, asset=NATIVE_ASSET):
+        account_id = self.account_ids.get(to_address(address))
+        asset_id = self.asset_ids.get(asset)
+        if account_id is None or asset_id is None:
+            return 0
+        return self.balances[account_id, asset_id].item()
+
+    def transfer_arrays(self, transfers):
+        # (senders, recipients, assets, amounts) arrays for (sender, recipient, asset,
+        # amount) tuples, or None if an amount is not a whole number of coins
+        if not transfers:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, empty, empty
+        senders, recipients, assets, amounts = zip(*transfers)
+        amounts = np.array(amounts)
+        if amounts.dtype.kind not in "iu":
+            return None
+        return (self.account_id_array(senders), self.account_id_array(recipients),
+                self.asset_id_array(assets), amounts.astype(np.int64))
+
+    def overdrafts(self, senders, recipients, assets, amounts):
+        # (account ids, asset ids) that the batch as a whole would leave negative.
+        # Only the cells the batch touches are summed and compared.
+        columns = self.balances.shape[1]
+        cells = np.concatenate((senders * columns + assets, recipients * columns + assets))
+        changes = np.concatenate((-amounts, amounts))
+        touched, positions = np.unique(cells, return_inverse=True)
+        delta = np.zeros(len(touched), dtype=np.int64)
+        np.add.at(delta, positions, changes)
+        after = self.balances.reshape(-1)[touched] + delta
+        overdrawn = touched[(after < 0) & (delta < 0) & ~self.issuers[touched // columns]]
+        return overdrawn // columns, overdrawn % columns
+
+    def apply_transfers(self, senders, recipients, assets, amounts, check=True):
+        # Apply a batch of transfers at once. With check=True nothing is applied
+        # if any non-issuer account would be overdrawn by the batch.
+        if check and len(self.overdrafts(senders, recipients, assets, amounts)[0]):
+            print("Insufficient funds!")
+            return False
+        np.subtract.at(self.balances, (senders, assets), amounts)
+        np.add.at(self.balances, (recipients, assets), amounts)
+        return True
+
+    def transfer(self, transfers, check=True):
+        # Registered assets only: native coins move with blocks
+        if any(asset == NATIVE_ASSET for _, _, asset, _ in transfers):
+            print("Native coins only move with blocks!")
+            return False
+        return self._apply_arrays(self.transfer_arrays(transfers), check)
+
+    def apply_block(self, block, direction=1):
+        # Native coin transfers of a block; returns False, applying nothing, if
+        # they would overdraw an account. direction=-1 reverts a connected block.
+        transfers = [(transaction.sender, transaction.recipient, NATIVE_ASSET, direction * transaction.amount)
+                     for transaction in block.transactions]
+        return self._apply_arrays(self.transfer_arrays(transfers), direction == 1)
+
+    def _apply_arrays(self, arrays, check):
+        if arrays is None:
+            print("Amounts must be whole numbers!")
+            return False
+        return self.apply_transfers(*arrays, check=check)
+
+    def revert_block(self, block):
+        self.apply_block(block, -1)
+
+    def settle_channels(self, channels):
+        # Bulk settlement of closed channels: each channel's per-asset movements
+        # from party1 to party2 are paid out in one batch, or none if any party
+        # cannot cover its side
+        transfers = []
+        for channel in channels:
+            for asset, change in channel.balances1.items():
+                if change:
+                    transfers.append((channel.party1, channel.party2, asset, -change))
+        return self.transfer(transfers)
+
+    def load(self, balances):
+        # Replace all balances with {asset: {address: balance}}
+        self.balances[:] = 0
+        for asset, table in balances.items():
+            asset_id = self.register_asset(asset)
+            self.balances[self.account_id_array(table), asset_id] = np.fromiter(table.values(), dtype=np.int64, count=len(table))
+
+    def column(self, asset):
+        return AssetColumn(self, asset)
+
+    def export(self, assets=None):
+        # Non-zero balances as {asset: {address: balance}}
+        exported = {}
+        rows, columns = np.nonzero(self.balances[:len(self.accounts), :len(self.assets)])
+        for row, column in zip(rows.tolist(), columns.tolist()):
+            asset = self.assets[column]
+            if assets is None or asset in assets:
+                exported.setdefault(asset, {})[self.accounts[row]] = self.balances[row, column].item()
+        return exported
+
+
+class AssetColumn:
+    # Read-only view of one asset's balances as a dict of {address: balance}
+    def __init__(self, ledger, asset):
+        self.ledger = ledger
+        self.asset = asset
+
+    def __getitem__(self, address):
+        account_id = self.ledger.account_ids.get(to_address(address))
+        if account_id is None:
+            raise KeyError(address)
+        return self.ledger.balances[account_id, self.ledger.asset_ids[self.asset]].item()
+
+    def __contains__(self, address):
+        return to_address(address) in self.ledger.account_ids
+
+    def __iter__(self):
+        return iter(self.ledger.accounts)
+
+    def __len__(self):
+        return len(self.ledger.accounts)
+
+    def get(self, address, default=None):
+        account_id = self.ledger.account_ids.get(to_address(address))
+        if account_id is None:
+            return default
+        return self.ledger.balances[account_id, self.ledger.asset_ids[self.asset]].item()
+
+    def items(self):
+        column = self.ledger.balances[:len(self.ledger.accounts), self.ledger.asset_ids[self.asset]]
+        return zip(self.ledger.accounts, column.tolist())
@@ -1,23 +1,186 @@
 import time
+import queue
+import struct
 import hashlib
-from constants import DIFFICULTY
+import multiprocessing
+import merkle
+from constants import DIFFICULTY, MINING_WORKERS
+from encoding import LENGTH
+from transaction import Transaction
+
+# Layout version written into every block header
+BLOCK_VERSION = 1
+
+# version, previous hash, Merkle root, timestamp; the nonce follows
+HEADER_PREFIX = struct.Struct('<I32s32sd')
+NONCE = struct.Struct('<Q')
+HEADER = struct.Struct(HEADER_PREFIX.format + NONCE.format[1:])
+HEADER_SIZE = HEADER.size
+
+# Transaction count written for a block whose body has been pruned
+PRUNED = 0xFFFFFFFF
+
+# Nonces a worker tries between checks of the shared stop flag
+NONCE_BATCH_SIZE = 4096
+
+# Seconds the parent waits for a result before checking that workers are still alive
+WORKER_POLL_INTERVAL = 1
 
 
 class Block:
+    __slots__ = ('version', 'timestamp', 'previous_hash', 'nonce', 'transactions', 'merkle_root', 'hash', '_merkle_levels')
+
     def __init__(self, previous_hash, transactions):
+        self.version = BLOCK_VERSION
         self.timestamp = time.time()
         self.previous_hash = previous_hash
         self.nonce = 0  # Added for the Proof-of-Work mechanism
         self.transactions = transactions
+        self.merkle_root = self.compute_merkle_root()
         self.hash = self.compute_hash()
+        self._merkle_levels = None
+
+    def compute_merkle_root(self, cached=True):
+        # cached=False recomputes every txid from the transaction fields
+        if cached:
+            return merkle.merkle_root([transaction.txid() for transaction in self.transactions])
+        return merkle.merkle_root([transaction.compute_txid() for transaction in self.transactions])
+
+    def merkle_proof(self, transaction):
+        # O(log n) sibling hashes proving the transaction is committed to by merkle_root
+        if self._merkle_levels is None:
+            self._merkle_levels = merkle.merkle_levels([tx.txid() for tx in self.transactions])
+        return merkle.merkle_proof(self._merkle_levels, self.transactions.index(transaction))
+
+    @staticmethod
+    def verify_merkle_proof(txid, proof, merkle_root):
+        return merkle.verify_proof(txid, proof, merkle_root)
+
+    def header_prefix(self):
+        # Everything hashed ahead of the nonce; it does not change while mining
+        previous_hash = bytes.fromhex(self.previous_hash.rjust(64, '0'))
+        return HEADER_PREFIX.pack(self.version, previous_hash, self.merkle_root, self.timestamp)
+
+    def header(self):
+        return self.header_prefix() + NONCE.pack(self.nonce)
 
     def compute_hash(self):
-        block_string = "{}{}{}{}".format(self.timestamp, self.previous_hash, self.transactions, self.nonce).encode()
-        return hashlib.sha256(block_string).hexdigest()
+        return hashlib.sha256(self.header()).hexdigest()
+
+    @classmethod
+    def from_header(cls, header):
+        # A block known only by its header; its transactions are None
+        block = cls.__new__(cls)
+        block.version, previous_hash, block.merkle_root, block.timestamp, block.nonce = HEADER.unpack_from(header, 0)
+        block.previous_hash = previous_hash.hex()
+        block.transactions = None
+        block.hash = hashlib.sha256(header[:HEADER_SIZE]).hexdigest()
+        block._merkle_levels = None
+        return block
+
+    def pruned(self):
+        # Header-only copy, as kept once the body is pruned
+        return Block.from_header(self.header())
 
-    def mine(self):
+    def serialize(self):
+        # Header followed by the transaction count and each transaction
+        if self.transactions is None:
+            return self.header() + LENGTH.pack(PRUNED)
+        parts = [self.header(), LENGTH.pack(len(self.transactions))]
+        parts.extend(transaction.serialize() for transaction in self.transactions)
+        return b''.join(parts)
+
+    @classmethod
+    def deserialize(cls, data):
+        # Transactions are decoded in place from a memoryview over `data`
+        data = memoryview(data)
+        block = cls.__new__(cls)
+        block.version, previous_hash, block.merkle_root, block.timestamp, block.nonce = HEADER.unpack_from(data, 0)
+        block.previous_hash = previous_hash.hex()
+        (count,) = LENGTH.unpack_from(data, HEADER_SIZE)
+        offset = HEADER_SIZE + LENGTH.size
+        block.transactions = None if count == PRUNED else []
+        for _ in range(0 if count == PRUNED else count):
+            transaction, offset = Transaction.deserialize(data, offset)
+            block.transactions.append(transaction)
+        block.hash = hashlib.sha256(data[:HEADER_SIZE]).hexdigest()
+        block._merkle_levels = None
+        return block
+
+    def mine(self, workers=MINING_WORKERS):
         # Proof-of-Work mechanism
-        pattern = '0' * DIFFICULTY
-        while not self.hash.startswith(pattern):
-            self.nonce += 1
-            self.hash = self.compute_hash()
+        prefix = self.header_prefix()
+        target = pow_target(DIFFICULTY)
+        if workers > 1:
+            self.nonce, digest = mine_parallel(prefix, target, workers)
+        else:
+            self.nonce, digest = search_nonces(hashlib.sha256(prefix), target, self.nonce, 1)
+        self.hash = digest.hex()
+
+
+def parse_header(header):
+    # (hash, previous hash, Merkle root) of a serialized header
+    _, previous_hash, merkle_root, _, _ = HEADER.unpack_from(header, 0)
+    return hashlib.sha256(header[:HEADER_SIZE]).hexdigest(), previous_hash.hex(), merkle_root
+
+
+def pow_target(difficulty):
+    # A digest starts with `difficulty` hex zeros exactly when it sorts below this
+    return (1 << (256 - 4 * difficulty)).to_bytes(32, 'big')
+
+
+def search_nonces(prefix_state, target, start, step, attempts=None):
+    # Hash only the nonce bytes on top of a copy of the precomputed prefix state.
+    # Returns (nonce, digest) for the first match, or None after `attempts` tries.
+    pack_nonce = NONCE.pack
+    nonce = start
+    while attempts is None or attempts > 0:
+        state = prefix_state.copy()
+        state.update(pack_nonce(nonce))
+        digest = state.digest()
+        if digest < target:
+            return nonce, digest
+        nonce += step
+        if attempts is not None:
+            attempts -= 1
+    return None
+
+
+def mine_parallel(prefix, target, workers):
+    # Worker i tries nonces i, i + workers, i + 2 * workers, ... The first one to
+    # find a match reports it and sets the stop flag for the rest.
+    found = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=_search_worker, args=(prefix, target, start, workers, found, results), daemon=True)
+        for start in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        while True:
+            try:
+                return results.get(timeout=WORKER_POLL_INTERVAL)
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes):
+                    # A worker may have reported just before exiting
+                    try:
+                        return results.get_nowait()
+                    except queue.Empty:
+                        raise RuntimeError("Every mining worker exited without finding a nonce")
+    finally:
+        found.set()
+        for process in processes:
+            process.join()
+
+
+def _search_worker(prefix, target, start, step, found, results):
+    prefix_state = hashlib.sha256(prefix)
+    nonce = start
+    while not found.is_set():
+        result = search_nonces(prefix_state, target, nonce, step, NONCE_BATCH_SIZE)
+        if result:
+            found.set()
+            results.put(result)
+            return
+        nonce += step * NONCE_BATCH_SIZE
@@ -1,166 +1,562 @@
 import time
-import random
+from concurrent.futures import ProcessPoolExecutor
 from transaction import Transaction
 from block import Block
 from channel import Channel
+from channelregistry import ChannelRegistry
 from smartcontract import SmartContract
-from constants import DIFFICULTY, MAX_TRANSACTIONS_PER_BLOCK, MINING_REWARD, TIME_LOCK_PERIOD
+from constants import DIFFICULTY, MAX_TRANSACTIONS_PER_BLOCK, MINING_WORKERS, SIGNATURE_WORKERS, TIME_LOCK_PERIOD, \
+    SNAPSHOT_INTERVAL, PRUNE_DEPTH, HISTORY_PAGE_SIZE
 from wallet import Wallet  # For the verify_signature method
+from ledger import Ledger
+from mempool import Mempool
+from address import to_address
+from validation import ChainValidator, block_reward, check_block, check_header, check_transaction
+from executor import BlockExecutor
+from blocktemplate import BlockTemplate
+from stakeregistry import StakeRegistry
+from contractstate import ContractStore
+from blocktree import BlockTree
+from snapshot import ChainSnapshot
+from addressindex import AddressIndex
+from assetledger import AssetLedger, NATIVE_ASSET
 
 class Blockchain:
-    def __init__(self):
-        self.chain = [self.create_genesis_block()]
-        self.transaction_pool = []
-        self.stakers = {} # New dictionary to keep track of staked coins
-        self.channels = [] # List to store active channels
-        self.contracts = {} # Dictionary to store deployed contracts
-        self.registered_assets = [] # List to store registered assets
+    def __init__(self, block_store=None, snapshot=None):
+        # A BlockStore keeps the chain on disk; without one it lives in a list
+        self.chain = block_store if block_store is not None else []
+        if not self.chain:
+            self.chain.append(self.create_genesis_block())
+        self.assets = AssetLedger() # Balances per (account, asset) in NumPy arrays, native coins included
+        self.ledger = Ledger(self.assets) # Native balances: the confirmed ones from assets, plus the pool
+        self.stakers = StakeRegistry() # Staked coins, sampled by weight in O(log n)
+        self.tree = BlockTree() # Main chain and side branches, for fork choice
+        self.address_index = AddressIndex() # Transactions by address, and per-block address filters
+        self.confirmed_txids = set() # Txids of confirmed transactions (not rewards), so none is confirmed twice
+        self.transaction_pool = Mempool()
+        self.transaction_pool.subscribe(self.ledger.add_pending, self.ledger.remove_pending)
+        # Next block's transactions, updated with the pool; one slot is left for the block reward
+        self.block_template = BlockTemplate(max_count=MAX_TRANSACTIONS_PER_BLOCK - 1)
+        self.transaction_pool.subscribe(self.block_template.add, self.block_template.remove)
+        self.mining_workers = MINING_WORKERS # Processes used for Proof-of-Work
+        self.validator = ChainValidator() # Remembers how far the chain has been verified
+        self.executor = BlockExecutor(self) # Runs the transactions selected for a block
+        self.signature_workers = SIGNATURE_WORKERS # Processes used for batch signature checks
+        self.signature_pool = None # Their process pool, started on first use and kept until close()
+        self.signature_pool_size = 0
+        self.channels = ChannelRegistry() # Channels indexed by party pair, party and state
+        self.contracts = ContractStore() # Deployed contracts, with journaled state
+        self.registered_assets = self.assets.asset_ids # Asset name -> id, O(1) lookups
         self.registered_watchtowers = [] # List to store registered watchtowers
+        self.snapshot_interval = SNAPSHOT_INTERVAL # Blocks between state snapshots
+        self.prune_depth = PRUNE_DEPTH # Recent blocks kept with their bodies (0 keeps all)
+        self.pruned_height = 0 # Blocks below this height have only their headers
+
+        # Start from a snapshot (by default the one saved in the block store) and
+        # replay only the blocks after it
+        if snapshot is None and hasattr(self.chain, "load_snapshot"):
+            data = self.chain.load_snapshot()
+            snapshot = ChainSnapshot.deserialize(data) if data else None
+        if snapshot is not None and (snapshot.height >= len(self.chain) or self.chain[snapshot.height].hash != snapshot.block_hash):
+            print("Snapshot does not match the chain!")
+            snapshot = None
+        self.snapshot = snapshot # Latest state snapshot; only blocks up to it may be pruned
+        if snapshot is not None:
+            snapshot.restore(self)
+        # The block tree starts below the snapshot's block, at most max_reorg_depth
+        # blocks down, so a branch forking just below it can still be adopted
+        root = 0 if snapshot is None else self.reorg_window_start(snapshot.height)
+        replayed = 0 if snapshot is None else snapshot.height + 1
+        self.tree.connected(self.tree.add(self.chain[root], root), [])
+        for height in range(root + 1, len(self.chain)):
+            block = self.chain[height]
+            if height >= replayed:
+                self.assets.apply_block(block)
+                self.apply_stakes(block, 1)
+                self.index_txids(block, 1)
+            self.tree.connected(self.tree.add(block), [])
+        self.mining_reward = block_reward(len(self.chain)) # Reward of the next block
+
+    def reorg_window_start(self, height):
+        # Lowest height, at most max_reorg_depth below `height`, from which every
+        # block up to `height` can be disconnected again. Undo records of contract
+        # writes do not survive a restart, and pruned blocks have no body to revert.
+        start = height
+        while start > max(height - self.tree.max_reorg_depth, 0):
+            transactions = self.chain[start].transactions
+            if transactions is None or any(transaction.tx_type == "contract" for transaction in transactions):
+                break
+            start -= 1
+        return start
+
+    @classmethod
+    def from_snapshot(cls, snapshot, source, commitment=None, block_store=None):
+        # Boot a node from a snapshot instead of genesis. The headers up to the
+        # snapshot come from source (anything with get_header(height), like
+        # HeaderSync sources) and are checked for linkage and Proof-of-Work;
+        # no block bodies are downloaded or replayed.
+        if commitment is not None and snapshot.commitment() != commitment:
+            print("Snapshot does not match its commitment!")
+            return None
+        chain = block_store if block_store is not None else []
+        previous_hash = None
+        for height in range(snapshot.height + 1):
+            block = Block.from_header(source.get_header(height))
+            if height == 0:
+                valid = block.hash == cls.create_genesis_block().hash
+            else:
+                valid = block.previous_hash == previous_hash and check_header(block, block.hash) is None
+            if not valid:
+                print(f"Invalid header at height {height}")
+                return None
+            chain.append(block)
+            previous_hash = block.hash
+        if previous_hash != snapshot.block_hash:
+            print("Snapshot does not match the headers!")
+            return None
+        if hasattr(chain, "save_snapshot"):
+            chain.save_snapshot(snapshot.serialize())
+        blockchain = cls(chain, snapshot)
+        blockchain.pruned_height = snapshot.height + 1
+        return blockchain
 
     def register_asset(self, asset_name):
-        if asset_name not in self.registered_assets:
-            self.registered_assets.append(asset_name)
+        self.assets.register_asset(asset_name)
+
+    def get_asset_balance(self, address, asset_name=NATIVE_ASSET):
+        return self.assets.get_balance(address, asset_name)
 
     def register_watchtower(self, watchtower):
         self.registered_watchtowers.append(watchtower)
 
-    def stake_coins(self, address, amount):
+    @staticmethod
+    def staking_transaction(address, amount):
+        # The transaction a staker signs to stake `amount`
+        return Transaction(address, "STAKE_ADDRESS", amount, None, tx_type="stake")
+
+    def stake_coins(self, address, amount, signature):
         # Check if the user has enough balance
         balance = self.get_balance(address)
         if balance < amount:
             print("Insufficient funds to stake!")
             return False
-        # Add or update the staked amount
-        if address in self.stakers:
-            self.stakers[address] += amount
-        else:
-            self.stakers[address] = amount
-        # Create a staking transaction
-        staking_transaction = Transaction(address, "STAKE_ADDRESS", amount, None, tx_type="stake")
-        self.transaction_pool.append(staking_transaction)
-        return True
+        # Like any transfer the stake is signed by its owner; it counts once it is in a block
+        staking_transaction = self.staking_transaction(address, amount)
+        if not Wallet.verify_signature(address, signature, staking_transaction.signing_payload()):
+            print("Invalid signature!")
+            return False
+        staking_transaction.signature = signature
+        return self.transaction_pool.add(staking_transaction)
+
+    def apply_stakes(self, block, direction):
+        for transaction in block.transactions:
+            if transaction.tx_type == "stake":
+                self.stakers.add(transaction.sender, direction * transaction.amount)
+
+    def index_txids(self, block, direction):
+        # Add (direction 1) or remove (-1) a block's txids in confirmed_txids.
+        # Rewards are left out: check_block already allows one per block.
+        for transaction in block.transactions:
+            if transaction.tx_type == "reward":
+                continue
+            if direction == 1:
+                self.confirmed_txids.add(transaction.txid())
+            else:
+                self.confirmed_txids.discard(transaction.txid())
 
     def select_validator(self):
         # Select a validator based on the number of coins staked
-        total_staked = sum(self.stakers.values())
-        r = random.randint(1, total_staked)
-        for address, stake in self.stakers.items():
-            if r <= stake:
-                return address
-            r -= stake
+        return self.stakers.select()
+
+    def select_validators(self, count, distinct=False):
+        # Draw several validators at once, e.g. for a committee or a simulation
+        return self.stakers.select_many(count, distinct)
 
     def challenge_close(self, party1, party2, transaction_index):
+        # Dispute a pending close with a newer state; a requester that claimed a
+        # state it had revoked loses its coin balance
         channel = self.find_channel(party1, party2)
-        if not channel or channel.open:
-            print("Channel not found or still open!")
-            return
-        # Check if the provided transaction index is more recent
-        if transaction_index > len(channel.commitment_transactions) - 1:
+        if not channel or not channel.close_requested:
+            print("Channel not found or no close requested!")
+            return False
+        # Check if the provided state number is known
+        if transaction_index > channel.state.number:
             print("Invalid transaction index!")
-            return
-        channel.close(transaction_index)
+            return False
+        return channel.challenge_close(transaction_index)
 
 
     def add_transaction_to_pool(self, transaction, sender_public_key, signature):
+        # A transaction already in the chain would be paid a second time
+        if transaction.txid() in self.confirmed_txids:
+            print("Transaction already confirmed!")
+            return False
         # Added validation for transaction amounts
         sender_balance = self.get_balance(transaction.sender)
         if sender_balance < transaction.amount:
             print("Insufficient funds!")
             return False
 
-        if Wallet.verify_signature(sender_public_key, signature, str(transaction)):
+        if Wallet.verify_signature(sender_public_key, signature, transaction.signing_payload()):
+            # Keep the signature with the transaction so it can be relayed and re-verified
+            transaction.signature = signature
             # Replace-by-Fee mechanism: If a transaction with a higher fee comes in, replace the one in the pool
-            for idx, old_transaction in enumerate(self.transaction_pool):
-                if old_transaction.sender == transaction.sender and old_transaction.recipient == transaction.recipient:
-                    if transaction.fee > old_transaction.fee:
-                        self.transaction_pool[idx] = transaction
-                        return True
-            self.transaction_pool.append(transaction)
-            return True
+            return self.transaction_pool.add_or_replace(transaction)
         return False
 
-    def create_genesis_block(self):
-        return Block("0", [])
+    def add_transactions_to_pool(self, entries):
+        # Batch admission of (transaction, sender_public_key, signature) tuples: the
+        # signatures are checked together up front, then admitted in order
+        signatures = [(public_key, signature, transaction) for transaction, public_key, signature in entries]
+        verified = Wallet.verify_signatures(signatures, self.signature_workers, self.signature_executor())
+        results = []
+        for (transaction, _, signature), valid in zip(entries, verified):
+            if not valid:
+                results.append(False)
+            elif transaction.txid() in self.confirmed_txids:
+                print("Transaction already confirmed!")
+                results.append(False)
+            elif self.get_balance(transaction.sender) < transaction.amount:
+                print("Insufficient funds!")
+                results.append(False)
+            else:
+                transaction.signature = signature
+                results.append(self.transaction_pool.add_or_replace(transaction))
+        return results
+
+    def signature_executor(self):
+        # The long-lived pool for batch signature checks, or None when they run in-process
+        if self.signature_workers <= 1:
+            return None
+        if self.signature_pool is not None and self.signature_pool_size != self.signature_workers:
+            self.signature_pool.shutdown()
+            self.signature_pool = None
+        if self.signature_pool is None:
+            self.signature_pool = ProcessPoolExecutor(self.signature_workers)
+            self.signature_pool_size = self.signature_workers
+        return self.signature_pool
+
+    def close(self):
+        # Stop the worker processes kept for signature checks and validation. A
+        # chain kept on disk also gets a snapshot of its tip, so reopening it
+        # restores that state instead of replaying the blocks.
+        if hasattr(self.chain, "save_snapshot") and (self.snapshot is None or self.snapshot.height < len(self.chain) - 1):
+            self.try_snapshot()
+        if self.signature_pool is not None:
+            self.signature_pool.shutdown()
+            self.signature_pool = None
+        self.validator.close()
+
+    @staticmethod
+    def create_genesis_block():
+        # Fixed timestamp, so every node starts from the same genesis hash
+        genesis = Block("0", [])
+        genesis.timestamp = 0
+        genesis.hash = genesis.compute_hash()
+        return genesis
 
     def mine_block(self, miner_address=None):
-        if not self.transaction_pool:
+        # PoS: Select a validator based on staked coins, falling back to the miner
+        validator = self.select_validator() or miner_address
+        if not self.transaction_pool and validator is None:
             return False
 
-        # Process each transaction in the pool (including smart contract calls)
-        for tx in self.transaction_pool:
-            self.process_transaction(tx)
+        # Take the prepared template (highest fee density within the size and count
+        # limits), then execute it in arrival order (including smart contract calls)
+        selected = []
+        for transaction in sorted(self.block_template.transactions(), key=self.transaction_pool.arrival_index):
+            # Unsigned or forged transactions would make the block invalid
+            reason = check_transaction(transaction)
+            if not reason and transaction.txid() in self.confirmed_txids:
+                reason = "already confirmed"
+            if reason:
+                print(f"Dropped pending transaction: {reason}")
+                self.transaction_pool.remove(transaction)
+            else:
+                selected.append(transaction)
+        # Contract transactions beyond the block's gas budget wait in the pool
+        selected, _ = self.executor.within_gas_budget(selected)
+        # The validator's reward is the block's first transaction
+        rewards = []
+        if validator is not None:
+            rewards.append(Transaction("Network", validator, self.mining_reward, None, tx_type="reward"))
+        # Contract writes are journaled until the block is appended, so a block
+        # abandoned while mining is undone at the cost of what it touched
+        self.contracts.checkpoint()
+        underfunded = []
+        try:
+            transactions_to_add = self.executor.execute(selected, underfunded)
+            new_block = Block(self.chain[-1].hash, rewards + transactions_to_add)
+            new_block.mine(self.mining_workers)  # Proof-of-Work mining
+        except BaseException:
+            self.contracts.revert()
+            raise
+        # Transactions that failed against the chain state would only be selected
+        # again. One that lacked funds stays if the pool as a whole covers its
+        # sender, since the coins it needs are still waiting to be mined.
+        executed = {id(transaction) for transaction in transactions_to_add}
+        covered = {id(transaction) for transaction in underfunded if self.ledger.get_balance(transaction.sender) >= 0}
+        for transaction in selected:
+            if id(transaction) not in executed and id(transaction) not in covered:
+                self.transaction_pool.remove(transaction)
 
-        # Select transactions based on fees (higher fees first) and the set limit
-        sorted_transactions = sorted(self.transaction_pool, key=lambda x: x.fee, reverse=True)
-        transactions_to_add = sorted_transactions[:MAX_TRANSACTIONS_PER_BLOCK]
-        new_block = Block(self.chain[-1].hash, transactions_to_add)
-        new_block.mine()  # Proof-of-Work mining
+        # Append the block; its contract changes are already made, and are undone
+        # by connect_block if the block is refused
+        node = self.tree.add(new_block)
+        if not self.connect_block(new_block, node, self.contracts.commit()):
+            self.tree.remove(node)
+            return False
+        return True
 
-        # PoS: Select a validator based on staked coins
-        validator = self.select_validator()
-        # Reward the validator
-        reward_transaction = Transaction("Network", validator, MINING_REWARD, None, tx_type="reward")
-        self.transaction_pool.append(reward_transaction)
+    def add_block(self, block, checked=False):
+        # Accept a block produced elsewhere if it checks out. A block on another
+        # branch is kept, and becomes the main chain once its branch has more work.
+        # checked=True skips check_block for callers that already ran it.
+        parent = self.tree.get(block.previous_hash)
+        if block.hash in self.tree or parent is None:
+            return False
+        # A branch forking below the blocks a reorganization can undo could never
+        # be switched to, so it is not stored (the height check bounds the walk)
+        tip = self.tree.tip
+        if parent is not tip and (not self.tree.can_undo(tip.height - parent.height)
+                                  or not self.tree.can_undo(tip.height - self.tree.fork_point(tip, parent).height)):
+            print("Rejected block: forks deeper than the reorganization limit")
+            return False
+        reason = None if checked else check_block(block, block.hash, parent.height + 1)
+        if reason:
+            print(f"Rejected block: {reason}")
+            return False
+        node = self.tree.add(block)
+        if node.parent is self.tree.tip:
+            if not self.connect_block(block, node):
+                self.tree.remove(node)
+                return False
+        elif node.work > self.tree.tip.work:
+            return self.reorganize(node)
+        return True
 
-        # Clear the added transactions from the pool
-        self.transaction_pool = self.transaction_pool[MAX_TRANSACTIONS_PER_BLOCK:]
+    def connect_block(self, block, node, contract_changes=None):
+        # Apply a block on top of the tip. contract_changes are its contract state
+        # writes when they were made while mining; a block from elsewhere is
+        # executed here instead, and is refused (returning False, with nothing
+        # applied) if it overspends, fails a contract call, exceeds the gas budget
+        # or repeats a transaction confirmed in an earlier block.
+        if any(transaction.tx_type != "reward" and transaction.txid() in self.confirmed_txids
+               for transaction in block.transactions):
+            print("Block repeats a confirmed transaction!")
+            if contract_changes is not None:
+                self.contracts.journal.undo(contract_changes)
+            return False
+        if contract_changes is None:
+            if self.executor.within_gas_budget(block.transactions)[1]:
+                print("Block exceeds the gas limit!")
+                return False
+            self.contracts.checkpoint()
+            try:
+                executed = self.executor.execute(block.transactions)
+            except BaseException:
+                self.contracts.revert()
+                raise
+            if len(executed) != len(block.transactions):
+                self.contracts.revert()
+                print("Block has transactions that fail against the chain state!")
+                return False
+            contract_changes = self.contracts.commit()
+        # The block's coin transfers are checked again as one batch over the asset ledger
+        if not self.assets.apply_block(block):
+            self.contracts.journal.undo(contract_changes)
+            return False
+        for transaction in block.transactions:
+            self.transaction_pool.remove_txid(transaction.txid())
+        self.chain.append(block)
+        self.apply_stakes(block, 1)
+        self.index_txids(block, 1)
+        self.address_index.add_block(len(self.chain) - 1, block)
+        self.tree.connected(node, contract_changes)
+        # Adjusted reward mechanism: the reward shrinks by 10% with every block
+        self.mining_reward = block_reward(len(self.chain))
+        if self.snapshot_interval and (len(self.chain) - 1) % self.snapshot_interval == 0:
+            self.try_snapshot()
+        return True
+
+    def disconnect_block(self, readmit=True):
+        # Undo the tip block. With readmit, its transactions go back to the pool
+        # if they can still be funded; otherwise the caller readmits them itself.
+        block = self.chain.pop()
+        self.assets.revert_block(block)
+        self.apply_stakes(block, -1)
+        self.index_txids(block, -1)
+        self.address_index.remove_block(len(self.chain), block)
+        self.contracts.journal.undo(self.tree.disconnected(block))
+        self.mining_reward = block_reward(len(self.chain))
+        if self.snapshot is not None and self.snapshot.height >= len(self.chain):
+            self.snapshot = None
+        if readmit:
+            self.readmit_transactions([block])
+        return block
+
+    def readmit_transactions(self, blocks):
+        # Put the transactions of disconnected blocks (oldest first) back in the
+        # pool, except for rewards, which only their own block could pay, those
+        # the chain confirms again and those their senders can no longer fund
+        for block in blocks:
+            for transaction in block.transactions:
+                if transaction.tx_type == "reward" or transaction.txid() in self.confirmed_txids:
+                    continue
+                if self.get_balance(transaction.sender) < transaction.amount:
+                    print("Dropped a disconnected transaction: insufficient funds")
+                    continue
+                self.transaction_pool.add(transaction)
 
-        # Adjusted reward mechanism
-        global MINING_REWARD
-        MINING_REWARD *= 0.9  # Reward reduction mechanism
+    def take_snapshot(self):
+        # Capture the state at the tip, keep it with the block store, and prune
+        # if this node does not keep an archive
+        snapshot = ChainSnapshot.capture(self)
+        if hasattr(self.chain, "save_snapshot"):
+            self.chain.save_snapshot(snapshot.serialize())
+        self.snapshot = snapshot
+        if self.prune_depth:
+            self.prune(self.prune_depth)
+        return self.snapshot
 
-        self.chain.append(new_block)
+    def try_snapshot(self):
+        # take_snapshot for callers that have already changed the chain: contract
+        # state that cannot be encoded costs only this snapshot. Returns it, or None.
+        try:
+            return self.take_snapshot()
+        except (TypeError, ValueError) as error:
+            print(f"Snapshot failed: {error}")
+            return None
+
+    def prune(self, depth):
+        # Drop the bodies of blocks more than `depth` below the tip, keeping their
+        # headers. Blocks after the latest snapshot and those a reorg may still
+        # undo are never pruned. Returns the height below which bodies are gone.
+        if self.snapshot is None:
+            print("No snapshot to prune up to!")
+            return self.pruned_height
+        depth = max(depth, self.tree.max_reorg_depth)
+        height = min(len(self.chain) - depth, self.snapshot.height + 1)
+        if hasattr(self.chain, "prune"):
+            self.pruned_height = self.chain.prune(height)
+            return self.pruned_height
+        for pruned in range(self.pruned_height, height):
+            self.chain[pruned] = self.chain[pruned].pruned()
+        self.pruned_height = max(self.pruned_height, height)
+        return self.pruned_height
+
+    def reorganize(self, node):
+        # Switch the main chain to the branch ending at node, undoing and applying
+        # only the blocks after the fork point
+        fork = self.tree.fork_point(self.tree.tip, node)
+        if not self.tree.can_undo(self.tree.tip.height - fork.height):
+            print("Reorganization deeper than the undo history!")
+            return False
+        # Transactions of the blocks undone are readmitted once the switch is
+        # over, against the balances of the branch that ends up connected
+        old_branch = self.tree.branch(fork, self.tree.tip)
+        disconnected = []
+        while self.tree.tip is not fork:
+            disconnected.append(self.disconnect_block(readmit=False))
+        for branch_node in self.tree.branch(fork, node):
+            if not self.connect_block(branch_node.block, branch_node):
+                # Forget the invalid block and its descendants, and go back to the old branch
+                self.tree.remove(branch_node)
+                while self.tree.tip is not fork:
+                    disconnected.append(self.disconnect_block(readmit=False))
+                for old_node in old_branch:
+                    self.connect_block(old_node.block, old_node)
+                self.readmit_transactions(reversed(disconnected))
+                return False
+        self.readmit_transactions(reversed(disconnected))
         return True
 
 
     
     def get_balance(self, address):
-        # Calculate the balance of an address
+        return self.ledger.get_balance(address)
+
+    def get_history(self, address, after=None, limit=HISTORY_PAGE_SIZE):
+        # Pages of (height, transaction index) for the address, without a chain scan
+        self.address_index.catch_up(self.chain)
+        return self.address_index.get_history(address, after, limit)
+
+    def get_block_filter(self, height):
+        # Compact address filter a light client checks before fetching the block
+        self.address_index.catch_up(self.chain)
+        return self.address_index.get_filter(height)
+
+    def scan_balance(self, address):
+        # Calculate the balance of an address by replaying the whole chain and pool.
+        # Kept as a consistency check for the ledger index.
+        address = to_address(address)
         balance = 0
-        for block in self.chain:
+        blocks = self.chain
+        if self.snapshot is not None and self.chain[0].transactions is None:
+            # Pruned history is only known through the snapshot
+            balance = self.snapshot.balances.get(address, 0)
+            blocks = (self.chain[height] for height in range(self.snapshot.height + 1, len(self.chain)))
+        for block in blocks:
             for transaction in block.transactions:
-                if transaction.sender == address:
+                if to_address(transaction.sender) == address:
                     balance -= transaction.amount
-                if transaction.recipient == address:
+                if to_address(transaction.recipient) == address:
                     balance += transaction.amount
         for transaction in self.transaction_pool:
-            if transaction.sender == address:
+            if to_address(transaction.sender) == address:
                 balance -= transaction.amount
-            if transaction.recipient == address:
+            if to_address(transaction.recipient) == address:
                 balance += transaction.amount
         return balance
 
     def is_valid(self):
-        for i in range(1, len(self.chain)):
-            current = self.chain[i]
-            previous = self.chain[i - 1]
+        return self.validate().valid
 
-            if current.hash != current.compute_hash():
-                return False
-            if current.previous_hash != previous.hash:
-                return False
-        return True
+    def validate(self, full=False):
+        # Checks the blocks after the last verified checkpoint, or all of them with
+        # full=True. The result reports the first invalid height.
+        return self.validator.validate(self.chain, full)
     
     def open_channel(self, party1, party2, deposit1, deposit2):
         # Check if both parties have enough balance
         if self.get_balance(party1) < deposit1 or self.get_balance(party2) < deposit2:
             print("Insufficient funds to open channel!")
             return
+        existing = self.find_channel(party1, party2)
+        if existing and existing.open:
+            print("Channel already open!")
+            return
         new_channel = Channel(party1, party2, deposit1, deposit2)
-        self.channels.append(new_channel)
+        self.channels.add(new_channel)
 
     def find_channel(self, party1, party2):
-        for channel in self.channels:
-            if (channel.party1 == party1 and channel.party2 == party2) or (channel.party1 == party2 and channel.party2 == party1):
-                return channel
-        return None
+        return self.channels.find(party1, party2)
 
-    def update_channel(self, party1, party2, amount, signature1, signature2):
+    def update_channel(self, party1, party2, asset, amount, signature1, signature2, secrets, revocation_hashes):
         channel = self.find_channel(party1, party2)
         if not channel:
             print("Channel not found!")
-            return
-        channel.update(amount, signature1, signature2)
+            return False
+        return channel.update(asset, amount, signature1, signature2, secrets, revocation_hashes)
+
+    def update_channels(self, updates):
+        # Pipelined channel updates: (channel, state, signature1, signature2, secrets)
+        # tuples, possibly several consecutive states of one channel. All signatures
+        # are verified in one batch, then the states are committed in order.
+        items = []
+        for channel, state, signature1, signature2, _ in updates:
+            payload = state.payload()
+            items.append((channel.party1, signature1, payload))
+            items.append((channel.party2, signature2, payload))
+        verified = Wallet.verify_signatures(items, self.signature_workers, self.signature_executor())
+        results = []
+        for index, (channel, state, signature1, signature2, secrets) in enumerate(updates):
+            if not (verified[2 * index] and verified[2 * index + 1]):
+                print("Invalid signatures!")
+                results.append(False)
+            else:
+                results.append(channel.commit(state, signature1, signature2, secrets, verified=True))
+        return results
 
     def close_channel(self, party1, party2):
         channel = self.find_channel(party1, party2)
@@ -168,44 +564,29 @@ class Blockchain:
             print("Channel not found!")
             return
         channel.close()
-        # Logic to settle the final balances on the main chain can be added here
+        self.settle_channels([channel])
 
-    def process_transaction(self, transaction):
-        # Handle regular transfers
-        if transaction.tx_type == "transfer":
-            sender_balance = self.get_balance(transaction.sender)
-            if sender_balance < transaction.amount:
-                print("Insufficient funds!")
-                return False
-            # Update balances (this is a simplified version)
-            # In a real-world scenario, you'd add the transaction to a block and then update balances
-            self.update_balance(transaction.sender, -transaction.amount)
-            self.update_balance(transaction.recipient, transaction.amount)
-            return True
-        
-        # Handle contract calls
-        elif transaction.tx_type == "contract" and transaction.contract_address and transaction.contract_method:
-            contract = self.contracts.get(transaction.contract_address)
-            if contract:
-                contract.call(transaction.contract_method, transaction.contract_args)
-                return True
-            else:
-                print("Contract not found!")
-                return False
+    def settle_channels(self, channels):
+        # Pay out the per-asset balances of closed channels in one vectorized batch
+        return self.assets.settle_channels(channels)
 
-        return False
+    def process_transaction(self, transaction):
+        # Execute a single transaction (transfer checks, smart contract calls) against
+        # the confirmed state. Balances are updated by the ledger once its block is appended.
+        return self.executor.execute([transaction]) == [transaction]
     
     def deploy_contract(self, contract):
         if contract.address not in self.contracts:
+            contract.compile()  # Method table used by every later call
             self.contracts[contract.address] = contract
             print(f"Contract deployed at address {contract.address}")
         else:
             print("Contract address already in use!")
 
-    def request_channel_close(self, party1, party2):
+    def request_channel_close(self, party1, party2, transaction_index=None, requester=None):
         channel = self.find_channel(party1, party2)
         if channel:
-            channel.request_close()
+            channel.request_close(transaction_index, requester)
 
     def finalize_channel_close(self, party1, party2):
         channel = self.find_channel(party1, party2)
@@ -0,0 +1,80 @@
+import hashlib
+from address import to_address
+from encoding import LENGTH
+
+# Golomb-coded set parameters (as in BIP 158): remainders of P bits, and a
+# false positive rate of about 1 / M per queried address
+FILTER_P = 19
+FILTER_M = 784931
+
+
+def transaction_addresses(transaction):
+    addresses = {to_address(transaction.sender), to_address(transaction.recipient)}
+    if transaction.contract_address:
+        addresses.add(to_address(transaction.contract_address))
+    return addresses
+
+
+def block_addresses(block):
+    # Every address a block's transactions touch
+    addresses = set()
+    for transaction in block.transactions:
+        addresses |= transaction_addresses(transaction)
+    return addresses
+
+
+def build_filter(block):
+    # Compact filter of the addresses in a block: each is hashed into [0, N * M),
+    # and the sorted hashes are stored as Golomb-Rice coded differences
+    key = bytes.fromhex(block.hash)[:16]
+    addresses = block_addresses(block)
+    limit = len(addresses) * FILTER_M
+    values = sorted(_hash_to_range(key, address, limit) for address in addresses)
+    bits = 0
+    length = 0
+    previous = 0
+    for value in values:
+        quotient, remainder = (value - previous) >> FILTER_P, (value - previous) & ((1 << FILTER_P) - 1)
+        # Quotient in unary (ones closed by a zero), then the remainder in P bits
+        bits = (bits << (quotient + 1)) | (((1 << quotient) - 1) << 1)
+        bits = (bits << FILTER_P) | remainder
+        length += quotient + 1 + FILTER_P
+        previous = value
+    padding = -length % 8
+    return LENGTH.pack(len(values)) + (bits << padding).to_bytes((length + padding) // 8, 'big')
+
+
+def filter_matches(filter_data, block_hash, addresses):
+    # True if any of the addresses may be in the block (false positives are
+    # possible, false negatives are not)
+    (count,) = LENGTH.unpack_from(filter_data, 0)
+    if count == 0:
+        return False
+    key = bytes.fromhex(block_hash)[:16]
+    limit = count * FILTER_M
+    targets = sorted(_hash_to_range(key, to_address(address), limit) for address in addresses)
+    if not targets:
+        return False
+    bits = int.from_bytes(filter_data[LENGTH.size:], 'big')
+    position = (len(filter_data) - LENGTH.size) * 8
+    value = 0
+    target_index = 0
+    for _ in range(count):
+        quotient = 0
+        while (bits >> (position - 1)) & 1:
+            quotient += 1
+            position -= 1
+        position -= 1 + FILTER_P
+        value += (quotient << FILTER_P) | ((bits >> position) & ((1 << FILTER_P) - 1))
+        while targets[target_index] < value:
+            target_index += 1
+            if target_index == len(targets):
+                return False
+        if targets[target_index] == value:
+            return True
+    return False
+
+
+def _hash_to_range(key, address, limit):
+    digest = hashlib.sha256(key + address).digest()
+    return (int.from_bytes(digest[:8], 'little') * limit) >> 64
@@ -0,0 +1,284 @@
+import os
+import mmap
+import struct
+from collections import OrderedDict
+from block import Block, HEADER_SIZE
+from constants import BLOCK_CACHE_SIZE, SEGMENT_SIZE
+
+# heights.idx: block count, then one (segment, offset, length) record per height
+COUNT = struct.Struct('<Q')
+HEIGHT_RECORD = struct.Struct('<IQI')
+INITIAL_HEIGHT_CAPACITY = 4096
+
+# hashes.idx: capacity and entry count, then an open-addressing table of
+# (block hash, height + 1) slots where a zero height marks an empty slot
+HASH_TABLE_HEADER = struct.Struct('<QQ')
+HASH_SLOT = struct.Struct('<32sQ')
+INITIAL_HASH_CAPACITY = 1024
+
+# pruned.idx: heights below this have only their headers stored
+PRUNED_HEIGHT = struct.Struct('<Q')
+
+
+class BlockStore:
+    # Append-only block storage. Blocks are written in their binary form to
+    # numbered segment files and found through two memory-mapped indexes, so
+    # opening a store does not depend on its length and only the blocks that
+    # are read get decoded. Behaves as a list of blocks, like Blockchain.chain.
+    def __init__(self, directory, segment_size=SEGMENT_SIZE, cache_size=BLOCK_CACHE_SIZE):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_size = segment_size
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # Key: height, Value: decoded block
+        self.readers = {}  # Key: segment number, Value: open file
+        self.heights_file, self.heights = self._open_index('heights.idx', COUNT.size + HEIGHT_RECORD.size * INITIAL_HEIGHT_CAPACITY)
+        self.hashes_file, self.hashes = self._open_index('hashes.idx', HASH_TABLE_HEADER.size + HASH_SLOT.size * INITIAL_HASH_CAPACITY)
+        if HASH_TABLE_HEADER.unpack_from(self.hashes, 0)[0] == 0:
+            HASH_TABLE_HEADER.pack_into(self.hashes, 0, INITIAL_HASH_CAPACITY, 0)
+
+    def __len__(self):
+        return COUNT.unpack_from(self.heights, 0)[0]
+
+    def __iter__(self):
+        for height in range(len(self)):
+            yield self[height]
+
+    def __getitem__(self, height):
+        height = self._normalize(height)
+        block = self.cache.get(height)
+        if block is None:
+            block = Block.deserialize(self._read(height))
+            self._remember(height, block)
+        else:
+            self.cache.move_to_end(height)
+        return block
+
+    def get_header(self, height):
+        # Only the fixed-size header, without decoding the transactions
+        return self._read(self._normalize(height), HEADER_SIZE)
+
+    def get_headers(self, start, count):
+        # Headers of up to `count` blocks from `start`, in one call
+        return [self._read(height, HEADER_SIZE) for height in range(start, min(start + count, len(self)))]
+
+    def get_block_data(self, height):
+        # The block's serialized form, as stored
+        return self._read(self._normalize(height))
+
+    def height_of(self, block_hash):
+        capacity, _ = HASH_TABLE_HEADER.unpack_from(self.hashes, 0)
+        slot, key = self._first_slot(block_hash, capacity)
+        while True:
+            stored, height = HASH_SLOT.unpack_from(self.hashes, self._slot_offset(slot))
+            if height == 0:
+                return None
+            if stored == key:
+                return height - 1
+            slot = (slot + 1) % capacity
+
+    def get_by_hash(self, block_hash):
+        height = self.height_of(block_hash)
+        return None if height is None else self[height]
+
+    def append(self, block):
+        data = block.serialize()
+        height = len(self)
+        segment, offset = 0, 0
+        if height:
+            segment, offset, length = self._location(height - 1)
+            offset += length
+            if offset + len(data) > self.segment_size:
+                segment, offset = segment + 1, 0
+        with open(self._segment_path(segment), 'ab') as segment_file:
+            segment_file.write(data)
+        record_offset = COUNT.size + HEIGHT_RECORD.size * height
+        if record_offset + HEIGHT_RECORD.size > len(self.heights):
+            self.heights = self._grow(self.heights_file, self.heights, 2 * len(self.heights))
+        HEIGHT_RECORD.pack_into(self.heights, record_offset, segment, offset, len(data))
+        COUNT.pack_into(self.heights, 0, height + 1)
+        self._index_hash(block.hash, height)
+        self._remember(height, block)
+
+    def pop(self):
+        # Remove and return the last block, e.g. when a reorg disconnects it
+        height = self._normalize(-1)
+        block = self[height]
+        segment, offset, _ = self._location(height)
+        reader = self.readers.pop(segment, None)
+        if reader is not None:
+            reader.close()
+        with open(self._segment_path(segment), 'r+b') as segment_file:
+            segment_file.truncate(offset)
+        if offset == 0 and segment > 0:
+            os.remove(self._segment_path(segment))
+        COUNT.pack_into(self.heights, 0, height)
+        self._unindex_hash(block.hash)
+        self.cache.pop(height, None)
+        return block
+
+    def pruned_height(self):
+        path = os.path.join(self.directory, 'pruned.idx')
+        if not os.path.exists(path):
+            return 0
+        with open(path, 'rb') as pruned_file:
+            return PRUNED_HEIGHT.unpack(pruned_file.read())[0]
+
+    def prune(self, height):
+        # Rewrite every segment that holds only blocks below `height` with just
+        # their headers. Returns the height below which bodies are now gone.
+        start = self.pruned_height()
+        if height <= start:
+            return start
+        runs = {}  # Key: segment, Value: heights stored there
+        for block_height in range(start, min(height, len(self))):
+            runs.setdefault(self._location(block_height)[0], []).append(block_height)
+        pruned = start
+        for segment, heights in sorted(runs.items()):
+            following = heights[-1] + 1
+            if following >= len(self) or self._location(following)[0] == segment:
+                break  # The segment also holds blocks that are kept
+            reader = self.readers.pop(segment, None)
+            if reader is not None:
+                reader.close()
+            temporary = self._segment_path(segment) + '.tmp'
+            offset = 0
+            with open(temporary, 'wb') as segment_file:
+                for block_height in heights:
+                    data = self[block_height].pruned().serialize()
+                    segment_file.write(data)
+                    HEIGHT_RECORD.pack_into(self.heights, COUNT.size + HEIGHT_RECORD.size * block_height,
+                                            segment, offset, len(data))
+                    offset += len(data)
+                    self.cache.pop(block_height, None)
+            os.replace(temporary, self._segment_path(segment))
+            pruned = following
+        self.heights.flush()
+        with open(os.path.join(self.directory, 'pruned.idx'), 'wb') as pruned_file:
+            pruned_file.write(PRUNED_HEIGHT.pack(pruned))
+        return pruned
+
+    def save_snapshot(self, data):
+        # Replaced atomically, so a crash leaves the previous snapshot in place
+        path = os.path.join(self.directory, 'snapshot.dat')
+        with open(path + '.tmp', 'wb') as snapshot_file:
+            snapshot_file.write(data)
+        os.replace(path + '.tmp', path)
+
+    def load_snapshot(self):
+        path = os.path.join(self.directory, 'snapshot.dat')
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as snapshot_file:
+            return snapshot_file.read()
+
+    def flush(self):
+        self.heights.flush()
+        self.hashes.flush()
+
+    def close(self):
+        self.flush()
+        for reader in self.readers.values():
+            reader.close()
+        self.heights.close()
+        self.hashes.close()
+        self.heights_file.close()
+        self.hashes_file.close()
+
+    def _open_index(self, name, initial_size):
+        path = os.path.join(self.directory, name)
+        if not os.path.exists(path):
+            with open(path, 'wb') as index_file:
+                index_file.truncate(initial_size)
+        index_file = open(path, 'r+b')
+        return index_file, mmap.mmap(index_file.fileno(), 0)
+
+    @staticmethod
+    def _grow(index_file, index_map, size):
+        index_map.close()
+        index_file.truncate(size)
+        return mmap.mmap(index_file.fileno(), 0)
+
+    def _normalize(self, height):
+        count = len(self)
+        if height < 0:
+            height += count
+        if not 0 <= height < count:
+            raise IndexError("block height out of range")
+        return height
+
+    def _location(self, height):
+        return HEIGHT_RECORD.unpack_from(self.heights, COUNT.size + HEIGHT_RECORD.size * height)
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, "blk{:05d}.dat".format(segment))
+
+    def _read(self, height, size=None):
+        segment, offset, length = self._location(height)
+        reader = self.readers.get(segment)
+        if reader is None:
+            reader = self.readers[segment] = open(self._segment_path(segment), 'rb')
+        reader.seek(offset)
+        return reader.read(length if size is None else size)
+
+    def _remember(self, height, block):
+        self.cache[height] = block
+        self.cache.move_to_end(height)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    @staticmethod
+    def _first_slot(block_hash, capacity):
+        key = bytes.fromhex(block_hash)
+        return int.from_bytes(key[:8], 'little') % capacity, key
+
+    @staticmethod
+    def _slot_offset(slot):
+        return HASH_TABLE_HEADER.size + HASH_SLOT.size * slot
+
+    def _index_hash(self, block_hash, height):
+        capacity, entries = HASH_TABLE_HEADER.unpack_from(self.hashes, 0)
+        if 2 * (entries + 1) > capacity:
+            self._rehash(2 * capacity)
+            capacity, entries = HASH_TABLE_HEADER.unpack_from(self.hashes, 0)
+        slot, key = self._first_slot(block_hash, capacity)
+        while HASH_SLOT.unpack_from(self.hashes, self._slot_offset(slot))[1] != 0:
+            slot = (slot + 1) % capacity
+        HASH_SLOT.pack_into(self.hashes, self._slot_offset(slot), key, height + 1)
+        HASH_TABLE_HEADER.pack_into(self.hashes, 0, capacity, entries + 1)
+
+    def _unindex_hash(self, block_hash):
+        # Linear-probing delete: later slots of the same probe run shift back
+        # into the gap, so lookups never stop early at it
+        capacity, entries = HASH_TABLE_HEADER.unpack_from(self.hashes, 0)
+        gap, key = self._first_slot(block_hash, capacity)
+        while True:
+            stored, height = HASH_SLOT.unpack_from(self.hashes, self._slot_offset(gap))
+            if height == 0:
+                return
+            if stored == key:
+                break
+            gap = (gap + 1) % capacity
+        slot = gap
+        while True:
+            slot = (slot + 1) % capacity
+            stored, height = HASH_SLOT.unpack_from(self.hashes, self._slot_offset(slot))
+            if height == 0:
+                break
+            home, _ = self._first_slot(stored.hex(), capacity)
+            # Move the entry back unless its home lies cyclically in (gap, slot]
+            if (gap < slot and (home <= gap or home > slot)) or (slot < gap and slot < home <= gap):
+                HASH_SLOT.pack_into(self.hashes, self._slot_offset(gap), stored, height)
+                gap = slot
+        HASH_SLOT.pack_into(self.hashes, self._slot_offset(gap), bytes(32), 0)
+        HASH_TABLE_HEADER.pack_into(self.hashes, 0, capacity, entries - 1)
+
+    def _rehash(self, capacity):
+        old_capacity, _ = HASH_TABLE_HEADER.unpack_from(self.hashes, 0)
+        occupied = [HASH_SLOT.unpack_from(self.hashes, self._slot_offset(slot)) for slot in range(old_capacity)]
+        self.hashes = self._grow(self.hashes_file, self.hashes, self._slot_offset(capacity))
+        self.hashes[HASH_TABLE_HEADER.size:] = bytes(len(self.hashes) - HASH_TABLE_HEADER.size)
+        HASH_TABLE_HEADER.pack_into(self.hashes, 0, capacity, 0)
+        for key, height in occupied:
+            if height:
+                self._index_hash(key.hex(), height - 1)
@@ -0,0 +1,128 @@
+import heapq
+import itertools
+from constants import MAX_BLOCK_SIZE, MAX_TRANSACTIONS_PER_BLOCK
+
+# Where an entry is: in the template, waiting as a candidate, or parked as too large for the space left
+IN_TEMPLATE = 0
+WAITING = 1
+PARKED = 2
+
+
+class BlockTemplate:
+    # The best candidate transaction set for the next block, kept current as
+    # transactions enter and leave the mempool. Transactions are ranked by fee
+    # density (fee per serialized byte) and taken in that order while they fit
+    # the size and count budgets; one too large for the space left is parked
+    # until enough space frees up, so it does not hold back smaller ones. The
+    # template's worst entry, the best waiting candidate and the smallest
+    # parked one sit on top of three heaps, so each mempool change moves only
+    # a few entries between them.
+    def __init__(self, max_size=MAX_BLOCK_SIZE, max_count=MAX_TRANSACTIONS_PER_BLOCK):
+        self.max_size = max_size
+        self.max_count = max_count
+        self.entries = {}  # Key: id(transaction), Value: [density, seq, size, transaction, place, token]
+        self.template = []  # Heap of (density, -seq, token, id): worst member first
+        self.candidates = []  # Heap of (-density, seq, token, id): best waiting transaction first
+        self.parked = []  # Heap of (size, seq, token, id): smallest parked transaction first
+        self.members = {}  # Key: id(transaction), Value: transaction, for those in the template
+        self.size = 0
+        self._seq = itertools.count()
+        self._token = itertools.count()
+
+    @property
+    def count(self):
+        return len(self.members)
+
+    def __len__(self):
+        return len(self.members)
+
+    def transactions(self):
+        return list(self.members.values())
+
+    def add(self, transaction):
+        size = len(transaction.serialize())
+        if size > self.max_size:
+            print("Transaction too large for a block!")
+            return
+        entry = [transaction.fee / size, next(self._seq), size, transaction, WAITING, None]
+        self.entries[id(transaction)] = entry
+        best = self._peek(self.candidates)
+        if best is not None and (-best[0], best[1]) > (entry[0], -entry[1]):
+            self._push_candidate(entry)
+            return
+        self._push_template(entry)
+        self._shrink()
+        self._fill()
+        self._compact_if_stale()
+
+    def remove(self, transaction):
+        entry = self.entries.pop(id(transaction), None)
+        if entry is None:
+            return
+        entry[5] = None  # Invalidates its heap entry
+        if entry[4] == IN_TEMPLATE:
+            self.size -= entry[2]
+            del self.members[id(transaction)]
+            self._fill()
+        self._compact_if_stale()
+
+    def _shrink(self):
+        while self.count > self.max_count or self.size > self.max_size:
+            worst = self._peek(self.template)
+            entry = self.entries[worst[3]]
+            self.size -= entry[2]
+            del self.members[worst[3]]
+            self._push_candidate(entry)
+
+    def _fill(self):
+        self._unpark()
+        while self.count < self.max_count:
+            best = self._peek(self.candidates)
+            if best is None:
+                return
+            entry = self.entries[best[3]]
+            if self.size + entry[2] <= self.max_size:
+                self._push_template(entry)
+            else:
+                self._park(entry)
+
+    def _unpark(self):
+        # Parked transactions that fit the space left become candidates again
+        while True:
+            smallest = self._peek(self.parked)
+            if smallest is None or self.size + smallest[0] > self.max_size:
+                return
+            self._push_candidate(self.entries[smallest[3]])
+
+    def _push_template(self, entry):
+        entry[4], entry[5] = IN_TEMPLATE, next(self._token)
+        self.size += entry[2]
+        self.members[id(entry[3])] = entry[3]
+        heapq.heappush(self.template, (entry[0], -entry[1], entry[5], id(entry[3])))
+
+    def _push_candidate(self, entry):
+        entry[4], entry[5] = WAITING, next(self._token)
+        heapq.heappush(self.candidates, (-entry[0], entry[1], entry[5], id(entry[3])))
+
+    def _park(self, entry):
+        entry[4], entry[5] = PARKED, next(self._token)
+        heapq.heappush(self.parked, (entry[2], entry[1], entry[5], id(entry[3])))
+
+    def _peek(self, heap):
+        # Top live item of a heap, discarding stale ones
+        while heap:
+            entry = self.entries.get(heap[0][3])
+            if entry is not None and entry[5] == heap[0][2]:
+                return heap[0]
+            heapq.heappop(heap)
+        return None
+
+    def _compact_if_stale(self):
+        if len(self.template) + len(self.candidates) + len(self.parked) <= 2 * len(self.entries) + 64:
+            return
+        self.template = [(e[0], -e[1], e[5], key) for key, e in self.entries.items() if e[4] == IN_TEMPLATE]
+        self.candidates = [(-e[0], e[1], e[5], key) for key, e in self.entries.items() if e[4] == WAITING]
+        self.parked = [(e[2], e[1], e[5], key) for key, e in self.entries.items() if e[4] == PARKED]
+        heapq.heapify(self.template)
+        heapq.heapify(self.candidates)
+        heapq.heapify(self.parked)
@@ -0,0 +1,102 @@
+from collections import deque
+from constants import DIFFICULTY, MAX_REORG_DEPTH
+
+
+class BlockNode:
+    def __init__(self, block_hash, parent, height, work, block):
+        self.hash = block_hash
+        self.parent = parent
+        self.height = height
+        self.work = work  # Cumulative work from genesis up to and including this block
+        self.block = block  # Kept only while the block is off the main chain
+        self.undo = None  # Contract state changes to revert when disconnecting
+        self.children = []  # Nodes built on this one, on any branch
+
+
+class BlockTree:
+    # Every known block by hash, on the main chain or a side branch. The main
+    # chain ends at tip; the most recent MAX_REORG_DEPTH connected blocks keep
+    # their undo records, so switching to a heavier branch costs O(depth).
+    def __init__(self, block_work=16 ** DIFFICULTY, max_reorg_depth=MAX_REORG_DEPTH):
+        self.block_work = block_work  # Expected hashes to find one block
+        self.max_reorg_depth = max_reorg_depth
+        self.nodes = {}  # Key: block hash, Value: BlockNode
+        self.tip = None
+        self.recent = deque()  # Connected nodes that still hold undo records
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, block_hash):
+        return block_hash in self.nodes
+
+    def get(self, block_hash):
+        return self.nodes.get(block_hash)
+
+    def add(self, block, height=0):
+        # Returns the new node, or None for a duplicate or a block whose parent is
+        # unknown. The first block added is the root, at `height`: genesis, or
+        # the block of the snapshot a node started from.
+        if block.hash in self.nodes:
+            return None
+        parent = self.nodes.get(block.previous_hash)
+        if parent is None and self.nodes:
+            return None
+        if parent is not None:
+            height = parent.height + 1
+        work = (parent.work if parent else height * self.block_work) + self.block_work
+        node = self.nodes[block.hash] = BlockNode(block.hash, parent, height, work, block)
+        if parent is not None:
+            parent.children.append(node)
+        return node
+
+    def remove(self, node):
+        # Forget an off-chain block found invalid, with every block built on it
+        if node.parent is not None:
+            node.parent.children.remove(node)
+        stack = [node]
+        while stack:
+            removed = stack.pop()
+            del self.nodes[removed.hash]
+            stack.extend(removed.children)
+
+    def connected(self, node, undo):
+        node.block = None
+        node.undo = undo
+        self.tip = node
+        self.recent.append(node)
+        if len(self.recent) > self.max_reorg_depth:
+            self.recent.popleft().undo = None
+
+    def disconnected(self, block):
+        node = self.tip
+        undo = node.undo
+        node.block = block
+        node.undo = None
+        self.tip = node.parent
+        if self.recent and self.recent[-1] is node:
+            self.recent.pop()
+        return undo
+
+    def can_undo(self, depth):
+        return depth <= len(self.recent)
+
+    @staticmethod
+    def fork_point(a, b):
+        while a.height > b.height:
+            a = a.parent
+        while b.height > a.height:
+            b = b.parent
+        while a is not b:
+            a, b = a.parent, b.parent
+        return a
+
+    @staticmethod
+    def branch(ancestor, node):
+        # Nodes after ancestor up to and including node, oldest first
+        nodes = []
+        while node is not ancestor:
+            nodes.append(node)
+            node = node.parent
+        nodes.reverse()
+        return nodes
@@ -1,56 +1,223 @@
 import time
+import struct
+import hashlib
 from wallet import Wallet
+from address import to_address
+from encoding import pack_number, pack_json, pack_optional_bytes
+from revocation import RevocationStore
 from constants import TIME_LOCK_PERIOD
 
+# Layout version and state number at the start of a signed channel state
+STATE_HEADER = struct.Struct('<BQ')
+STATE_VERSION = 1
+
+
+def channel_id(party1, party2):
+    # Same id whichever way round the parties are given
+    first, second = sorted((to_address(party1), to_address(party2)))
+    return hashlib.sha256(first + second).hexdigest()
+
+
+class ChannelState:
+    # One numbered state of a channel, signed by both parties: the coin balances,
+    # the net change per asset for each party, and each party's revocation hash.
+    # Revealing the secret behind a revocation hash gives that state up.
+    def __init__(self, channel_id, number, balance1, balance2, balances1, balances2,
+                 revocation_hash1=None, revocation_hash2=None):
+        self.channel_id = channel_id
+        self.number = number
+        self.balance1 = balance1
+        self.balance2 = balance2
+        self.balances1 = balances1
+        self.balances2 = balances2
+        self.revocation_hash1 = revocation_hash1
+        self.revocation_hash2 = revocation_hash2
+
+    def payload(self):
+        # Canonical bytes both parties sign
+        return b''.join([
+            STATE_HEADER.pack(STATE_VERSION, self.number),
+            bytes.fromhex(self.channel_id),
+            pack_number(self.balance1),
+            pack_number(self.balance2),
+            pack_json(self.balances1),
+            pack_json(self.balances2),
+            pack_optional_bytes(self.revocation_hash1),
+            pack_optional_bytes(self.revocation_hash2),
+        ])
+
+    def signing_payload(self):
+        return self.payload()
+
+    def next(self, transfers, revocation_hash1, revocation_hash2):
+        # The following state after a batch of (asset, amount) payments from
+        # party1 to party2 (negative amounts flow back); asset None is the coin.
+        # Returns None if a coin balance would go negative or a revocation hash
+        # is missing, since a state that cannot be revoked could be closed on later.
+        if revocation_hash1 is None or revocation_hash2 is None:
+            print("Channel states need both revocation hashes!")
+            return None
+        balance1, balance2 = self.balance1, self.balance2
+        balances1, balances2 = dict(self.balances1), dict(self.balances2)
+        for asset, amount in transfers:
+            if asset is None:
+                balance1 -= amount
+                balance2 += amount
+            else:
+                balances1[asset] = balances1.get(asset, 0) - amount
+                balances2[asset] = balances2.get(asset, 0) + amount
+        if balance1 < 0 or balance2 < 0:
+            return None
+        return ChannelState(self.channel_id, self.number + 1, balance1, balance2, balances1, balances2,
+                            revocation_hash1, revocation_hash2)
+
 
 class Channel:
     def __init__(self, party1, party2, deposit1, deposit2):
+        self.id = channel_id(party1, party2)
         self.party1 = party1
         self.party2 = party2
-        self.balances1 = {}
-        self.balances2 = {}
-        self.balance1 = deposit1
-        self.balance2 = deposit2
         self.open = True
-        self.commitment_transactions = []
         self.close_requested = False
         self.close_request_time = None
+        self.close_requester = None # 1 or 2: the party whose close request is pending
+        self.cheater = None # 1 or 2: a party caught closing on a revoked state
+        self.listeners = [] # Callbacks taking (channel, event), fired on lifecycle changes
+        # Only the latest state and its signatures are kept; earlier states are
+        # covered by the revocation secrets, stored in O(log n) space
+        self.signatures = (None, None)
+        self.revocations1 = RevocationStore() # Secrets revealed by party1
+        self.revocations2 = RevocationStore() # Secrets revealed by party2
+        self.adopt(ChannelState(self.id, 0, deposit1, deposit2, {}, {}))
+
+    def adopt(self, state, signatures=(None, None)):
+        self.state = state
+        self.signatures = signatures
+        self.balance1 = state.balance1
+        self.balance2 = state.balance2
+        self.balances1 = state.balances1
+        self.balances2 = state.balances2
+        self.last_transaction_index = state.number # Number of the latest signed state
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def notify_listeners(self, event):
+        for listener in self.listeners:
+            listener(self, event)
 
-    def update(self, asset, amount, signature1, signature2):
+    def propose(self, transfers, revocation_hash1, revocation_hash2):
+        # The next state for a batch of (asset, amount) payments; both parties sign
+        # its payload. Any number of payments costs one state and one signature each.
+        return self.state.next(transfers, revocation_hash1, revocation_hash2)
+
+    def check(self, state, secrets=None):
+        # Everything about a proposed state except its signatures. The parties
+        # give up the current state by revealing its revocation secrets.
         if not self.open:
             print("Channel is closed!")
-            return
-        # Verify signatures
-        if not Wallet.verify_signature(self.party1, signature1, str(amount)) or not Wallet.verify_signature(self.party2, signature2, str(amount)):
+            return False
+        if state is None or state.channel_id != self.id or state.number != self.state.number + 1:
+            print("Invalid channel state!")
+            return False
+        if state.revocation_hash1 is None or state.revocation_hash2 is None:
+            print("Channel states need both revocation hashes!")
+            return False
+        current = self.state
+        for revocation_hash, store, secret in ((current.revocation_hash1, self.revocations1, secrets and secrets[0]),
+                                               (current.revocation_hash2, self.revocations2, secrets and secrets[1])):
+            if revocation_hash is None:
+                continue
+            if secret is None or hashlib.sha256(secret).digest() != revocation_hash or not store.consistent(current.number, secret):
+                print("Invalid revocation secret!")
+                return False
+        return True
+
+    def commit(self, state, signature1, signature2, secrets=None, verified=False):
+        # Move to a state both parties signed. verified=True skips the signature
+        # checks for callers that verified a whole batch already.
+        if not self.check(state, secrets):
+            return False
+        if not verified and not all(Wallet.verify_signatures([(self.party1, signature1, state.payload()),
+                                                              (self.party2, signature2, state.payload())])):
             print("Invalid signatures!")
-            return
-        self.balance1 -= amount
-        self.balance2 += amount
-        # Store the commitment transaction
-        self.commitment_transactions.append((amount, signature1, signature2))
-        self.balances1[asset] -= amount
-        self.balances2[asset] += amount
+            return False
+        # Only the first state has no revocation hashes, so none to reveal
+        if self.state.number > 0 and not (self.revocations1.insert(self.state.number, secrets[0]) and
+                                          self.revocations2.insert(self.state.number, secrets[1])):
+            print("Invalid revocation secret!")
+            return False
+        self.adopt(state, (signature1, signature2))
+        return True
+
+    def update(self, asset, amount, signature1, signature2, secrets, revocation_hashes):
+        # A single payment; see propose and commit for batches. secrets revoke the
+        # current state (None for the first one); revocation_hashes are the new state's.
+        return self.commit(self.propose([(asset, amount)], *revocation_hashes), signature1, signature2, secrets)
+
+    def is_revoked(self, number):
+        # True once both parties revealed the secrets of state `number`
+        return self.revocations1.secret(number) is not None and self.revocations2.secret(number) is not None
+
+    def party_number(self, party):
+        # 1 or 2 for one of the channel's parties, otherwise None
+        address = to_address(party)
+        if address == to_address(self.party1):
+            return 1
+        if address == to_address(self.party2):
+            return 2
+        return None
+
+    def revealed_secret(self, party, number):
+        # The secret party 1 or 2 revealed to revoke state `number`, or None
+        store = {1: self.revocations1, 2: self.revocations2}.get(party)
+        return None if store is None else store.secret(number)
 
     def close(self, transaction_index=None):
+        # Closes on the latest state; returns False for an older (revoked) one
+        if transaction_index is not None and transaction_index < self.state.number:
+            if self.is_revoked(transaction_index):
+                print(f"State {transaction_index} was revoked!")
+            else:
+                print(f"State {transaction_index} is not the latest!")
+            return False
         self.open = False
-        # If a specific transaction index is provided, close with that state
-        if transaction_index and transaction_index < len(self.commitment_transactions):
-            amount, _, _ = self.commitment_transactions[transaction_index]
-            self.balance1 -= amount
-            self.balance2 += amount
-        # Logic to settle the final balances on the main chain can be added here
-
-    def request_close(self, transaction_index=None):
+        self.notify_listeners("close")
+        return True
+
+    def request_close(self, transaction_index=None, requester=None):
+        # Start the time lock on closing at state transaction_index (the latest by
+        # default), as claimed by requester; the other party may challenge it
         self.close_requested = True
         self.close_request_time = time.time()
+        self.last_transaction_index = self.state.number if transaction_index is None else transaction_index
+        self.close_requester = None if requester is None else self.party_number(requester)
+        self.notify_listeners("request_close")
 
     def finalize_close(self):
         if self.close_requested and (time.time() - self.close_request_time) > TIME_LOCK_PERIOD:
-            self.close()  # This is the existing close method
-        else:
-            print("Close request time lock not yet expired.")
+            return self.close(self.last_transaction_index)
+        print("Close request time lock not yet expired.")
+        return False
 
     def challenge_close(self, newer_transaction_index):
-        if newer_transaction_index > self.last_transaction_index:
-            self.last_transaction_index = newer_transaction_index
-            self.close_request_time = time.time()  # Reset the timer
\ No newline at end of file
+        # Answer a pending close with a newer state. If the requester already
+        # revealed its secret for the state it claimed, it closed on a state it
+        # had revoked: a breach, and its coin balance goes to the other party.
+        if not self.close_requested or not self.last_transaction_index < newer_transaction_index <= self.state.number:
+            print("Nothing to challenge!")
+            return False
+        claimed = self.last_transaction_index
+        self.last_transaction_index = newer_transaction_index
+        self.close_request_time = time.time()  # Reset the timer
+        if self.revealed_secret(self.close_requester, claimed) is not None:
+            self.penalize(self.close_requester)
+        self.notify_listeners("challenge_close")
+        return True
+
+    def penalize(self, cheater):
+        self.cheater = cheater
+        if cheater == 1:
+            self.balance1, self.balance2 = 0, self.balance1 + self.balance2
+        else:
+            self.balance1, self.balance2 = self.balance1 + self.balance2, 0
\ No newline at end of file
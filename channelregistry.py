@@ -0,0 +1,48 @@
+from address import to_address
+from channel import channel_id
+
+
+class ChannelRegistry:
+    # Channels keyed by their order-independent party-pair id, with secondary
+    # indexes by party and by lifecycle state. The state indexes follow each
+    # channel through its lifecycle events.
+    def __init__(self):
+        self.channels = {}  # Key: channel id, Value: channel
+        self.by_party = {}  # Key: address, Value: set of channel ids
+        self.open_ids = set()
+        self.close_requested_ids = set()
+
+    def __len__(self):
+        return len(self.channels)
+
+    def __iter__(self):
+        return iter(list(self.channels.values()))
+
+    def add(self, channel):
+        self.channels[channel.id] = channel
+        for party in (channel.party1, channel.party2):
+            self.by_party.setdefault(to_address(party), set()).add(channel.id)
+        channel.add_listener(lambda changed, event: self.refresh(changed))
+        self.refresh(channel)
+
+    def find(self, party1, party2):
+        return self.channels.get(channel_id(party1, party2))
+
+    def channels_of(self, party):
+        return [self.channels[cid] for cid in self.by_party.get(to_address(party), ())]
+
+    def open_channels(self):
+        return [self.channels[cid] for cid in self.open_ids]
+
+    def close_requested_channels(self):
+        return [self.channels[cid] for cid in self.close_requested_ids]
+
+    def refresh(self, channel):
+        if channel.open:
+            self.open_ids.add(channel.id)
+        else:
+            self.open_ids.discard(channel.id)
+        if channel.open and channel.close_requested:
+            self.close_requested_ids.add(channel.id)
+        else:
+            self.close_requested_ids.discard(channel.id)
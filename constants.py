@@ -10,4 +10,93 @@ MAX_TRANSACTIONS_PER_BLOCK = 10
 MINING_REWARD = 50
 
 # Time lock period in seconds (e.g., 24 hours)
-TIME_LOCK_PERIOD = 86400
\ No newline at end of file
+TIME_LOCK_PERIOD = 86400
+
+# Number of processes used to search for a Proof-of-Work nonce (1 mines serially)
+MINING_WORKERS = 1
+
+# Maximum number of pending transactions; the lowest-fee ones are evicted beyond it
+MAX_MEMPOOL_TRANSACTIONS = 100000
+
+# Number of verified signatures remembered so relayed transactions skip the EC math
+SIGNATURE_CACHE_SIZE = 100000
+
+# Number of processes used to verify a batch of signatures (1 verifies in-process)
+SIGNATURE_WORKERS = 1
+
+# Size in bytes after which the block store starts a new segment file
+SEGMENT_SIZE = 128 * 1024 * 1024
+
+# Number of decoded blocks the block store keeps in memory
+BLOCK_CACHE_SIZE = 256
+
+# Number of processes used to validate a range of blocks (1 validates in-process)
+VALIDATION_WORKERS = 1
+
+# Blocks handed to a validation worker at a time
+VALIDATION_BATCH_SIZE = 256
+
+# SMTP settings for watchtower notifications
+SMTP_HOST = 'smtp.example.com'
+SMTP_PORT = 587
+SMTP_USERNAME = 'watchtower@example.com'
+SMTP_PASSWORD = 'password'  # Use your SMTP server credentials
+NOTIFICATION_SENDER = 'watchtower@example.com'
+NOTIFICATION_RECIPIENT = 'user@example.com'  # This should be the user's email address
+
+# Notifications sent per SMTP session, and delivery attempts before one is dropped
+NOTIFICATION_BATCH_SIZE = 20
+NOTIFICATION_MAX_ATTEMPTS = 5
+
+# First retry delay in seconds (doubles after each failure), and how long an idle SMTP connection is kept
+NOTIFICATION_RETRY_DELAY = 1
+SMTP_IDLE_TIMEOUT = 30
+
+# Outgoing messages queued per peer before the node stops reading from that peer
+PEER_QUEUE_SIZE = 256
+
+# Recently relayed transactions and blocks kept in serialized form to answer peers
+RELAY_CACHE_SIZE = 10000
+
+# Inventory ids remembered as already received, and seconds before an unanswered request may go to another peer
+SEEN_CACHE_SIZE = 100000
+REQUEST_TIMEOUT = 30
+
+# Inventory ids remembered per peer as already known to it, so they are not announced back
+PEER_KNOWN_SIZE = 10000
+
+# Threads fetching and checking block bodies during sync, bodies fetched ahead of the
+# one being appended, and headers requested at a time
+SYNC_WORKERS = 4
+SYNC_WINDOW = 16
+SYNC_HEADER_BATCH = 2000
+
+# Threads executing independent groups of a block's transactions (1 executes in order)
+EXECUTION_WORKERS = 1
+
+# Maximum serialized size in bytes of a block's transactions
+MAX_BLOCK_SIZE = 1000000
+
+# Gas charged for each contract method call and each contract state write
+GAS_PER_CALL = 1000
+GAS_PER_WRITE = 5000
+
+# Gas available to one contract transaction, and reserved per contract transaction within a block
+TX_GAS_LIMIT = 100000
+BLOCK_GAS_LIMIT = 500000
+
+# Contract method name whose arguments are a list of [method, args] calls to run in one transaction
+BATCH_METHOD = "batch"
+
+# Most recent blocks that keep undo records; a competing branch forking deeper is not adopted
+MAX_REORG_DEPTH = 100
+
+# Blocks between state snapshots (0 takes none), and recent blocks kept with their bodies (0 keeps all)
+SNAPSHOT_INTERVAL = 1000
+PRUNE_DEPTH = 0
+
+# Entries returned per page of an address history query
+HISTORY_PAGE_SIZE = 100
+
+# Distinct addresses interned before the table is emptied and starts over
+INTERNED_ADDRESS_LIMIT = 100000
@@ -0,0 +1,188 @@
+import threading
+from constants import GAS_PER_WRITE
+
+MISSING = object()  # Marks a key that did not exist before a write
+KEY_TYPES = (str, int, float, bool, type(None))  # Keys a snapshot can encode (JSON scalars)
+
+
+class StateJournal:
+    # Undo log shared by all contract state. While a checkpoint is open every
+    # write records the value it replaced, so reverting or committing costs only
+    # the number of changes. Open snapshots are given the old value on the first
+    # write to each key (copy-on-write), so they keep reading the state as it was.
+    def __init__(self):
+        self.entries = []  # (mapping, key, old value) for each write since the first checkpoint
+        self.checkpoints = []  # Journal lengths at each open checkpoint
+        self.snapshots = []  # Open StateSnapshot objects
+        self.lock = threading.RLock()
+        self.local = threading.local()  # GasMeter of the contract transaction running on this thread
+
+    def write(self, mapping, key, value):
+        meter = getattr(self.local, "meter", None)
+        if meter is not None:
+            meter.charge(GAS_PER_WRITE)
+        with self.lock:
+            old = mapping.data.get(key, MISSING)
+            if meter is not None:
+                meter.changes.append((mapping, key, old))
+            if self.checkpoints:
+                self.entries.append((mapping, key, old))
+            for snapshot in self.snapshots:
+                snapshot.preserve(mapping, key, old)
+            if value is MISSING:
+                mapping.data.pop(key, None)
+            else:
+                mapping.data[key] = value
+
+    def meter(self, meter):
+        # Charge this thread's state writes to meter (None stops metering)
+        self.local.meter = meter
+
+    def undo(self, changes):
+        # Restore the values overwritten by changes, e.g. those of a failed transaction
+        self.meter(None)
+        for mapping, key, old in reversed(changes):
+            self.write(mapping, key, old)
+
+    def checkpoint(self):
+        with self.lock:
+            self.checkpoints.append(len(self.entries))
+            return len(self.checkpoints)
+
+    def revert(self):
+        # Undo every write since the latest checkpoint, newest first
+        with self.lock:
+            start = self.checkpoints.pop()
+            while len(self.entries) > start:
+                mapping, key, old = self.entries.pop()
+                for snapshot in self.snapshots:
+                    snapshot.preserve(mapping, key, mapping.data.get(key, MISSING))
+                if old is MISSING:
+                    mapping.data.pop(key, None)
+                else:
+                    mapping.data[key] = old
+
+    def commit(self):
+        # Keep the writes since the latest checkpoint. Returns them as
+        # (mapping, key, old value) undo records.
+        with self.lock:
+            start = self.checkpoints.pop()
+            changes = self.entries[start:]
+            if not self.checkpoints:
+                self.entries = []
+            return changes
+
+    def snapshot(self):
+        with self.lock:
+            snapshot = StateSnapshot(self)
+            self.snapshots.append(snapshot)
+            return snapshot
+
+    def release(self, snapshot):
+        with self.lock:
+            if snapshot in self.snapshots:
+                self.snapshots.remove(snapshot)
+
+
+class StateSnapshot:
+    # Read-only view of the state at the moment it was taken
+    def __init__(self, journal):
+        self.journal = journal
+        self.saved = {}  # Key: (mapping, key), Value: value when the snapshot was taken
+
+    def preserve(self, mapping, key, old):
+        self.saved.setdefault((mapping, key), old)
+
+    def get(self, mapping, key, default=None):
+        with self.journal.lock:
+            value = self.saved.get((mapping, key), MISSING)
+            if value is MISSING and (mapping, key) not in self.saved:
+                value = mapping.data.get(key, MISSING)
+        return default if value is MISSING else value
+
+    def get_value(self, store, address, key, default=None):
+        contract = self.get(store, address)
+        if contract is None:
+            return default
+        return self.get(contract.state, key, default)
+
+    def close(self):
+        self.journal.release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ContractState:
+    # A contract's key/value storage. Behaves like a dict; once the contract is
+    # deployed its writes go through the chain's StateJournal.
+    def __init__(self, journal=None):
+        self.journal = journal
+        self.data = {}
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        # Raising here fails the contract call that made the write, which is undone
+        if not isinstance(key, KEY_TYPES):
+            raise TypeError(f"Unsupported contract state key {key!r}")
+        if self.journal is None:
+            self.data[key] = value
+        else:
+            self.journal.write(self, key, value)
+
+    def __delitem__(self, key):
+        if key not in self.data:
+            raise KeyError(key)
+        if self.journal is None:
+            del self.data[key]
+        else:
+            self.journal.write(self, key, MISSING)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def keys(self):
+        return self.data.keys()
+
+    def values(self):
+        return self.data.values()
+
+    def items(self):
+        return self.data.items()
+
+
+class ContractStore(ContractState):
+    # Blockchain.contracts: deployed contracts by address, with deployments and
+    # all contract state writes journaled together
+    def __init__(self):
+        super().__init__(StateJournal())
+
+    def __setitem__(self, address, contract):
+        contract.state.journal = self.journal
+        super().__setitem__(address, contract)
+
+    def checkpoint(self):
+        return self.journal.checkpoint()
+
+    def revert(self):
+        self.journal.revert()
+
+    def commit(self):
+        return self.journal.commit()
+
+    def snapshot(self):
+        return self.journal.snapshot()
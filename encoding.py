@@ -0,0 +1,85 @@
+import json
+import struct
+
+from address import to_address
+
+# Type tags for numeric fields, so integer amounts stay integers
+INT_TAG = b'i'
+FLOAT_TAG = b'f'
+
+LENGTH = struct.Struct('<I')
+INT = struct.Struct('<q')
+FLOAT = struct.Struct('<d')
+
+
+def pack_bytes(data):
+    return LENGTH.pack(len(data)) + data
+
+
+def pack_address(party):
+    return pack_bytes(to_address(party))
+
+
+def pack_number(value):
+    if isinstance(value, int):
+        return INT_TAG + INT.pack(value)
+    return FLOAT_TAG + FLOAT.pack(value)
+
+
+def pack_optional_text(text):
+    if text is None:
+        return b'\x00'
+    return b'\x01' + pack_bytes(text.encode())
+
+
+def pack_json(value):
+    return pack_bytes(json.dumps(value, separators=(',', ':'), sort_keys=True).encode())
+
+
+def pack_optional_bytes(data):
+    if data is None:
+        return b'\x00'
+    return b'\x01' + pack_bytes(data)
+
+
+# Each unpack_* reads one field at `offset` of a bytes-like object and returns
+# (value, next offset). Fields are read in place through a memoryview; only the
+# values handed back are materialized.
+
+def unpack_view(data, offset):
+    (length,) = LENGTH.unpack_from(data, offset)
+    offset += LENGTH.size
+    return memoryview(data)[offset:offset + length], offset + length
+
+
+def unpack_bytes(data, offset):
+    view, offset = unpack_view(data, offset)
+    return bytes(view), offset
+
+
+def unpack_text(data, offset):
+    view, offset = unpack_view(data, offset)
+    return str(view, 'utf-8'), offset
+
+
+def unpack_number(data, offset):
+    if data[offset] == INT_TAG[0]:
+        return INT.unpack_from(data, offset + 1)[0], offset + 1 + INT.size
+    return FLOAT.unpack_from(data, offset + 1)[0], offset + 1 + FLOAT.size
+
+
+def unpack_optional_bytes(data, offset):
+    if data[offset] == 0:
+        return None, offset + 1
+    return unpack_bytes(data, offset + 1)
+
+
+def unpack_optional_text(data, offset):
+    if data[offset] == 0:
+        return None, offset + 1
+    return unpack_text(data, offset + 1)
+
+
+def unpack_json(data, offset):
+    text, offset = unpack_text(data, offset)
+    return json.loads(text), offset
@@ -0,0 +1,149 @@
+from concurrent.futures import ThreadPoolExecutor
+from constants import EXECUTION_WORKERS, GAS_PER_CALL, TX_GAS_LIMIT, BLOCK_GAS_LIMIT, BATCH_METHOD
+from gas import GasMeter, OutOfGas
+
+
+class BlockExecutor:
+    # Executes the transactions chosen for a block. Transactions are grouped by
+    # the accounts and contracts they touch, merging any groups that share one,
+    # so conflicting transactions always land in the same group and run there in
+    # block order. Independent groups run concurrently, each against the
+    # confirmed balances plus its own running deltas, which gives the same
+    # outcome as executing the whole list serially.
+    def __init__(self, blockchain, workers=EXECUTION_WORKERS):
+        self.blockchain = blockchain
+        self.workers = workers
+
+    def execute(self, transactions, underfunded=None):
+        # Returns the transactions that executed successfully, in their original
+        # order. Those rejected only for lack of funds are appended to underfunded.
+        groups = self.group(transactions)
+        if self.workers > 1 and len(groups) > 1:
+            with ThreadPoolExecutor(self.workers) as pool:
+                outcomes = list(pool.map(self._run_group, groups))
+        else:
+            outcomes = [self._run_group(group) for group in groups]
+        accepted = sorted(index for outcome, _ in outcomes for index in outcome)
+        if underfunded is not None:
+            underfunded.extend(transactions[index] for index in sorted(index for _, outcome in outcomes for index in outcome))
+        return [transactions[index] for index in accepted]
+
+    def within_gas_budget(self, transactions, block_gas_limit=BLOCK_GAS_LIMIT):
+        # Every contract transaction reserves TX_GAS_LIMIT, so the calls and state
+        # writes of a block are bounded up front. Gas does not meter computation
+        # inside a method; contracts are code deployed by the node operator.
+        # Returns (admitted, deferred) in order.
+        admitted = []
+        deferred = []
+        reserved = 0
+        for transaction in transactions:
+            if transaction.tx_type == "contract":
+                if reserved + TX_GAS_LIMIT > block_gas_limit:
+                    deferred.append(transaction)
+                    continue
+                reserved += TX_GAS_LIMIT
+            admitted.append(transaction)
+        return admitted, deferred
+
+    def group(self, transactions):
+        # Union-find over access keys; returns lists of (index, transaction)
+        parent = {}
+
+        def find(key):
+            while parent[key] != key:
+                parent[key] = parent[parent[key]]
+                key = parent[key]
+            return key
+
+        first_keys = []
+        for transaction in transactions:
+            keys = self.access_keys(transaction)
+            for key in keys:
+                parent.setdefault(key, key)
+            for key in keys[1:]:
+                parent[find(key)] = find(keys[0])
+            first_keys.append(keys[0])
+        groups = {}
+        for index, (transaction, key) in enumerate(zip(transactions, first_keys)):
+            groups.setdefault(find(key), []).append((index, transaction))
+        return list(groups.values())
+
+    @staticmethod
+    def access_keys(transaction):
+        # Rewards are minted, so the "Network" sender's balance is never read
+        keys = [("account", transaction.recipient)]
+        if transaction.tx_type != "reward":
+            keys.append(("account", transaction.sender))
+        if transaction.tx_type == "contract" and transaction.contract_address:
+            keys.append(("contract", transaction.contract_address))
+        return keys
+
+    def _run_group(self, group):
+        confirmed = self.blockchain.ledger.confirmed
+        deltas = {}
+        accepted = []
+        underfunded = []
+        for index, transaction in group:
+            if transaction.tx_type != "reward":
+                balance = confirmed.get(transaction.sender, 0) + deltas.get(transaction.sender, 0)
+                if balance < transaction.amount:
+                    print("Insufficient funds!")
+                    underfunded.append(index)
+                    continue
+            if transaction.tx_type == "contract":
+                contract = self.blockchain.contracts.get(transaction.contract_address)
+                if not contract or not transaction.contract_method:
+                    print("Contract not found!")
+                    continue
+                if not self.call_contract(contract, transaction):
+                    continue
+            deltas[transaction.sender] = deltas.get(transaction.sender, 0) - transaction.amount
+            deltas[transaction.recipient] = deltas.get(transaction.recipient, 0) + transaction.amount
+            accepted.append(index)
+        return accepted, underfunded
+
+    @staticmethod
+    def contract_calls(transaction):
+        # The [method, args] calls of a contract transaction, or None if they are malformed
+        if transaction.contract_method == BATCH_METHOD:
+            calls = transaction.contract_args
+        else:
+            calls = [[transaction.contract_method, transaction.contract_args]]
+        if not isinstance(calls, list):
+            return None
+        for call in calls:
+            if not isinstance(call, (list, tuple)) or len(call) != 2:
+                return None
+            method, args = call
+            if not isinstance(method, str) or not isinstance(args, list):
+                return None
+        return calls
+
+    def call_contract(self, contract, transaction):
+        # Runs one contract transaction (a single call, or a batch of [method, args]
+        # calls) under a GasMeter. A failed transaction leaves no state behind,
+        # whether it runs out of gas or the contract's code raises.
+        calls = self.contract_calls(transaction)
+        if calls is None:
+            print("Malformed contract call!")
+            return False
+        journal = self.blockchain.contracts.journal
+        meter = GasMeter(TX_GAS_LIMIT)
+        journal.meter(meter)
+        try:
+            for method, args in calls:
+                meter.charge(GAS_PER_CALL)
+                if not contract.call(method, args):
+                    journal.undo(meter.changes)
+                    return False
+        except OutOfGas as error:
+            print(error)
+            journal.undo(meter.changes)
+            return False
+        except Exception as error:
+            print(f"Contract call failed: {error!r}")
+            journal.undo(meter.changes)
+            return False
+        finally:
+            journal.meter(None)
+        return True
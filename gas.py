@@ -0,0 +1,15 @@
+class OutOfGas(Exception):
+    pass
+
+
+class GasMeter:
+    # Counts the gas used by one contract transaction and stops it at its limit
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.changes = []  # (mapping, key, old value) written by this transaction
+
+    def charge(self, amount):
+        self.used += amount
+        if self.used > self.limit:
+            raise OutOfGas(f"Out of gas: used {self.used} of {self.limit}")
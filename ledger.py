@@ -0,0 +1,28 @@
+from address import to_address
+from assetledger import AssetLedger, NATIVE_ASSET
+
+
+class Ledger:
+    # Native coin balances. Confirmed balances are the native column of the
+    # asset ledger, where blocks are applied; this adds the pool's net changes.
+    def __init__(self, assets=None):
+        self.assets = assets if assets is not None else AssetLedger()
+        self.confirmed = self.assets.column(NATIVE_ASSET)  # Key: address, Value: balance from mined blocks (read-only)
+        self.pending = {}  # Key: address, Value: net change from the transaction pool
+
+    def get_balance(self, address):
+        address = to_address(address)
+        return self.confirmed.get(address, 0) + self.pending.get(address, 0)
+
+    def add_pending(self, transaction):
+        self._apply(self.pending, transaction, 1)
+
+    def remove_pending(self, transaction):
+        self._apply(self.pending, transaction, -1)
+
+    @staticmethod
+    def _apply(balances, transaction, direction):
+        sender = to_address(transaction.sender)
+        recipient = to_address(transaction.recipient)
+        balances[sender] = balances.get(sender, 0) - direction * transaction.amount
+        balances[recipient] = balances.get(recipient, 0) + direction * transaction.amount
@@ -0,0 +1,129 @@
+import heapq
+import itertools
+from address import to_address
+from constants import MAX_MEMPOOL_TRANSACTIONS
+
+
+class Mempool:
+    # Pending transactions indexed by fee for block selection and eviction, and by
+    # (sender, recipient) for replace-by-fee. Heaps use lazy deletion: entries of
+    # removed transactions are skipped when they surface and dropped on compaction.
+    def __init__(self, max_size=MAX_MEMPOOL_TRANSACTIONS):
+        self.max_size = max_size
+        self.entries = {}  # Key: entry id, Value: transaction (in arrival order)
+        self.entry_ids = {}  # Key: id(transaction), Value: entry id
+        self.by_txid = {}  # Key: txid, Value: entry ids of transactions with that txid
+        self.by_fee = []  # Heap of (-fee, entry id): best fee first, then oldest
+        self.by_low_fee = []  # Heap of (fee, -entry id): worst fee first, then newest
+        self.by_pair = {}  # Key: (sender, recipient), Value: heap of (fee, entry id)
+        self.add_listeners = []
+        self.remove_listeners = []
+        self._next_id = itertools.count()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(list(self.entries.values()))
+
+    def __contains__(self, transaction):
+        return id(transaction) in self.entry_ids
+
+    def arrival_index(self, transaction):
+        # Increases with arrival time; usable as a sort key for pending transactions
+        return self.entry_ids[id(transaction)]
+
+    def subscribe(self, on_add, on_remove):
+        self.add_listeners.append(on_add)
+        self.remove_listeners.append(on_remove)
+
+    def add(self, transaction):
+        # Returns False if the transaction was already pending or was evicted
+        # straight away for a low fee
+        if id(transaction) in self.entry_ids:
+            return False
+        entry_id = next(self._next_id)
+        self.entries[entry_id] = transaction
+        self.entry_ids[id(transaction)] = entry_id
+        self.by_txid.setdefault(transaction.txid(), []).append(entry_id)
+        heapq.heappush(self.by_fee, (-transaction.fee, entry_id))
+        heapq.heappush(self.by_low_fee, (transaction.fee, -entry_id))
+        heapq.heappush(self.by_pair.setdefault(self._pair(transaction), []), (transaction.fee, entry_id))
+        for listener in self.add_listeners:
+            listener(transaction)
+        while len(self.entries) > self.max_size:
+            self.remove(self.entries[self._peek(self.by_low_fee, lambda item: -item[1])])
+        self._compact_if_stale()
+        return transaction in self
+
+    def add_or_replace(self, transaction):
+        # Replace-by-Fee: a higher fee replaces the cheapest pending transaction
+        # between the same sender and recipient; otherwise the transaction is added
+        pair_heap = self.by_pair.get(self._pair(transaction))
+        if pair_heap:
+            entry_id = self._peek(pair_heap, lambda item: item[1])
+            if entry_id is not None and transaction.fee > self.entries[entry_id].fee:
+                self.remove(self.entries[entry_id])
+        return self.add(transaction)
+
+    def remove(self, transaction):
+        entry_id = self.entry_ids.pop(id(transaction), None)
+        if entry_id is None:
+            return False
+        del self.entries[entry_id]
+        txid = transaction.txid()
+        same_txid = self.by_txid[txid]
+        same_txid.remove(entry_id)
+        if not same_txid:
+            del self.by_txid[txid]
+        for listener in self.remove_listeners:
+            listener(transaction)
+        return True
+
+    def remove_txid(self, txid):
+        # Remove one pending transaction with this id, e.g. a copy received in a block
+        entry_ids = self.by_txid.get(txid)
+        if not entry_ids:
+            return False
+        return self.remove(self.entries[entry_ids[0]])
+
+    def get_txid(self, txid):
+        entry_ids = self.by_txid.get(txid)
+        return self.entries[entry_ids[0]] if entry_ids else None
+
+    def select(self, count):
+        # The `count` highest-fee transactions, without removing them
+        selected = []
+        while self.by_fee and len(selected) < count:
+            item = heapq.heappop(self.by_fee)
+            if item[1] in self.entries:
+                selected.append(item)
+        for item in selected:
+            heapq.heappush(self.by_fee, item)
+        return [self.entries[entry_id] for _, entry_id in selected]
+
+    @staticmethod
+    def _pair(transaction):
+        return to_address(transaction.sender), to_address(transaction.recipient)
+
+    def _peek(self, heap, entry_id_of):
+        while heap:
+            entry_id = entry_id_of(heap[0])
+            if entry_id in self.entries:
+                return entry_id
+            heapq.heappop(heap)
+        return None
+
+    def _compact_if_stale(self):
+        # Rebuild the heaps once stale entries outnumber live ones
+        if len(self.by_fee) <= 2 * len(self.entries) + 64:
+            return
+        self.by_fee = [(-tx.fee, entry_id) for entry_id, tx in self.entries.items()]
+        self.by_low_fee = [(tx.fee, -entry_id) for entry_id, tx in self.entries.items()]
+        self.by_pair = {}
+        for entry_id, tx in self.entries.items():
+            self.by_pair.setdefault(self._pair(tx), []).append((tx.fee, entry_id))
+        heapq.heapify(self.by_fee)
+        heapq.heapify(self.by_low_fee)
+        for pair_heap in self.by_pair.values():
+            heapq.heapify(pair_heap)
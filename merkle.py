@@ -0,0 +1,49 @@
+import hashlib
+
+# Root of a block without transactions
+EMPTY_ROOT = bytes(32)
+
+# Prefix for interior nodes, so a pair of hashes can never pass for a leaf
+NODE_PREFIX = b'\x01'
+
+
+def hash_pair(left, right):
+    return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+
+def merkle_levels(leaves):
+    # All levels of the tree, leaves first. An odd last node moves up unchanged;
+    # pairing it with itself would give [a, b, c] and [a, b, c, c] the same root.
+    levels = [list(leaves)]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        parents = [hash_pair(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            parents.append(level[-1])
+        levels.append(parents)
+    return levels
+
+
+def merkle_root(leaves):
+    if not leaves:
+        return EMPTY_ROOT
+    return merkle_levels(leaves)[-1][0]
+
+
+def merkle_proof(levels, index):
+    # Sibling hashes from the leaf up, each flagged with whether it sits on the left.
+    # A node moved up without a sibling adds nothing.
+    proof = []
+    for level in levels[:-1]:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append((level[sibling], sibling < index))
+        index //= 2
+    return proof
+
+
+def verify_proof(leaf, proof, root):
+    node = leaf
+    for sibling, sibling_on_left in proof:
+        node = hash_pair(sibling, node) if sibling_on_left else hash_pair(node, sibling)
+    return node == root
@@ -0,0 +1,238 @@
+import asyncio
+import struct
+import time
+from collections import OrderedDict
+from block import Block
+from transaction import Transaction
+from constants import PEER_KNOWN_SIZE, PEER_QUEUE_SIZE, RELAY_CACHE_SIZE, SEEN_CACHE_SIZE, REQUEST_TIMEOUT
+
+# Frame: body length and message type, then the body
+FRAME = struct.Struct('<IB')
+MSG_INV = 1  # Body: count, then inventory items
+MSG_GETDATA = 2  # Body: count, then inventory items
+MSG_TX = 3  # Body: serialized transaction
+MSG_BLOCK = 4  # Body: serialized block
+
+# Inventory item: kind and 32-byte id (txid or block hash)
+INV_ITEM = struct.Struct('<B32s')
+INV_COUNT = struct.Struct('<I')
+INV_TX = 1
+INV_BLOCK = 2
+
+
+def frame(msg_type, body):
+    return FRAME.pack(len(body), msg_type) + body
+
+
+def inventory_frame(msg_type, items):
+    return frame(msg_type, INV_COUNT.pack(len(items)) + b''.join(INV_ITEM.pack(kind, object_id) for kind, object_id in items))
+
+
+def parse_inventory(body):
+    (count,) = INV_COUNT.unpack_from(body, 0)
+    return [INV_ITEM.unpack_from(body, INV_COUNT.size + INV_ITEM.size * index) for index in range(count)]
+
+
+class Peer:
+    def __init__(self, reader, writer, queue_size, known_size=PEER_KNOWN_SIZE):
+        self.reader = reader
+        self.writer = writer
+        self.outbox = asyncio.Queue(queue_size)  # Data frames waiting to be written
+        self.announcements = []  # Inventory to announce, sent together in one INV
+        self.known = OrderedDict()  # Inventory this peer has or has announced to us; least recent first
+        self.known_size = known_size
+        self.wakeup = asyncio.Event()
+        self.tasks = []
+
+    async def send(self, data):
+        # Waits while the peer's outbox is full, which stalls whoever is feeding it
+        await self.outbox.put(data)
+        self.wakeup.set()
+
+    def announce(self, item):
+        if item not in self.known:
+            self.remember(item)
+            self.announcements.append(item)
+            self.wakeup.set()
+
+    def remember(self, item):
+        # Forgetting an old item only means it may be announced to the peer again
+        self.known[item] = True
+        self.known.move_to_end(item)
+        if len(self.known) > self.known_size:
+            self.known.popitem(last=False)
+
+
+class Node:
+    # Gossips transactions and blocks for a Blockchain over persistent TCP
+    # connections. New objects are announced by id (INV) and only fetched
+    # (GETDATA) by peers that have not seen them; each peer has a bounded
+    # outbox, and a peer that does not keep up stops being read from. A peer
+    # sending a malformed message is dropped.
+    def __init__(self, blockchain, host='127.0.0.1', port=0, queue_size=PEER_QUEUE_SIZE, cache_size=RELAY_CACHE_SIZE,
+                 seen_size=SEEN_CACHE_SIZE, request_timeout=REQUEST_TIMEOUT):
+        self.blockchain = blockchain
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size
+        self.cache_size = cache_size
+        self.seen_size = seen_size
+        self.request_timeout = request_timeout
+        self.peers = []
+        self.server = None
+        self.seen = OrderedDict()  # Inventory recently received, so it is not fetched twice; least recent first
+        self.requested = OrderedDict()  # Key: inventory item, Value: (peer, time requested); oldest first
+        self.relay_cache = OrderedDict()  # Key: inventory item, Value: serialized object
+        self.received = {MSG_INV: 0, MSG_GETDATA: 0, MSG_TX: 0, MSG_BLOCK: 0}
+        self.duplicates = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._accept, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+        for peer in list(self.peers):
+            for task in peer.tasks:
+                task.cancel()
+            peer.writer.close()
+        if self.server:
+            await self.server.wait_closed()
+
+    async def connect(self, host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        return self._add_peer(reader, writer)
+
+    def submit_transaction(self, transaction, public_key, signature):
+        if not self.blockchain.add_transaction_to_pool(transaction, public_key, signature):
+            return False
+        self._relay((INV_TX, transaction.txid()), transaction.serialize(), None)
+        return True
+
+    def mine(self, miner_address=None):
+        if not self.blockchain.mine_block(miner_address):
+            return False
+        block = self.blockchain.chain[-1]
+        self._relay((INV_BLOCK, bytes.fromhex(block.hash)), block.serialize(), None)
+        return True
+
+    async def _accept(self, reader, writer):
+        self._add_peer(reader, writer)
+
+    def _add_peer(self, reader, writer):
+        peer = Peer(reader, writer, self.queue_size)
+        self.peers.append(peer)
+        peer.tasks = [asyncio.create_task(self._read_loop(peer)), asyncio.create_task(self._write_loop(peer))]
+        return peer
+
+    def _drop_peer(self, peer):
+        if peer in self.peers:
+            self.peers.remove(peer)
+        # Anything still outstanding from this peer may be fetched from another one
+        for item in [item for item, (source, _) in self.requested.items() if source is peer]:
+            del self.requested[item]
+        peer.writer.close()
+
+    def _relay(self, item, data, source):
+        self._mark_seen(item)
+        self.relay_cache[item] = data
+        if len(self.relay_cache) > self.cache_size:
+            self.relay_cache.popitem(last=False)
+        for peer in self.peers:
+            if peer is not source:
+                peer.announce(item)
+
+    async def _read_loop(self, peer):
+        try:
+            while True:
+                length, msg_type = FRAME.unpack(await peer.reader.readexactly(FRAME.size))
+                body = await peer.reader.readexactly(length)
+                await self._handle(peer, msg_type, body)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except (struct.error, ValueError, IndexError) as error:
+            print(f"Dropping peer after a malformed message: {error!r}")
+        finally:
+            self._drop_peer(peer)
+            for task in peer.tasks:
+                if task is not asyncio.current_task():
+                    task.cancel()
+
+    async def _write_loop(self, peer):
+        try:
+            while True:
+                await peer.wakeup.wait()
+                peer.wakeup.clear()
+                if peer.announcements:
+                    items, peer.announcements = peer.announcements, []
+                    peer.writer.write(inventory_frame(MSG_INV, items))
+                while not peer.outbox.empty():
+                    peer.writer.write(peer.outbox.get_nowait())
+                await peer.writer.drain()
+        except ConnectionError:
+            pass
+
+    async def _handle(self, peer, msg_type, body):
+        self.received[msg_type] = self.received.get(msg_type, 0) + 1
+        if msg_type == MSG_INV:
+            items = parse_inventory(body)
+            for item in items:
+                peer.remember(item)
+            self._expire_requests()
+            wanted = [item for item in items if item not in self.seen and item not in self.requested]
+            now = time.monotonic()
+            for item in wanted:
+                self.requested[item] = (peer, now)
+            if wanted:
+                await peer.send(inventory_frame(MSG_GETDATA, wanted))
+        elif msg_type == MSG_GETDATA:
+            for kind, object_id in parse_inventory(body):
+                data = self.relay_cache.get((kind, object_id))
+                if data is not None:
+                    await peer.send(frame(MSG_TX if kind == INV_TX else MSG_BLOCK, data))
+        elif msg_type == MSG_TX:
+            transaction, _ = Transaction.deserialize(body)
+            item = (INV_TX, transaction.txid())
+            if not self._receive(peer, item):
+                return
+            if self.blockchain.add_transaction_to_pool(transaction, transaction.sender, transaction.signature):
+                self._relay(item, body, peer)
+            else:
+                # It may become valid later (e.g. once its funds arrive), so it can be fetched again
+                del self.seen[item]
+        elif msg_type == MSG_BLOCK:
+            block = Block.deserialize(body)
+            item = (INV_BLOCK, bytes.fromhex(block.hash))
+            if not self._receive(peer, item):
+                return
+            if self.blockchain.add_block(block):
+                self._relay(item, body, peer)
+            else:
+                del self.seen[item]
+
+    def _receive(self, peer, item):
+        # Returns False for an object this node already has
+        self.requested.pop(item, None)
+        peer.remember(item)
+        if item in self.seen:
+            self.seen.move_to_end(item)
+            self.duplicates += 1
+            return False
+        self._mark_seen(item)
+        return True
+
+    def _mark_seen(self, item):
+        self.seen[item] = True
+        self.seen.move_to_end(item)
+        if len(self.seen) > self.seen_size:
+            self.seen.popitem(last=False)
+
+    def _expire_requests(self):
+        # Requests left unanswered too long may be sent to another peer
+        deadline = time.monotonic() - self.request_timeout
+        while self.requested:
+            item, (_, requested_at) = next(iter(self.requested.items()))
+            if requested_at > deadline:
+                return
+            del self.requested[item]
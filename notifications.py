@@ -0,0 +1,149 @@
+import time
+import queue
+import smtplib
+import threading
+from email.message import EmailMessage
+from constants import (NOTIFICATION_BATCH_SIZE, NOTIFICATION_MAX_ATTEMPTS, NOTIFICATION_RECIPIENT, NOTIFICATION_RETRY_DELAY,
+                       NOTIFICATION_SENDER, SMTP_HOST, SMTP_IDLE_TIMEOUT, SMTP_PASSWORD, SMTP_PORT, SMTP_USERNAME)
+
+
+class EmailNotifier:
+    # Queues notifications and delivers them from background worker threads.
+    # Each worker keeps its own SMTP connection open between batches, sends up
+    # to batch_size queued messages per session and retries failed batches with
+    # exponential backoff, so callers never wait on the network.
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT, username=SMTP_USERNAME, password=SMTP_PASSWORD,
+                 sender=NOTIFICATION_SENDER, recipient=NOTIFICATION_RECIPIENT, workers=1,
+                 batch_size=NOTIFICATION_BATCH_SIZE, max_attempts=NOTIFICATION_MAX_ATTEMPTS,
+                 retry_delay=NOTIFICATION_RETRY_DELAY, idle_timeout=SMTP_IDLE_TIMEOUT, smtp_factory=smtplib.SMTP):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.sender = sender
+        self.recipient = recipient
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.idle_timeout = idle_timeout
+        self.smtp_factory = smtp_factory
+        self.queue = queue.Queue()
+        self.sent = 0
+        self.dropped = 0
+        self.workers = [threading.Thread(target=self._run, daemon=True) for _ in range(workers)]
+        self.started = False
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def notify(self, subject, body):
+        msg = EmailMessage()
+        msg.set_content(body)
+        msg['Subject'] = subject
+        msg['From'] = self.sender
+        msg['To'] = self.recipient
+        # Queued under the lock, so nothing lands behind close()'s stop signals
+        with self.lock:
+            if self.closed:
+                print("Notifier is closed!")
+                return
+            self._start()
+            self.queue.put(msg)
+
+    def flush(self):
+        # Block until everything queued so far has been sent or dropped
+        self.queue.join()
+
+    def close(self):
+        # Stop the workers after the messages already queued; later calls do nothing
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        if self.started:
+            for _ in self.workers:
+                self.queue.put(None)
+            for worker in self.workers:
+                worker.join()
+
+    def _start(self):
+        # Called with the lock held
+        if not self.started:
+            self.started = True
+            for worker in self.workers:
+                worker.start()
+
+    def _run(self):
+        connection = None
+        while True:
+            try:
+                msg = self.queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                connection = self._disconnect(connection)
+                continue
+            if msg is None:
+                self._disconnect(connection)
+                self.queue.task_done()
+                return
+            batch = [msg]
+            while len(batch) < self.batch_size:
+                try:
+                    msg = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if msg is None:
+                    # Hand the stop signal back for after this batch
+                    self.queue.task_done()
+                    self.queue.put(None)
+                    break
+                batch.append(msg)
+            try:
+                connection = self._deliver(connection, batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _deliver(self, connection, batch):
+        delay = self.retry_delay
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                if connection is None:
+                    connection = self._connect()
+                while batch:
+                    connection.send_message(batch[0])
+                    batch = batch[1:]
+                    with self.lock:
+                        self.sent += 1
+                return connection
+            except (smtplib.SMTPException, OSError) as error:
+                connection = self._disconnect(connection)
+                if attempt == self.max_attempts:
+                    print(f"Dropping {len(batch)} notifications: {error}")
+                    with self.lock:
+                        self.dropped += len(batch)
+                    return None
+                time.sleep(delay)
+                delay *= 2
+            except Exception as error:
+                # Anything else (a broken message, a bug in the SMTP client) will
+                # not go away on retry: drop the batch but keep the worker alive
+                self._disconnect(connection)
+                print(f"Dropping {len(batch)} notifications: {error!r}")
+                with self.lock:
+                    self.dropped += len(batch)
+                return None
+        return connection
+
+    def _connect(self):
+        connection = self.smtp_factory(self.host, self.port)
+        if self.username:
+            connection.login(self.username, self.password)
+        return connection
+
+    @staticmethod
+    def _disconnect(connection):
+        if connection is not None:
+            try:
+                connection.quit()
+            except Exception:
+                pass
+        return None
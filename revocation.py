@@ -0,0 +1,80 @@
+import hashlib
+
+# Revocation secrets are numbered downwards from here (as in BOLT 3), so state
+# number n uses index START_INDEX - n
+INDEX_BITS = 48
+START_INDEX = (1 << INDEX_BITS) - 1
+
+
+def derive_secret(base, bits, index):
+    # Walk from a secret covering the low `bits` bits of its index down to `index`
+    secret = bytearray(base)
+    for bit in range(bits - 1, -1, -1):
+        if (index >> bit) & 1:
+            secret[bit // 8] ^= 1 << (bit % 8)
+            secret = bytearray(hashlib.sha256(secret).digest())
+    return bytes(secret)
+
+
+def state_index(number):
+    return START_INDEX - number
+
+
+class RevocationChain:
+    # One party's revocation secrets, all derived from a single seed. The
+    # secret of a state is revealed when the parties move past it; its hash is
+    # committed to in the state itself.
+    def __init__(self, seed):
+        self.seed = seed
+
+    def secret(self, number):
+        return derive_secret(self.seed, INDEX_BITS, state_index(number))
+
+    def hash(self, number):
+        return hashlib.sha256(self.secret(number)).digest()
+
+
+class RevocationStore:
+    # The counterparty's side: secrets revealed so far, kept in at most
+    # INDEX_BITS + 1 slots. Any earlier secret can be derived from a later one
+    # whose index shares its high bits, so older secrets are dropped as newer
+    # ones arrive.
+    def __init__(self):
+        self.known = []  # (index, secret) by the number of trailing zero bits of the index
+
+    def __len__(self):
+        return len(self.known)
+
+    def consistent(self, number, secret):
+        # False if the stored secrets could not have come from the same seed
+        index = state_index(number)
+        position = self._trailing_zeros(index)
+        for bit in range(min(position, len(self.known))):
+            known_index, known_secret = self.known[bit]
+            if known_index is not None and derive_secret(secret, position, known_index) != known_secret:
+                return False
+        return True
+
+    def insert(self, number, secret):
+        # Returns False if the secret is inconsistent with those already stored
+        if not self.consistent(number, secret):
+            return False
+        position = self._trailing_zeros(state_index(number))
+        while len(self.known) <= position:
+            self.known.append((None, None))
+        self.known[position] = (state_index(number), secret)
+        return True
+
+    def secret(self, number):
+        # The secret of a revoked state, or None if it has not been revealed
+        index = state_index(number)
+        for bit, (known_index, known_secret) in enumerate(self.known):
+            if known_index is not None and index & ~((1 << bit) - 1) == known_index:
+                return derive_secret(known_secret, bit, index)
+        return None
+
+    @staticmethod
+    def _trailing_zeros(index):
+        if index == 0:
+            return INDEX_BITS
+        return (index & -index).bit_length() - 1
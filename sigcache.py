@@ -0,0 +1,35 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from address import to_address
+from constants import SIGNATURE_CACHE_SIZE
+
+
+class SignatureCache:
+    # Bounded LRU set of signatures that have already verified
+    def __init__(self, max_size=SIGNATURE_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(public_key, signature, payload):
+        return to_address(public_key), hashlib.sha256(payload).digest(), signature
+
+    def __contains__(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return False
+            self.entries.move_to_end(key)
+            return True
+
+    def add(self, key):
+        with self.lock:
+            self.entries[key] = True
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+
+# Shared by transaction admission and channel updates
+signature_cache = SignatureCache()
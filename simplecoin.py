@@ -138,6 +138,7 @@ class Blockchain:
         return Block("0", [])
 
     def mine_block(self, miner_address=None):
+        global MINING_REWARD
         if not self.transaction_pool:
             return False
 
@@ -161,7 +162,6 @@ class Blockchain:
         self.transaction_pool = self.transaction_pool[MAX_TRANSACTIONS_PER_BLOCK:]
 
         # Adjusted reward mechanism
-        global MINING_REWARD
         MINING_REWARD *= 0.9  # Reward reduction mechanism
 
         self.chain.append(new_block)
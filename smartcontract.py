@@ -1,17 +1,38 @@
+from contractstate import ContractState
+
+# Methods of the base class that transactions cannot call
+RESERVED_METHODS = {"call", "compile"}
+
+
 class SmartContract:
     def __init__(self, address):
         self.address = address
-        self.state = {}
+        self.state = ContractState()
+        self.methods = None
+
+    def compile(self):
+        # Resolve the callable methods once, at deploy time
+        self.methods = {}
+        for name in dir(type(self)):
+            if name.startswith("_") or name in RESERVED_METHODS:
+                continue
+            method = getattr(self, name)
+            if callable(method):
+                self.methods[name] = method
+        return self.methods
 
     def call(self, method, args):
-        if hasattr(self, method):
-            getattr(self, method)(*args)
-        else:
+        methods = self.methods if self.methods is not None else self.compile()
+        function = methods.get(method)
+        if function is None:
             print(f"Method {method} not found in contract.")
+            return False
+        function(*args)
+        return True
 
     # Example methods
     def set_value(self, key, value):
         self.state[key] = value
 
     def get_value(self, key):
-        return self.state.get(key)
\ No newline at end of file
+        return self.state.get(key)
@@ -0,0 +1,166 @@
+import json
+import struct
+import hashlib
+from encoding import pack_bytes, pack_number, pack_json, unpack_bytes, unpack_number, unpack_json, LENGTH
+from address import to_address, intern_address
+from channel import Channel, ChannelState
+from smartcontract import SmartContract
+from assetledger import NATIVE_ASSET
+
+# Layout version written at the start of every serialized snapshot; 2 added the asset
+# balances, 3 the numbered channel states with their revocation secrets and disputes,
+# 4 the txids of confirmed transactions, 5 contract state as [key, value] pairs
+SNAPSHOT_VERSION = 5
+TXID_SIZE = 32
+SNAPSHOT_HEADER = struct.Struct('<BQ')
+
+
+class ChainSnapshot:
+    # The chain state after the block at `height`: confirmed balances, stakes,
+    # channels, contract state, the txids already confirmed (so a restored
+    # node still refuses replays) and the balances of registered assets. Its
+    # commitment is the hash of the canonical encoding of the chain state, so
+    # two nodes holding the same state agree on it. Registered assets move by
+    # this node's own transfers, not by blocks, so they are carried along but
+    # left out of the commitment.
+    def __init__(self, height, block_hash, balances, stakes, channels, contracts, assets=None, txids=None):
+        self.height = height
+        self.block_hash = block_hash
+        self.balances = balances  # Key: address, Value: confirmed balance
+        self.stakes = stakes  # Key: address, Value: staked amount
+        self.channels = channels  # One dict of fields per channel
+        self.contracts = contracts  # Key: contract address, Value: state as sorted [key, value] pairs
+        self.assets = assets or {}  # Key: registered asset, Value: {address: balance}
+        self.txids = txids or set()  # Txids of confirmed transactions, rewards excepted
+
+    @classmethod
+    def capture(cls, blockchain):
+        balances = {address: balance for address, balance in blockchain.ledger.confirmed.items() if balance}
+        stakes = {address: stake for address, stake in blockchain.stakers.items() if stake}
+        channels = [channel_fields(channel) for channel in blockchain.channels]
+        contracts = {address: state_items(contract.state) for address, contract in blockchain.contracts.items()}
+        assets = {asset: {} for asset in blockchain.assets.assets if asset != NATIVE_ASSET}
+        for asset, table in blockchain.assets.export(assets).items():
+            assets[asset] = table
+        return cls(len(blockchain.chain) - 1, blockchain.chain[-1].hash, balances, stakes, channels, contracts, assets,
+                   set(blockchain.confirmed_txids))
+
+    def restore(self, blockchain):
+        # Replace the blockchain's confirmed state with this snapshot's. Contracts
+        # not already deployed come back as plain SmartContracts holding their state.
+        blockchain.assets.load(dict(self.assets, **{NATIVE_ASSET: self.balances}))
+        for address, stake in self.stakes.items():
+            blockchain.stakers[address] = stake
+        blockchain.confirmed_txids = set(self.txids)
+        for fields in self.channels:
+            blockchain.channels.add(restore_channel(fields))
+        for address, state in self.contracts.items():
+            contract = blockchain.contracts.get(address)
+            if contract is None:
+                contract = SmartContract(address)
+                blockchain.deploy_contract(contract)
+            contract.state.data = {key: value for key, value in state}
+
+    def serialize(self):
+        assets = {asset: {address.hex(): balance for address, balance in table.items()} for asset, table in self.assets.items()}
+        return self.serialize_chain_state() + pack_json(assets)
+
+    def serialize_chain_state(self):
+        parts = [SNAPSHOT_HEADER.pack(SNAPSHOT_VERSION, self.height), bytes.fromhex(self.block_hash)]
+        for table in (self.balances, self.stakes):
+            parts.append(LENGTH.pack(len(table)))
+            for address in sorted(table):
+                parts.append(pack_bytes(address) + pack_number(table[address]))
+        parts.append(pack_json(sorted(self.channels, key=lambda fields: fields["id"])))
+        parts.append(pack_json(self.contracts))
+        parts.append(LENGTH.pack(len(self.txids)))
+        parts.extend(sorted(self.txids))
+        return b''.join(parts)
+
+    @classmethod
+    def deserialize(cls, data):
+        data = memoryview(data)
+        version, height = SNAPSHOT_HEADER.unpack_from(data, 0)
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version {version}")
+        offset = SNAPSHOT_HEADER.size
+        block_hash = bytes(data[offset:offset + 32]).hex()
+        offset += 32
+        tables = []
+        for _ in range(2):
+            (count,) = LENGTH.unpack_from(data, offset)
+            offset += LENGTH.size
+            table = {}
+            for _ in range(count):
+                address, offset = unpack_bytes(data, offset)
+                table[address], offset = unpack_number(data, offset)
+            tables.append(table)
+        channels, offset = unpack_json(data, offset)
+        contracts, offset = unpack_json(data, offset)
+        (count,) = LENGTH.unpack_from(data, offset)
+        offset += LENGTH.size
+        txids = {bytes(data[start:start + TXID_SIZE]) for start in range(offset, offset + count * TXID_SIZE, TXID_SIZE)}
+        offset += count * TXID_SIZE
+        assets, offset = unpack_json(data, offset)
+        assets = {asset: {bytes.fromhex(address): balance for address, balance in table.items()}
+                  for asset, table in assets.items()}
+        return cls(height, block_hash, tables[0], tables[1], channels, contracts, assets, txids)
+
+    def commitment(self):
+        return hashlib.sha256(self.serialize_chain_state()).hexdigest()
+
+
+def channel_fields(channel):
+    # A channel as JSON-friendly fields; addresses and signatures as hex
+    return {
+        "id": channel.id,
+        "party1": to_address(channel.party1).hex(),
+        "party2": to_address(channel.party2).hex(),
+        "number": channel.state.number,
+        "balance1": channel.state.balance1,
+        "balance2": channel.state.balance2,
+        "balances1": channel.balances1,
+        "balances2": channel.balances2,
+        "revocation_hashes": [hex_or_none(channel.state.revocation_hash1), hex_or_none(channel.state.revocation_hash2)],
+        "signatures": [hex_or_none(signature) for signature in channel.signatures],
+        "revocations1": [[index, hex_or_none(secret)] for index, secret in channel.revocations1.known],
+        "revocations2": [[index, hex_or_none(secret)] for index, secret in channel.revocations2.known],
+        "open": channel.open,
+        "close_requested": channel.close_requested,
+        "close_request_time": channel.close_request_time,
+        "last_transaction_index": channel.last_transaction_index,
+        "close_requester": channel.close_requester,
+        "cheater": channel.cheater,
+    }
+
+
+def restore_channel(fields):
+    channel = Channel(intern_address(bytes.fromhex(fields["party1"])), intern_address(bytes.fromhex(fields["party2"])),
+                      fields["balance1"], fields["balance2"])
+    state = ChannelState(channel.id, fields["number"], fields["balance1"], fields["balance2"],
+                         fields["balances1"], fields["balances2"], *map(bytes_or_none, fields["revocation_hashes"]))
+    channel.adopt(state, tuple(map(bytes_or_none, fields["signatures"])))
+    channel.revocations1.known = [(index, bytes_or_none(secret)) for index, secret in fields["revocations1"]]
+    channel.revocations2.known = [(index, bytes_or_none(secret)) for index, secret in fields["revocations2"]]
+    channel.open = fields["open"]
+    channel.close_requested = fields["close_requested"]
+    channel.close_request_time = fields["close_request_time"]
+    channel.last_transaction_index = fields["last_transaction_index"]
+    channel.close_requester = fields["close_requester"]
+    if fields["cheater"] is not None:
+        channel.penalize(fields["cheater"])
+    return channel
+
+
+def state_items(state):
+    # Pairs rather than a JSON object, whose keys would all come back as strings,
+    # in the order of their JSON text, which also sorts keys of mixed types
+    return sorted(([key, value] for key, value in state.items()), key=lambda item: json.dumps(item[0]))
+
+
+def hex_or_none(data):
+    return None if data is None else data.hex()
+
+
+def bytes_or_none(text):
+    return None if text is None else bytes.fromhex(text)
@@ -0,0 +1,120 @@
+import random
+from address import to_address, intern_address
+
+
+class StakeRegistry:
+    # Staked amounts per address, kept in a Fenwick tree so that stake updates and
+    # stake-weighted sampling both take O(log n). Reads like a dict of address: stake.
+    def __init__(self):
+        self.slots = {}  # Key: address, Value: position in stakes
+        self.addresses = []  # Address at each position
+        self.stakes = []  # Stake at each position
+        self.tree = [0]  # Fenwick tree over stakes, 1-based
+        self.total = 0
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __bool__(self):
+        return self.total > 0
+
+    def __contains__(self, address):
+        return to_address(address) in self.slots
+
+    def __getitem__(self, address):
+        return self.stakes[self.slots[to_address(address)]]
+
+    def __setitem__(self, address, amount):
+        address = intern_address(address)
+        position = self.slots.get(address)
+        if position is None:
+            position = self._allocate(address)
+        self._update(position, amount - self.stakes[position])
+
+    def __iter__(self):
+        return iter(self.addresses)
+
+    def get(self, address, default=None):
+        position = self.slots.get(to_address(address))
+        return default if position is None else self.stakes[position]
+
+    def keys(self):
+        return list(self.addresses)
+
+    def values(self):
+        return list(self.stakes)
+
+    def items(self):
+        return list(zip(self.addresses, self.stakes))
+
+    def add(self, address, amount):
+        self[address] = self.get(address, 0) + amount
+
+    def select(self, rng=random):
+        # One address drawn with probability proportional to its stake
+        if self.total <= 0:
+            return None
+        if isinstance(self.total, int):
+            r = rng.randint(1, self.total)
+        else:
+            r = rng.uniform(0, self.total)
+        return self.addresses[self._find(r)]
+
+    def select_many(self, count, distinct=False, rng=random):
+        # count independent draws, or a committee of distinct addresses with
+        # distinct=True (drawn stakes are set aside until the committee is full)
+        if distinct:
+            count = min(count, sum(1 for stake in self.stakes if stake > 0))
+        chosen = []
+        removed = []
+        for _ in range(count):
+            address = self.select(rng)
+            if address is None:
+                break
+            chosen.append(address)
+            if distinct:
+                position = self.slots[address]
+                removed.append((position, self.stakes[position]))
+                self._update(position, -self.stakes[position])
+        for position, stake in removed:
+            self._update(position, stake)
+        return chosen
+
+    def _allocate(self, address):
+        position = len(self.addresses)
+        self.slots[address] = position
+        self.addresses.append(address)
+        self.stakes.append(0)
+        # Extending a Fenwick tree by one: the new node covers the stakes
+        # from the end of its lowest-set-bit range up to itself
+        index = position + 1
+        node = 0
+        child = index - 1
+        lower = index - (index & -index)
+        while child > lower:
+            node += self.tree[child]
+            child -= child & -child
+        self.tree.append(node)
+        return position
+
+    def _update(self, position, delta):
+        if not delta:
+            return
+        self.stakes[position] += delta
+        self.total += delta
+        index = position + 1
+        while index < len(self.tree):
+            self.tree[index] += delta
+            index += index & -index
+
+    def _find(self, r):
+        # Smallest position whose prefix sum reaches r
+        position = 0
+        step = 1 << (len(self.tree) - 1).bit_length()
+        while step:
+            following = position + step
+            if following < len(self.tree) and self.tree[following] < r:
+                position = following
+                r -= self.tree[following]
+            step >>= 1
+        return min(position, len(self.stakes) - 1)
@@ -0,0 +1,96 @@
+import struct
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from block import Block, parse_header, pow_target
+from validation import check_block
+from constants import DIFFICULTY, SYNC_HEADER_BATCH, SYNC_WINDOW, SYNC_WORKERS
+
+
+class ChainSource:
+    # Serves an in-memory chain (a list of blocks, e.g. another node's
+    # Blockchain.chain) through the same interface as BlockStore
+    def __init__(self, chain):
+        self.chain = chain
+
+    def __len__(self):
+        return len(self.chain)
+
+    def get_header(self, height):
+        return self.chain[height].header()
+
+    def get_headers(self, start, count):
+        return [block.header() for block in self.chain[start:start + count]]
+
+    def get_block_data(self, height):
+        return self.chain[height].serialize()
+
+
+class HeaderSync:
+    # Headers-first catch-up. The compact headers are downloaded from one
+    # source and checked for linkage and Proof-of-Work; then the bodies are
+    # fetched from all sources in parallel, at most `window` ahead of the one
+    # being appended, each checked against its header as it arrives, and
+    # appended in height order.
+    # A source is anything with len(), get_headers(start, count) and get_block_data(height).
+    def __init__(self, blockchain, sources, workers=SYNC_WORKERS, header_batch=SYNC_HEADER_BATCH, window=SYNC_WINDOW):
+        self.blockchain = blockchain
+        self.sources = sources
+        self.workers = workers
+        self.header_batch = header_batch
+        self.window = window
+
+    def sync(self):
+        # Returns the number of blocks appended
+        headers = self.download_headers()
+        if headers is None:
+            return 0
+        start = len(self.blockchain.chain)
+        jobs = iter(enumerate(headers, start))
+        appended = 0
+        with ThreadPoolExecutor(self.workers) as executor:
+            pending = deque()  # (height, future) in height order
+            while True:
+                for job in itertools.islice(jobs, self.window - len(pending)):
+                    pending.append((job[0], executor.submit(self._fetch_body, job)))
+                if not pending:
+                    break
+                height, future = pending.popleft()
+                block = future.result()
+                if block is None or not self.blockchain.add_block(block, checked=True):
+                    print(f"Invalid block body at height {height}")
+                    for _, later in pending:
+                        later.cancel()
+                    break
+                appended += 1
+        return appended
+
+    def download_headers(self):
+        # Hashes of the validated headers past the local tip, or None if a header is invalid
+        source = max(self.sources, key=len)
+        target = pow_target(DIFFICULTY)
+        previous_hash = self.blockchain.chain[-1].hash
+        hashes = []
+        for batch_start in range(len(self.blockchain.chain), len(source), self.header_batch):
+            batch = source.get_headers(batch_start, min(self.header_batch, len(source) - batch_start))
+            for height, header in enumerate(batch, batch_start):
+                block_hash, header_previous_hash, _ = parse_header(header)
+                if header_previous_hash != previous_hash or bytes.fromhex(block_hash) >= target:
+                    print(f"Invalid header at height {height}")
+                    return None
+                hashes.append(block_hash)
+                previous_hash = block_hash
+        return hashes
+
+    def _fetch_body(self, job):
+        # Spread heights over the sources that have them; None if the body does not match
+        height, block_hash = job
+        holders = [source for source in self.sources if len(source) > height]
+        source = holders[height % len(holders)]
+        try:
+            block = Block.deserialize(source.get_block_data(height))
+        except (ValueError, IndexError, struct.error):
+            return None
+        if block.hash != block_hash or check_block(block, block_hash, height):
+            return None
+        return block
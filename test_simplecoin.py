@@ -1,8 +1,74 @@
+import hashlib
 import unittest
+import time
+import asyncio
+import tempfile
+import threading
+import socketserver
 from blockchain import Blockchain
 from wallet import Wallet
 from transaction import Transaction
+from block import Block, HEADER_SIZE
+from mempool import Mempool
+from sigcache import signature_cache
+from blockstore import BlockStore
+from address import to_address
+from validation import ChainValidator, block_reward, check_block, check_transaction
+from channel import Channel
+from watchtower import Watchtower
+from notifications import EmailNotifier
+from node import Node, Peer, MSG_INV, MSG_TX, MSG_BLOCK, frame
+from sync import ChainSource, HeaderSync
+from executor import BlockExecutor
+from smartcontract import SmartContract
+from blocktemplate import BlockTemplate
+from stakeregistry import StakeRegistry
+from contractstate import ContractStore
+from assetledger import NATIVE_ASSET
+from snapshot import ChainSnapshot, channel_fields, restore_channel
+from blockfilter import filter_matches
+from revocation import RevocationChain
 from constants import *
+import block as block_module
+import address as address_module
+
+
+def _exit_worker(*args):
+    # Stands in for a mining worker that dies without reporting
+    pass
+
+
+class LocalSMTPHandler(socketserver.StreamRequestHandler):
+    # Just enough of SMTP for smtplib to send messages to a local stand-in server
+    def handle(self):
+        self.server.connections += 1
+        self.wfile.write(b"220 localhost\r\n")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command == b"DATA":
+                self.wfile.write(b"354 go ahead\r\n")
+                while self.rfile.readline() not in (b".\r\n", b""):
+                    pass
+                self.server.messages += 1
+                self.wfile.write(b"250 ok\r\n")
+            elif command == b"QUIT":
+                self.wfile.write(b"221 bye\r\n")
+                return
+            else:
+                self.wfile.write(b"250 ok\r\n")
+
+
+class LocalSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), LocalSMTPHandler)
+        self.connections = 0
+        self.messages = 0
+
 
 class TestSimpleCoin(unittest.TestCase):
 
@@ -11,23 +77,905 @@ class TestSimpleCoin(unittest.TestCase):
         self.wallet1 = Wallet()
         self.wallet2 = Wallet()
 
+    def tearDown(self):
+        self.blockchain.close()
+
     def test_transaction_signature(self):
         transaction = Transaction(self.wallet1.public_key, self.wallet2.public_key, 10, None)
         signature = self.wallet1.sign_transaction(str(transaction))
         self.assertTrue(Wallet.verify_signature(self.wallet1.public_key, signature, str(transaction)))
 
     def test_add_transaction_to_pool(self):
+        self.fund(self.wallet1)
         transaction = Transaction(self.wallet1.public_key, self.wallet2.public_key, 10, None)
-        signature = self.wallet1.sign_transaction(str(transaction))
+        signature = self.wallet1.sign_transaction(transaction)
         self.blockchain.add_transaction_to_pool(transaction, self.wallet1.public_key, signature)
         self.assertIn(transaction, self.blockchain.transaction_pool)
 
     def test_mine_block(self):
+        self.fund(self.wallet1)
         transaction = Transaction(self.wallet1.public_key, self.wallet2.public_key, 10, None)
-        signature = self.wallet1.sign_transaction(str(transaction))
+        signature = self.wallet1.sign_transaction(transaction)
         self.blockchain.add_transaction_to_pool(transaction, self.wallet1.public_key, signature)
         self.blockchain.mine_block(self.wallet2.public_key)
         self.assertIn(transaction, self.blockchain.chain[-1].transactions)
 
+    def fund(self, wallet, blockchain=None):
+        # Coins only enter through block rewards: mine a block paying its reward to
+        # the wallet (or to a staker, once there are any). Returns the reward.
+        blockchain = blockchain or self.blockchain
+        reward = blockchain.mining_reward
+        self.assertTrue(blockchain.mine_block(wallet.public_key))
+        return reward
+
+    @staticmethod
+    def signed(wallet, recipient, amount, fee=0, *args):
+        transaction = Transaction(wallet.public_key, recipient, amount, None, fee, *args)
+        transaction.signature = wallet.sign_transaction(transaction)
+        return transaction
+
+    def stake(self, wallet, amount):
+        transaction = Blockchain.staking_transaction(wallet.public_key, amount)
+        return self.blockchain.stake_coins(wallet.public_key, amount, wallet.sign_transaction(transaction))
+
+    def test_ledger_matches_chain_scan(self):
+        self.fund(self.wallet1)
+        self.stake(self.wallet1, 20)
+        for amount, fee in [(10, 1), (5, 3), (7, 2)]:
+            self.blockchain.transaction_pool.add(self.signed(self.wallet1, self.wallet2.public_key, amount, fee))
+        self.blockchain.mine_block(self.wallet2.public_key)
+        self.blockchain.mine_block(self.wallet2.public_key)
+        for address in [self.wallet1.public_key, self.wallet2.public_key, "Network", "STAKE_ADDRESS"]:
+            self.assertAlmostEqual(self.blockchain.get_balance(address), self.blockchain.scan_balance(address))
+
+    def test_parallel_mining(self):
+        self.blockchain.mining_workers = 3
+        self.blockchain.mine_block(self.wallet2.public_key)
+        block = self.blockchain.chain[-1]
+        self.assertTrue(block.hash.startswith('0' * DIFFICULTY))
+        self.assertEqual(block.hash, block.compute_hash())
+        self.assertTrue(self.blockchain.is_valid())
+
+    def test_parallel_mining_fails_when_workers_die(self):
+        original = block_module._search_worker
+        block_module._search_worker = _exit_worker
+        try:
+            with self.assertRaises(RuntimeError):
+                Block("0", []).mine(2)
+        finally:
+            block_module._search_worker = original
+
+    def test_block_header_is_fixed_binary_layout(self):
+        self.blockchain.mine_block(self.wallet2.public_key)
+        block = self.blockchain.chain[-1]
+        self.assertEqual(len(block.header()), HEADER_SIZE)
+        self.assertEqual(block.hash, hashlib.sha256(block.header()).hexdigest())
+        self.assertTrue(self.blockchain.is_valid())
+        block.transactions[0].amount = 1000
+        self.assertEqual(self.blockchain.validate(full=True).invalid_height, 1)
+
+    def test_merkle_inclusion_proofs(self):
+        transactions = [Transaction(self.wallet1.public_key, self.wallet2.public_key, amount, None) for amount in range(1, 8)]
+        block = Block("0", transactions)
+        for transaction in transactions:
+            proof = block.merkle_proof(transaction)
+            self.assertLessEqual(len(proof), 3)
+            self.assertTrue(Block.verify_merkle_proof(transaction.txid(), proof, block.merkle_root))
+        outsider = Transaction(self.wallet2.public_key, self.wallet1.public_key, 1, None)
+        self.assertFalse(Block.verify_merkle_proof(outsider.txid(), block.merkle_proof(transactions[0]), block.merkle_root))
+
+    def test_repeated_transactions_change_the_block(self):
+        self.fund(self.wallet1)
+        for amount in (1, 2):
+            self.blockchain.transaction_pool.add(self.signed(self.wallet1, self.wallet2.public_key, amount))
+        self.blockchain.mine_block(self.wallet2.public_key)
+        honest = self.blockchain.chain[-1]
+        self.assertEqual(len(honest.transactions), 3)
+        # Repeating the odd last transaction must not keep the Merkle root (CVE-2012-2459)
+        mutated = Block.deserialize(honest.serialize())
+        mutated.transactions.append(mutated.transactions[-1])
+        self.assertNotEqual(mutated.compute_merkle_root(cached=False), honest.merkle_root)
+        self.assertEqual(check_block(mutated, honest.hash, 2), "merkle root mismatch")
+        repeated = Block(honest.previous_hash, mutated.transactions)
+        repeated.mine()
+        self.assertEqual(check_block(repeated, repeated.hash, 2), "repeated transaction")
+
+    def test_coin_amounts_are_whole_numbers(self):
+        rewards = [block_reward(height) for height in range(1, 80)]
+        self.assertTrue(all(type(reward) is int for reward in rewards))
+        self.assertEqual((rewards[0], rewards[1], rewards[2], rewards[-1]), (MINING_REWARD, 45, 40, 0))
+        self.assertEqual(check_transaction(self.signed(self.wallet1, self.wallet2.public_key, 0.5)), "amount is not a whole number of coins")
+        self.assertEqual(check_transaction(self.signed(self.wallet1, self.wallet2.public_key, -1)), "negative amount")
+        self.assertIsNone(check_transaction(self.signed(self.wallet1, self.wallet2.public_key, 1)))
+
+    def test_mempool_replace_by_fee_and_eviction(self):
+        pool = Mempool(max_size=3)
+        low = Transaction(self.wallet1.public_key, self.wallet2.public_key, 5, None, 1)
+        high = Transaction(self.wallet1.public_key, self.wallet2.public_key, 5, None, 4)
+        pool.add_or_replace(low)
+        pool.add_or_replace(high)
+        self.assertNotIn(low, pool)
+        self.assertIn(high, pool)
+        others = [Transaction(self.wallet2.public_key, "STAKE_ADDRESS", 1, None, fee) for fee in (2, 3, 5)]
+        for transaction in others:
+            pool.add(transaction)
+        self.assertEqual(len(pool), 3)
+        self.assertNotIn(others[0], pool)
+        self.assertEqual([tx.fee for tx in pool.select(2)], [5, 4])
+        self.assertFalse(pool.add(high))
+        self.assertEqual([tx.fee for tx in pool.select(3)], [5, 4, 3])
+
+    def test_mine_block_clears_mined_transactions(self):
+        self.fund(self.wallet1)
+        transactions = [self.signed(self.wallet1, "STAKE_ADDRESS", 1, fee) for fee in range(MAX_TRANSACTIONS_PER_BLOCK + 5)]
+        for transaction in transactions:
+            self.blockchain.transaction_pool.add(transaction)
+        self.blockchain.mine_block(self.wallet2.public_key)
+        for transaction in self.blockchain.chain[-1].transactions:
+            self.assertNotIn(transaction, self.blockchain.transaction_pool)
+        self.assertIn(transactions[0], self.blockchain.transaction_pool)
+
+    def test_mine_block_reports_a_refused_block(self):
+        contract = SmartContract("Contract1")
+        self.blockchain.deploy_contract(contract)
+        self.fund(self.wallet1)
+        self.blockchain.transaction_pool.add(
+            self.signed(self.wallet1, "Contract1", 0, 0, "contract", "Contract1", "set_value", ["key", 1]))
+        self.blockchain.assets.apply_block = lambda block, direction=1: False  # Refuses every block
+        tree_size = len(self.blockchain.tree)
+        self.assertFalse(self.blockchain.mine_block(self.wallet2.public_key))
+        self.assertEqual((len(self.blockchain.chain), len(self.blockchain.tree)), (2, tree_size))
+        self.assertIsNone(contract.get_value("key"))
+
+    def test_mine_block_keeps_transactions_the_pool_funds(self):
+        wallet3, wallet4 = Wallet(), Wallet()
+        self.fund(self.wallet1)
+        # Without a fee the payment to wallet3 is left out of a full block
+        incoming = self.signed(self.wallet1, wallet3.public_key, 10)
+        spend = self.signed(wallet3, self.wallet2.public_key, 5, 100)
+        overdraft = self.signed(wallet4, self.wallet2.public_key, 5, 100)
+        fillers = [self.signed(self.wallet1, "STAKE_ADDRESS", 1, fee) for fee in range(1, MAX_TRANSACTIONS_PER_BLOCK - 2)]
+        for transaction in [incoming, spend, overdraft] + fillers:
+            self.blockchain.transaction_pool.add(transaction)
+        self.blockchain.mine_block(self.wallet2.public_key)
+        self.assertEqual(self.blockchain.chain[-1].transactions[1:], fillers)
+        self.assertIn(spend, self.blockchain.transaction_pool)
+        self.assertNotIn(overdraft, self.blockchain.transaction_pool)
+        self.blockchain.mine_block(self.wallet2.public_key)
+        self.assertEqual(self.blockchain.chain[-1].transactions[1:], [incoming, spend])
+
+    def test_batch_admission_uses_signature_cache(self):
+        self.fund(self.wallet1)
+        entries = []
+        for amount in (1, 2, 3):
+            transaction = Transaction(self.wallet1.public_key, "STAKE_ADDRESS", amount, None)
+            entries.append((transaction, self.wallet1.public_key, self.wallet1.sign_transaction(transaction)))
+        forged = Transaction(self.wallet1.public_key, self.wallet2.public_key, 4, None)
+        entries.append((forged, self.wallet1.public_key, self.wallet2.sign_transaction(forged)))
+        self.blockchain.signature_workers = 2
+        self.assertEqual(self.blockchain.add_transactions_to_pool(entries), [True, True, True, False])
+        transaction, public_key, signature = entries[0]
+        self.assertIn(signature_cache.key(public_key, signature, transaction.signing_payload()), signature_cache)
+        # Later batches reuse the same worker processes
+        pool = self.blockchain.signature_pool
+        again = Transaction(self.wallet1.public_key, "STAKE_ADDRESS", 4, None)
+        other = Transaction(self.wallet1.public_key, "STAKE_ADDRESS", 5, None)
+        self.assertEqual(self.blockchain.add_transactions_to_pool(
+            [(tx, self.wallet1.public_key, self.wallet1.sign_transaction(tx)) for tx in (again, other)]), [True, True])
+        self.assertIs(self.blockchain.signature_pool, pool)
+
+    def test_block_store_survives_restart(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = BlockStore(directory, segment_size=512)
+            blockchain = Blockchain(store)
+            for _ in range(5):
+                blockchain.mine_block(self.wallet1.public_key)
+            hashes = [block.hash for block in blockchain.chain]
+            store.close()
+
+            reopened = BlockStore(directory, cache_size=2)
+            self.assertEqual([block.hash for block in reopened], hashes)
+            self.assertEqual(reopened.height_of(hashes[3]), 3)
+            self.assertEqual(reopened.get_header(-1), reopened[-1].header())
+            restarted = Blockchain(reopened)
+            self.assertTrue(restarted.is_valid())
+            self.assertEqual(restarted.get_balance(self.wallet1.public_key), blockchain.ledger.confirmed[to_address(self.wallet1.public_key)])
+            # A disconnected tip leaves the indexes as if it was never appended
+            self.assertEqual(restarted.disconnect_block().hash, hashes[-1])
+            self.assertIsNone(reopened.height_of(hashes[-1]))
+            self.assertEqual(reopened.height_of(hashes[3]), 3)
+            self.assertTrue(restarted.reorganize(restarted.tree.get(hashes[-1])))
+            self.assertEqual([block.hash for block in BlockStore(directory)], hashes)
+            reopened.close()
+
+    def test_checkpointed_parallel_validation(self):
+        for _ in range(4):
+            self.fund(self.wallet1)
+        self.assertTrue(self.blockchain.is_valid())
+        self.assertEqual(self.blockchain.validator.checkpoint_height, 4)
+        self.blockchain.chain[2].nonce += 1
+        self.assertTrue(self.blockchain.is_valid())
+        validator = ChainValidator(workers=2, batch_size=2)
+        result = validator.validate(self.blockchain.chain)
+        self.assertFalse(result)
+        self.assertEqual((result.invalid_height, result.reason), (2, "hash mismatch"))
+        validator.close()
+
+    def test_channel_registry_lookups(self):
+        wallet3 = Wallet()
+        for wallet in (self.wallet1, self.wallet2, wallet3):
+            self.fund(wallet)
+        self.blockchain.open_channel(self.wallet1.public_key, self.wallet2.public_key, 10, 10)
+        self.blockchain.open_channel(self.wallet2.public_key, wallet3.public_key, 5, 5)
+        channel = self.blockchain.find_channel(self.wallet2.public_key, self.wallet1.public_key)
+        self.assertIs(channel, self.blockchain.find_channel(self.wallet1.public_key, self.wallet2.public_key))
+        self.assertEqual(len(self.blockchain.channels.channels_of(self.wallet2.public_key)), 2)
+        self.blockchain.request_channel_close(self.wallet1.public_key, self.wallet2.public_key)
+        self.assertEqual(self.blockchain.channels.close_requested_channels(), [channel])
+        self.blockchain.close_channel(self.wallet1.public_key, self.wallet2.public_key)
+        self.assertEqual(len(self.blockchain.channels.open_channels()), 1)
+        self.assertEqual(self.blockchain.channels.close_requested_channels(), [])
+
+    def test_watchtower_acts_only_on_events_and_deadlines(self):
+        class RecordingWatchtower(Watchtower):
+            def __init__(self):
+                super().__init__()
+                self.notified = []
+
+            def notify_user_of_close(self, channel):
+                self.notified.append(channel)
+
+        watchtower = RecordingWatchtower()
+        channel = Channel(self.wallet1.public_key, self.wallet2.public_key, 10, 10)
+        chain1, chain2 = RevocationChain(b'\x01' * 32), RevocationChain(b'\x02' * 32)
+        for number in range(1, 4):
+            secrets = (chain1.secret(number - 1), chain2.secret(number - 1))
+            state = channel.propose([(None, 1)], chain1.hash(number), chain2.hash(number))
+            self.assertTrue(channel.commit(state, None, None, secrets, verified=True))
+        watchtower.monitor_channel(channel, channel.state, channel.signatures)
+        watchtower.check_channels()
+        self.assertEqual(watchtower.deadlines, [])
+        # party1 tries to close on state 1, which it already revoked
+        channel.request_close(1, self.wallet1.public_key)
+        watchtower.check_channels()
+        self.assertEqual((channel.last_transaction_index, channel.cheater), (3, 1))
+        self.assertEqual((channel.balance1, channel.balance2), (0, 20))
+        self.assertEqual(restore_channel(channel_fields(channel)).balance2, 20)
+        deadline = channel.close_request_time + TIME_LOCK_PERIOD
+        watchtower.check_channels(deadline - 1)
+        self.assertEqual(watchtower.notified, [])
+        watchtower.check_channels(deadline)
+        watchtower.check_channels(deadline + 1)
+        self.assertEqual(watchtower.notified, [channel])
+
+    def test_notifications_share_one_smtp_session(self):
+        server = LocalSMTPServer()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        notifier = EmailNotifier("127.0.0.1", server.server_address[1], username=None, batch_size=10)
+        watchtower = Watchtower(notifier)
+        for number in range(5):
+            watchtower.send_email_notification(f"Notice {number}", "Channel closed.")
+        notifier.flush()
+        notifier.close()
+        notifier.close()
+        watchtower.send_email_notification("Late", "Not sent after close.")
+        server.shutdown()
+        server.server_close()
+        self.assertEqual((server.messages, notifier.sent), (5, 5))
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(notifier.queue.qsize(), 0)
+
+    def test_notifications_retry_with_backoff(self):
+        attempts = []
+
+        class FlakySMTP:
+            def __init__(self, host, port):
+                attempts.append(host)
+                if len(attempts) < 3:
+                    raise OSError("connection refused")
+
+            def send_message(self, msg):
+                pass
+
+            def quit(self):
+                pass
+
+        notifier = EmailNotifier("smtp.invalid", 25, username=None, retry_delay=0.01, smtp_factory=FlakySMTP)
+        notifier.notify("Notice", "Channel closed.")
+        notifier.flush()
+        notifier.close()
+        self.assertEqual((len(attempts), notifier.sent, notifier.dropped), (3, 1, 0))
+
+    def test_unexpected_delivery_errors_keep_the_worker_alive(self):
+        class BrokenSMTP:
+            def __init__(self, host, port):
+                pass
+
+            def send_message(self, msg):
+                if msg['Subject'] == "Broken":
+                    raise RuntimeError("client bug")
+
+            def quit(self):
+                raise ValueError("already closed")
+
+        notifier = EmailNotifier("smtp.invalid", 25, username=None, batch_size=2, smtp_factory=BrokenSMTP)
+        for subject in ("Fine", "Broken", "Fine"):
+            notifier.notify(subject, "Channel closed.")
+        notifier.flush()
+        notifier.close()
+        self.assertEqual((notifier.sent, notifier.dropped), (2, 1))
+
+    def test_headers_first_sync_from_several_sources(self):
+        for _ in range(5):
+            self.fund(self.wallet1)
+        with tempfile.TemporaryDirectory() as directory:
+            store = BlockStore(directory)
+            for block in self.blockchain.chain:
+                store.append(block)
+            fresh = Blockchain()
+            self.assertEqual(HeaderSync(fresh, [ChainSource(self.blockchain.chain), store], workers=3).sync(), 5)
+            store.close()
+        self.assertEqual([block.hash for block in fresh.chain], [block.hash for block in self.blockchain.chain])
+        self.assertEqual(fresh.get_balance(self.wallet1.public_key), self.blockchain.ledger.confirmed[to_address(self.wallet1.public_key)])
+
+        class TamperedSource(ChainSource):
+            def __init__(self, chain):
+                super().__init__(chain)
+                self.requests = []
+
+            def get_headers(self, start, count):
+                self.requests.append((start, count))
+                return super().get_headers(start, count)
+
+            def get_block_data(self, height):
+                self.requests.append(height)
+                data = bytearray(super().get_block_data(height))
+                if height == 3:
+                    data[40] ^= 1  # Inside the Merkle root
+                return bytes(data)
+
+        source = TamperedSource(self.blockchain.chain)
+        self.assertEqual(HeaderSync(Blockchain(), [source]).sync(), 2)
+        # Headers come in batches; no body is fetched more than `window` ahead
+        source.requests = []
+        self.assertEqual(HeaderSync(Blockchain(), [source], workers=1, header_batch=2, window=1).sync(), 2)
+        self.assertEqual(source.requests, [(1, 2), (3, 2), (5, 1), 1, 2, 3])
+
+    def test_transactions_use_interned_address_bytes(self):
+        first = Transaction(self.wallet1.public_key, "STAKE_ADDRESS", 1, None)
+        second, _ = Transaction.deserialize(first.serialize())
+        self.assertIs(first.sender, self.wallet1.address)
+        self.assertIs(second.sender, first.sender)
+        self.assertIs(second.recipient, first.recipient)
+        self.assertEqual(len(first.sender), 33)
+        self.assertFalse(hasattr(first, '__dict__'))
+        self.assertFalse(hasattr(Block("0", [first]), '__dict__'))
+        # The table is bounded: junk addresses never make it grow past the limit
+        interned, limit = dict(address_module._interned), address_module.INTERNED_ADDRESS_LIMIT
+        address_module.INTERNED_ADDRESS_LIMIT = len(interned) + 2
+        try:
+            for index in range(5):
+                Transaction.deserialize(Transaction(index.to_bytes(8, 'little'), "STAKE_ADDRESS", 1, None).serialize())
+            self.assertLessEqual(len(address_module._interned), address_module.INTERNED_ADDRESS_LIMIT)
+        finally:
+            address_module.INTERNED_ADDRESS_LIMIT = limit
+            address_module._interned.clear()
+            address_module._interned.update(interned)
+
+    def test_wire_format_round_trip_and_signing_payload(self):
+        transaction = Transaction(self.wallet1.public_key, "Contract1", 0, None, 2, "contract", "Contract1", "set_value", ["key", 7])
+        transaction.signature = self.wallet1.sign_transaction(transaction)
+        data = bytearray(b"xx" + transaction.serialize())
+        decoded, offset = Transaction.deserialize(data, 2)
+        self.assertEqual(offset, len(data))
+        self.assertIsInstance(decoded.payload(), memoryview)
+        self.assertEqual(decoded.txid(), transaction.txid())
+        self.assertEqual(decoded.compute_txid(), transaction.txid())
+        self.assertEqual((decoded.contract_method, decoded.contract_args), ("set_value", ["key", 7]))
+        self.assertTrue(Wallet.verify_signature(decoded.sender, decoded.signature, decoded))
+        data[2] = 99
+        with self.assertRaises(ValueError):
+            Transaction.deserialize(data, 2)
+
+    def test_parallel_execution_matches_serial_order(self):
+        wallet3 = Wallet()
+        spend = self.fund(self.wallet1) // 2 + 1
+        self.blockchain.deploy_contract(SmartContract("Contract1"))
+        transactions = [
+            Transaction(self.wallet1.public_key, wallet3.public_key, spend, None),
+            Transaction(self.wallet2.public_key, "Contract1", 0, None, 0, "contract", "Contract1", "set_value", ["key", 1]),
+            Transaction(self.wallet1.public_key, wallet3.public_key, spend, None),  # Overdraws after the first
+            Transaction(wallet3.public_key, self.wallet2.public_key, 4, None),  # Needs the first transfer
+            Transaction("Network", self.wallet2.public_key, 5, None, tx_type="reward"),
+        ]
+        executor = BlockExecutor(self.blockchain, workers=4)
+        self.assertEqual(len(executor.group(transactions)), 1)
+        self.assertEqual(len(executor.group(transactions[:1] + transactions[4:])), 2)
+        self.assertEqual(len(executor.group(transactions[:2])), 2)
+        underfunded = []
+        self.assertEqual(executor.execute(transactions, underfunded), [transactions[i] for i in (0, 1, 3, 4)])
+        self.assertEqual(underfunded, [transactions[2]])
+        self.assertEqual(self.blockchain.contracts["Contract1"].get_value("key"), 1)
+
+    def test_block_template_tracks_mempool_by_fee_density(self):
+        pool = Mempool()
+        template = BlockTemplate(max_count=3)
+        pool.subscribe(template.add, template.remove)
+        small = [Transaction(self.wallet1.public_key, "STAKE_ADDRESS", 1, None, fee) for fee in (1, 2, 3, 4)]
+        large = Transaction(self.wallet1.public_key, "STAKE_ADDRESS", 1, None, 5, "contract", "C", "set_value", ["x" * 500, 1])
+        for transaction in small + [large]:
+            pool.add(transaction)
+        # The large transaction pays the most but the least per byte
+        self.assertEqual({tx.fee for tx in template.transactions()}, {2, 3, 4})
+        pool.remove(small[3])
+        self.assertEqual({tx.fee for tx in template.transactions()}, {1, 2, 3})
+        template.max_size = template.size
+        pool.add(Transaction(self.wallet2.public_key, "STAKE_ADDRESS", 1, None, 9))
+        self.assertEqual({tx.fee for tx in template.transactions()}, {2, 3, 9})
+        self.assertLessEqual(template.size, template.max_size)
+        # A transaction larger than a block is refused; one too large for the space
+        # left waits aside without holding back smaller ones, until space frees up
+        limited = BlockTemplate(max_size=sum(len(tx.serialize()) for tx in small[:3]))
+        huge = Transaction(self.wallet1.public_key, "STAKE_ADDRESS", 1, None, 10000, "contract", "C", "set_value", ["x" * 500, 1])
+        limited.add(huge)
+        self.assertEqual(len(limited.entries), 0)
+        # Waits behind the three best, ahead of small[0], and fits only once two have left
+        wide = Transaction(self.wallet1.public_key, "STAKE_ADDRESS", 1, None, 3, "contract", "C", "set_value", ["x" * 60, 1])
+        for transaction in small[1:] + [wide, small[0]]:
+            limited.add(transaction)
+        self.assertEqual({tx.fee for tx in limited.transactions()}, {2, 3, 4})
+        limited.remove(small[3])
+        self.assertEqual(set(limited.transactions()), {small[0], small[1], small[2]})
+        limited.remove(small[2])
+        limited.remove(small[1])
+        self.assertEqual(set(limited.transactions()), {small[0], wide})
+
+    def test_stake_registry_sampling(self):
+        stakers = StakeRegistry()
+        for index in range(1, 11):
+            stakers[f"staker{index}"] = index
+        stakers.add("staker1", 4)
+        stakers["staker10"] = 0
+        self.assertEqual(stakers.total, sum(range(1, 10)) + 4)
+        self.assertEqual(stakers["staker1"], 5)
+        prefix = 0
+        for position, stake in enumerate(stakers.stakes):
+            prefix += stake
+            if stake:
+                self.assertEqual(stakers._find(prefix), position)
+        draws = stakers.select_many(500)
+        self.assertNotIn(to_address("staker10"), draws)
+        committee = stakers.select_many(20, distinct=True)
+        self.assertEqual(len(set(committee)), 9)
+        self.assertEqual(stakers.total, sum(range(1, 10)) + 4)
+
+    def test_contract_state_journal(self):
+        contracts = ContractStore()
+        contract = SmartContract("Contract1")
+        contract.set_value("a", 1)
+        contracts["Contract1"] = contract
+        contracts.checkpoint()
+        contract.set_value("a", 2)
+        contract.set_value("b", 3)
+        with contracts.snapshot() as snapshot:
+            contract.set_value("a", 4)
+            contracts["Contract2"] = SmartContract("Contract2")
+            self.assertEqual(snapshot.get_value(contracts, "Contract1", "a"), 2)
+            self.assertIsNone(snapshot.get(contracts, "Contract2"))
+            contracts.revert()
+            self.assertEqual(snapshot.get_value(contracts, "Contract1", "a"), 2)
+        self.assertEqual(dict(contract.state.items()), {"a": 1})
+        self.assertNotIn("Contract2", contracts)
+        contracts.checkpoint()
+        contract.set_value("a", 5)
+        self.assertEqual(len(contracts.commit()), 1)
+        self.assertEqual((contract.get_value("a"), contracts.journal.entries), (5, []))
+
+    def test_contract_gas_and_batches(self):
+        contract = SmartContract("Contract1")
+        self.blockchain.deploy_contract(contract)
+        self.assertNotIn("compile", contract.methods)
+        executor = self.blockchain.executor
+        batch = Transaction(self.wallet1.public_key, "Contract1", 0, None, 0, "contract", "Contract1", BATCH_METHOD,
+                            [["set_value", ["a", 1]], ["set_value", ["b", 2]]])
+        self.assertTrue(executor.call_contract(contract, batch))
+        self.assertEqual((contract.get_value("a"), contract.get_value("b")), (1, 2))
+        calls = [["set_value", ["a", index]] for index in range(TX_GAS_LIMIT // GAS_PER_WRITE)]
+        expensive = Transaction(self.wallet1.public_key, "Contract1", 0, None, 0, "contract", "Contract1", BATCH_METHOD, calls)
+        self.assertFalse(executor.call_contract(contract, expensive))
+        self.assertEqual(contract.get_value("a"), 1)
+        admitted, deferred = executor.within_gas_budget([batch] * (BLOCK_GAS_LIMIT // TX_GAS_LIMIT + 2))
+        self.assertEqual((len(admitted), len(deferred)), (BLOCK_GAS_LIMIT // TX_GAS_LIMIT, 2))
+
+    def test_failing_contract_calls_leave_no_state(self):
+        contract = SmartContract("Contract1")
+        self.blockchain.deploy_contract(contract)
+        self.fund(self.wallet1)
+        for method, args in [("set_value", ["only_one"]), ("set_value", "ab"), (BATCH_METHOD, [["set_value"]]),
+                             (BATCH_METHOD, [["set_value", ["a", 1]], ["set_value", ["b"]]])]:
+            self.blockchain.transaction_pool.add(
+                self.signed(self.wallet1, "Contract1", 0, len(args), "contract", "Contract1", method, args))
+        self.assertTrue(self.blockchain.mine_block(self.wallet2.public_key))
+        self.assertEqual(len(self.blockchain.chain[-1].transactions), 1)
+        self.assertEqual(dict(contract.state.items()), {})
+        self.assertEqual(len(self.blockchain.transaction_pool), 0)
+
+    def test_contract_state_keys_keep_their_type_in_snapshots(self):
+        class SetContract(SmartContract):
+            def remember(self, key):
+                self.state[key] = {key}  # Runs, but cannot be put in a snapshot
+
+        with tempfile.TemporaryDirectory() as directory:
+            blockchain = Blockchain(BlockStore(directory))
+            blockchain.snapshot_interval = 1
+            blockchain.deploy_contract(SmartContract("Contract1"))
+            self.fund(self.wallet1, blockchain)
+            for fee, args in enumerate([[1, "int"], ["1", "str"], [["list"], "unhashable"]]):
+                blockchain.transaction_pool.add(
+                    self.signed(self.wallet1, "Contract1", 0, fee, "contract", "Contract1", "set_value", args))
+            self.assertTrue(blockchain.mine_block(self.wallet2.public_key))
+            self.assertEqual(len(blockchain.chain[-1].transactions), 3)  # The list key's call failed
+            self.assertEqual(blockchain.snapshot.height, 2)
+            blockchain.close()
+            blockchain.chain.close()
+
+            restarted = Blockchain(BlockStore(directory))
+            self.assertEqual(restarted.snapshot.height, 2)
+            self.assertEqual(dict(restarted.contracts["Contract1"].state.items()), {1: "int", "1": "str"})
+            # A state the snapshot cannot encode costs only the snapshot, never the block
+            restarted.deploy_contract(SetContract("Contract2"))
+            restarted.transaction_pool.add(self.signed(self.wallet1, "Contract2", 0, 0, "contract", "Contract2", "remember", ["k"]))
+            self.assertTrue(restarted.mine_block(self.wallet2.public_key))
+            self.assertEqual((len(restarted.chain), restarted.snapshot.height), (4, 2))
+            restarted.close()
+            restarted.chain.close()
+
+    def test_peer_blocks_must_execute(self):
+        other = Blockchain()
+        self.fund(self.wallet2, other)
+        self.fund(self.wallet1)
+        # wallet1 was only paid on this node's branch, so it overspends on the other one
+        overspend = self.signed(self.wallet1, self.wallet2.public_key, 5)
+        reward = Transaction("Network", self.wallet2.public_key, other.mining_reward, None, tx_type="reward")
+        invalid = Block(other.chain[1].hash, [reward, overspend])
+        invalid.mine()
+        self.assertTrue(self.blockchain.add_block(other.chain[1]))
+        self.assertFalse(self.blockchain.add_block(invalid))
+        self.assertNotIn(invalid.hash, self.blockchain.tree)
+        self.assertEqual(self.blockchain.chain[-1].previous_hash, self.blockchain.chain[0].hash)
+        self.assertEqual(len(self.blockchain.chain), 2)
+        self.assertEqual(self.blockchain.ledger.confirmed.get(self.wallet1.address, 0), self.blockchain.chain[1].transactions[0].amount)
+        # On top of the tip it is refused the same way
+        invalid = Block(self.blockchain.chain[1].hash, [reward, self.signed(Wallet(), self.wallet1.public_key, 5)])
+        invalid.mine()
+        self.assertFalse(self.blockchain.add_block(invalid))
+        self.assertNotIn(invalid.hash, self.blockchain.tree)
+        other.close()
+
+    def test_confirmed_transactions_cannot_be_replayed(self):
+        self.fund(self.wallet1)
+        transfer = self.signed(self.wallet1, self.wallet2.public_key, 5)
+        self.assertTrue(self.blockchain.add_transaction_to_pool(transfer, self.wallet1.public_key, transfer.signature))
+        self.fund(self.wallet2)
+        self.assertIn(transfer, self.blockchain.chain[-1].transactions)
+        replay, _ = Transaction.deserialize(transfer.serialize())
+        self.assertFalse(self.blockchain.add_transaction_to_pool(replay, self.wallet1.public_key, replay.signature))
+        self.assertEqual(self.blockchain.add_transactions_to_pool([(replay, self.wallet1.public_key, replay.signature)]), [False])
+        reward = Transaction("Network", self.wallet2.public_key, self.blockchain.mining_reward, None, tx_type="reward")
+        replayed = Block(self.blockchain.chain[-1].hash, [reward, replay])
+        replayed.mine()
+        self.assertFalse(self.blockchain.add_block(replayed))
+        self.assertNotIn(replayed.hash, self.blockchain.tree)
+        # The index survives a snapshot, and is undone with the block
+        snapshot = ChainSnapshot.deserialize(self.blockchain.take_snapshot().serialize())
+        self.assertIn(transfer.txid(), snapshot.txids)
+        self.blockchain.disconnect_block()
+        self.assertNotIn(transfer.txid(), self.blockchain.confirmed_txids)
+        self.assertIsNotNone(self.blockchain.transaction_pool.get_txid(transfer.txid()))
+        self.fund(self.wallet2)
+        self.assertIn(transfer, self.blockchain.chain[-1].transactions)
+
+    def test_reorganize_to_heavier_branch(self):
+        other = Blockchain()
+        for blockchain in (self.blockchain, other):
+            blockchain.deploy_contract(SmartContract("Contract1"))
+        self.fund(self.wallet1)
+        self.stake(self.wallet1, 30)
+        self.blockchain.transaction_pool.add(
+            self.signed(self.wallet1, "Contract1", 0, 0, "contract", "Contract1", "set_value", ["key", 1]))
+        self.blockchain.mine_block()
+        self.assertEqual((self.blockchain.stakers.total, self.blockchain.contracts["Contract1"].get_value("key")), (30, 1))
+        for _ in range(3):
+            self.fund(self.wallet2, other)
+        mined = [block.hash for block in self.blockchain.chain]
+        # Branches of equal work keep the current one
+        self.assertTrue(self.blockchain.add_block(other.chain[1]))
+        self.assertTrue(self.blockchain.add_block(other.chain[2]))
+        self.assertEqual([block.hash for block in self.blockchain.chain], mined)
+        self.assertTrue(self.blockchain.add_block(other.chain[3]))
+        self.assertEqual([block.hash for block in self.blockchain.chain], [block.hash for block in other.chain])
+        self.assertEqual(self.blockchain.stakers.total, 0)
+        self.assertIsNone(self.blockchain.contracts["Contract1"].get_value("key"))
+        self.assertEqual(self.blockchain.ledger.confirmed.get(self.wallet1.address, 0), 0)
+        # The contract call is back in the pool; the block reward is not, and neither
+        # is the stake, as the coins it locked were never paid on the new branch
+        self.assertEqual({tx.tx_type for tx in self.blockchain.transaction_pool}, {"contract"})
+        self.assertEqual(self.blockchain.get_balance(self.wallet1.public_key), 0)
+
+    def test_branches_forking_below_the_undo_history_are_not_stored(self):
+        self.blockchain.tree.max_reorg_depth = 1
+        deep, shallow = Blockchain(), Blockchain()
+        self.fund(self.wallet1)
+        self.assertTrue(shallow.add_block(self.blockchain.chain[1]))
+        self.fund(self.wallet1)
+        self.fund(self.wallet2, deep)
+        self.fund(self.wallet2, shallow)
+        self.assertFalse(self.blockchain.add_block(deep.chain[1]))
+        self.assertNotIn(deep.chain[1].hash, self.blockchain.tree)
+        self.assertTrue(self.blockchain.add_block(shallow.chain[2]))
+        self.assertIn(shallow.chain[2].hash, self.blockchain.tree)
+        # Forgetting a block forgets its descendants, found through the parents' children
+        node = self.blockchain.tree.get(shallow.chain[2].hash)
+        self.blockchain.tree.remove(node)
+        self.assertNotIn(node.hash, self.blockchain.tree)
+        self.assertEqual(self.blockchain.tree.get(self.blockchain.chain[1].hash).children, [self.blockchain.tree.tip])
+        deep.close()
+        shallow.close()
+
+    def test_boot_from_snapshot(self):
+        self.blockchain.snapshot_interval = 2
+        self.blockchain.deploy_contract(SmartContract("Contract1"))
+        self.fund(self.wallet1)
+        self.stake(self.wallet1, 30)
+        self.blockchain.transaction_pool.add(
+            self.signed(self.wallet1, "Contract1", 0, 0, "contract", "Contract1", "set_value", ["key", 1]))
+        self.blockchain.mine_block()
+        snapshot = ChainSnapshot.deserialize(self.blockchain.snapshot.serialize())
+        self.assertEqual(snapshot.height, 2)
+        self.assertEqual(snapshot.commitment(), self.blockchain.snapshot.commitment())
+        with self.assertRaises(ValueError):
+            ChainSnapshot.deserialize(b"\x01" + snapshot.serialize()[1:])  # An older layout
+        self.blockchain.mine_block(self.wallet2.public_key)  # Paid to the staker
+
+        source = ChainSource(self.blockchain.chain)
+        self.assertIsNone(Blockchain.from_snapshot(snapshot, source, commitment="00" * 32))
+        fresh = Blockchain.from_snapshot(snapshot, source, snapshot.commitment())
+        self.assertIsNone(fresh.chain[1].transactions)
+        self.assertEqual((len(fresh.tree), fresh.tree.tip.height), (1, 2))
+        self.assertEqual(HeaderSync(fresh, [source]).sync(), 1)
+        self.assertEqual([block.hash for block in fresh.chain], [block.hash for block in self.blockchain.chain])
+        for address in (self.wallet1.public_key, self.wallet2.public_key, "STAKE_ADDRESS"):
+            self.assertEqual(fresh.ledger.get_balance(address), self.blockchain.ledger.confirmed.get(to_address(address), 0))
+            self.assertEqual(fresh.scan_balance(address), fresh.get_balance(address))
+        self.assertEqual((fresh.stakers.total, fresh.contracts["Contract1"].get_value("key")), (30, 1))
+        self.assertTrue(fresh.is_valid())
+        self.assertEqual(fresh.tree.tip.work, self.blockchain.tree.tip.work)
+
+    def test_closed_chain_reopens_without_replaying_blocks(self):
+        with tempfile.TemporaryDirectory() as directory:
+            blockchain = Blockchain(BlockStore(directory))
+            other = Blockchain()
+            for height in range(1, 6):
+                blockchain.mine_block(self.wallet1.public_key)
+                if height <= 3:
+                    self.assertTrue(other.add_block(blockchain.chain[height]))
+            balance = blockchain.ledger.confirmed[self.wallet1.address]
+            blockchain.close()
+            blockchain.chain.close()
+
+            restarted = Blockchain(BlockStore(directory))
+            # The blocks a reorg may undo are read back, but none is replayed
+            self.assertEqual((len(restarted.tree), restarted.tree.tip.height, restarted.snapshot.height), (6, 5, 5))
+            self.assertEqual(restarted.get_balance(self.wallet1.public_key), balance)
+            self.assertEqual([height for height, _ in restarted.get_history(self.wallet1.public_key)], [1, 2, 3, 4, 5])
+            # A heavier branch forking below the tip it was closed at is still adopted
+            for _ in range(3):
+                self.fund(self.wallet2, other)
+            for height in range(4, 7):
+                restarted.add_block(other.chain[height])
+            self.assertEqual(restarted.chain[-1].hash, other.chain[-1].hash)
+            self.assertEqual(restarted.get_balance(self.wallet1.public_key), other.get_balance(self.wallet1.public_key))
+            self.assertEqual([height for height, _ in restarted.get_history(self.wallet1.public_key)], [1, 2, 3])
+            self.assertEqual([height for height, _ in restarted.get_history(self.wallet2.public_key)], [4, 5, 6])
+            other.close()
+            restarted.close()
+            restarted.chain.close()
+
+    def test_pruned_block_store_restarts_from_snapshot(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = BlockStore(directory, segment_size=256)
+            blockchain = Blockchain(store)
+            blockchain.tree.max_reorg_depth = 2
+            blockchain.snapshot_interval = 4
+            blockchain.prune_depth = 2
+            for _ in range(8):
+                blockchain.mine_block(self.wallet1.public_key)
+            self.assertGreater(store.pruned_height(), 0)
+            self.assertIsNone(store[0].transactions)
+            self.assertIsNotNone(store[-1].transactions)
+            balance = blockchain.ledger.confirmed[self.wallet1.address]
+            store.close()
+
+            restarted = Blockchain(BlockStore(directory))
+            self.assertEqual(restarted.snapshot.height, 8)
+            self.assertEqual(restarted.get_balance(self.wallet1.public_key), balance)
+            self.assertTrue(restarted.validate(full=True))
+            restarted.chain.close()
+
+    def test_address_history_and_block_filters(self):
+        wallet3 = Wallet()
+        self.fund(wallet3)
+        for amount in range(1, 6):
+            self.blockchain.transaction_pool.add(self.signed(wallet3, self.wallet2.public_key, amount))
+            self.fund(self.wallet1)
+        history = self.blockchain.get_history(self.wallet1.public_key)
+        self.assertEqual([height for height, _ in history], [2, 3, 4, 5, 6])
+        for height, index in history:
+            self.assertEqual(self.blockchain.chain[height].transactions[index].recipient, self.wallet1.address)
+        first_page = self.blockchain.get_history(self.wallet1.public_key, limit=2)
+        second_page = self.blockchain.get_history(self.wallet1.public_key, after=first_page[-1], limit=2)
+        self.assertEqual(first_page + second_page, history[:4])
+
+        block = self.blockchain.chain[4]
+        block_filter = self.blockchain.get_block_filter(4)
+        self.assertLess(len(block_filter), 16)
+        self.assertTrue(filter_matches(block_filter, block.hash, [self.wallet1.public_key]))
+        self.assertTrue(filter_matches(block_filter, block.hash, ["Unknown", self.wallet2.address]))
+        self.assertFalse(filter_matches(block_filter, block.hash, [Wallet().public_key, "Unknown"]))
+        self.assertFalse(filter_matches(self.blockchain.get_block_filter(0), self.blockchain.chain[0].hash, ["Network"]))
+
+    def test_vectorized_asset_ledger(self):
+        self.fund(self.wallet1)
+        for amount in range(1, 4):
+            self.blockchain.transaction_pool.add(self.signed(self.wallet1, self.wallet2.public_key, amount))
+            self.fund(self.wallet1)
+        # Confirmed native balances are the asset ledger's native column, which
+        # only blocks move
+        assets = self.blockchain.assets
+        for address, balance in self.blockchain.ledger.confirmed.items():
+            self.assertEqual(self.blockchain.get_asset_balance(address), balance)
+        self.assertEqual(self.blockchain.ledger.get_balance(self.wallet1.public_key), self.blockchain.scan_balance(self.wallet1.public_key))
+        self.assertFalse(assets.transfer([(self.wallet1.public_key, self.wallet2.public_key, NATIVE_ASSET, 1)]))
+        self.assertEqual(assets.get_balance(self.wallet2.public_key), self.blockchain.ledger.confirmed[self.wallet2.address])
+        overdraft = Block(self.blockchain.chain[-1].hash, [Transaction(self.wallet2.public_key, self.wallet1.public_key, 10 ** 6, None)])
+        self.assertFalse(assets.apply_block(overdraft))
+        self.assertEqual(assets.get_balance(self.wallet1.public_key), self.blockchain.ledger.confirmed[self.wallet1.address])
+        commitment = self.blockchain.take_snapshot().commitment()
+        self.blockchain.register_asset("Gold")
+        self.assertIn("Gold", self.blockchain.registered_assets)
+        accounts = [f"account{index}" for index in range(2000)]
+        self.assertTrue(assets.transfer([("Network", account, "Gold", 10) for account in accounts]))
+        # Every account passes 15 on, which only works as one batch with 10 coming in
+        ring = [(account, accounts[index - 1], "Gold", 15) for index, account in enumerate(accounts)]
+        self.assertFalse(assets.transfer(ring + [(accounts[0], "Sink", "Gold", 11)]))
+        self.assertTrue(assets.transfer(ring + [(accounts[0], "Sink", "Gold", 10)]))
+        self.assertEqual((assets.get_balance(accounts[0], "Gold"), assets.get_balance("Sink", "Gold")), (0, 10))
+        self.assertFalse(assets.transfer([("Sink", accounts[0], "Gold", 0.5)]))
+        # Asset balances are this node's own, so they stay out of the state commitment
+        snapshot = ChainSnapshot.deserialize(self.blockchain.take_snapshot().serialize())
+        self.assertEqual(snapshot.commitment(), commitment)
+        self.assertEqual(snapshot.assets["Gold"][to_address("Sink")], 10)
+
+        channel = Channel(self.wallet1.public_key, self.wallet2.public_key, 0, 0)
+        channel.balances1, channel.balances2 = {"Gold": -4}, {"Gold": 4}
+        assets.transfer([("Network", self.wallet1.public_key, "Gold", 5)])
+        self.assertTrue(self.blockchain.settle_channels([channel]))
+        self.assertEqual(self.blockchain.get_asset_balance(self.wallet2.public_key, "Gold"), 4)
+        self.assertFalse(self.blockchain.settle_channels([channel, channel]))
+
+    def test_pipelined_channel_states_with_revocation(self):
+        self.blockchain.channels.add(Channel(self.wallet1.public_key, self.wallet2.public_key, 100, 100))
+        channel = self.blockchain.find_channel(self.wallet1.public_key, self.wallet2.public_key)
+        chain1, chain2 = RevocationChain(b'\x01' * 32), RevocationChain(b'\x02' * 32)
+        updates = []
+        state = channel.state
+        for number in range(1, 101):
+            state = state.next([(None, 1), ("Gold", 2)], chain1.hash(number), chain2.hash(number))
+            secrets = (chain1.secret(number - 1), chain2.secret(number - 1)) if number > 1 else None
+            updates.append((channel, state, self.wallet1.sign_transaction(state.payload()),
+                            self.wallet2.sign_transaction(state.payload()), secrets))
+        self.assertEqual(self.blockchain.update_channels(updates), [True] * 100)
+        self.assertEqual((channel.state.number, channel.balance1, channel.balances2), (100, 0, {"Gold": 200}))
+        self.assertLessEqual(len(channel.revocations1), 8)
+        self.assertEqual(channel.revocations2.secret(37), chain2.secret(37))
+        self.assertTrue(channel.is_revoked(99))
+        self.assertFalse(channel.is_revoked(100))
+        # Old states, overdrafts and states that could not be revoked are refused
+        self.assertEqual(self.blockchain.update_channels(updates[-1:]), [False])
+        self.assertIsNone(channel.propose([(None, 1)], chain1.hash(101), chain2.hash(101)))
+        self.assertIsNone(channel.propose([(None, -5)], None, chain2.hash(101)))
+
+        secrets = (chain1.secret(100), chain2.secret(100))
+        hashes = (chain1.hash(101), chain2.hash(101))
+        state = channel.propose([(None, -5)], *hashes)
+        self.assertFalse(self.blockchain.update_channel(self.wallet1.public_key, self.wallet2.public_key, None, -5,
+                                                        self.wallet1.sign_transaction(state.payload()),
+                                                        self.wallet2.sign_transaction(state.payload()), secrets, (None, hashes[1])))
+        self.assertFalse(self.blockchain.update_channel(self.wallet1.public_key, self.wallet2.public_key, None, -5,
+                                                        self.wallet1.sign_transaction(state.payload()), None, secrets, hashes))
+        self.assertTrue(self.blockchain.update_channel(self.wallet1.public_key, self.wallet2.public_key, None, -5,
+                                                       self.wallet1.sign_transaction(state.payload()),
+                                                       self.wallet2.sign_transaction(state.payload()), secrets, hashes))
+        restored = restore_channel(channel_fields(channel))
+        self.assertEqual(restored.state.payload(), channel.state.payload())
+        self.assertEqual(restored.revocations1.secret(3), chain1.secret(3))
+
+        # Closing on a revoked state is refused, and challenging a close on a state
+        # the requester revoked hands the requester's coins to the other party
+        self.assertFalse(channel.close(50))
+        self.blockchain.request_channel_close(self.wallet1.public_key, self.wallet2.public_key, 100)  # No requester named
+        self.assertTrue(self.blockchain.challenge_close(self.wallet1.public_key, self.wallet2.public_key, 101))
+        self.assertIsNone(channel.cheater)
+        self.blockchain.request_channel_close(self.wallet1.public_key, self.wallet2.public_key, 99, self.wallet2.public_key)
+        self.assertFalse(self.blockchain.challenge_close(self.wallet1.public_key, self.wallet2.public_key, 102))
+        self.assertTrue(self.blockchain.challenge_close(self.wallet1.public_key, self.wallet2.public_key, 101))
+        self.assertEqual((channel.cheater, channel.balance1, channel.balance2), (2, 200, 0))
+        self.assertTrue(channel.open)
+
+
+
+class TestNode(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.nodes = [Node(Blockchain()) for _ in range(3)]
+        for node in self.nodes:
+            await node.start()
+        # A line topology: 0 - 1 - 2
+        await self.nodes[0].connect(self.nodes[1].host, self.nodes[1].port)
+        await self.nodes[1].connect(self.nodes[2].host, self.nodes[2].port)
+
+    async def asyncTearDown(self):
+        for node in self.nodes:
+            await node.stop()
+
+    async def wait_for(self, condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            await asyncio.sleep(0.01)
+
+    async def test_gossip_blocks_and_transactions(self):
+        wallet1, wallet2 = Wallet(), Wallet()
+        origin = self.nodes[0]
+        reward = origin.blockchain.mining_reward
+        origin.mine(wallet1.public_key)
+        await self.wait_for(lambda: all(len(node.blockchain.chain) == 2 for node in self.nodes))
+
+        transaction = Transaction(wallet1.public_key, wallet2.public_key, 10, None, 1)
+        self.assertTrue(origin.submit_transaction(transaction, wallet1.public_key, wallet1.sign_transaction(transaction)))
+        await self.wait_for(lambda: all(node.blockchain.transaction_pool.get_txid(transaction.txid()) for node in self.nodes))
+
+        origin.mine(wallet2.public_key)
+        await self.wait_for(lambda: all(len(node.blockchain.chain) == 3 for node in self.nodes))
+        for node in self.nodes:
+            self.assertIsNone(node.blockchain.transaction_pool.get_txid(transaction.txid()))
+            self.assertEqual(node.blockchain.get_balance(wallet1.public_key), reward - 10)
+            self.assertEqual(node.duplicates, 0)
+        self.assertEqual(self.nodes[2].received[MSG_TX], 1)
+        self.assertEqual(self.nodes[2].received[MSG_BLOCK], 2)
+
+    async def test_malformed_message_drops_peer(self):
+        node = self.nodes[2]
+        reader, writer = await asyncio.open_connection(node.host, node.port)
+        await self.wait_for(lambda: len(node.peers) == 2)
+        # Claims five inventory items but carries none
+        writer.write(frame(MSG_INV, b"\x05\x00\x00\x00"))
+        await writer.drain()
+        await self.wait_for(lambda: len(node.peers) == 1)
+        writer.close()
+
+    def test_seen_and_requested_are_bounded(self):
+        node = Node(Blockchain(), seen_size=2, request_timeout=0)
+        for index in range(3):
+            node._mark_seen((1, bytes([index]) * 32))
+        self.assertEqual(list(node.seen), [(1, bytes([1]) * 32), (1, bytes([2]) * 32)])
+        node.requested[(1, bytes(32))] = (None, time.monotonic() - 1)
+        node._expire_requests()
+        self.assertEqual(len(node.requested), 0)
+        peer = Peer(None, None, 1, known_size=2)
+        for index in range(3):
+            peer.announce((1, bytes([index]) * 32))
+        self.assertEqual(list(peer.known), [(1, bytes([1]) * 32), (1, bytes([2]) * 32)])
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,7 +1,20 @@
+import hashlib
+from address import intern_address, to_address
+from encoding import (pack_address, pack_bytes, pack_json, pack_number, pack_optional_bytes, pack_optional_text,
+                      unpack_bytes, unpack_json, unpack_number, unpack_optional_bytes, unpack_optional_text, unpack_text)
+
+# Leading byte of every encoded transaction
+TX_FORMAT_VERSION = 1
+
+
 class Transaction:
-    def __init__(self, sender, recipient, amount, signature, fee, tx_type="transfer", contract_address=None, contract_method=None, contract_args=None):
-        self.sender = sender
-        self.recipient = recipient
+    __slots__ = ('sender', 'recipient', 'amount', 'signature', 'fee', 'tx_type', 'contract_address', 'contract_method', 'contract_args',
+                 '_payload', '_txid')
+
+    def __init__(self, sender, recipient, amount, signature, fee=0, tx_type="transfer", contract_address=None, contract_method=None, contract_args=None):
+        # Parties are stored as interned canonical address bytes, whether given as keys, names or bytes
+        self.sender = intern_address(sender)
+        self.recipient = intern_address(recipient)
         self.amount = amount
         self.signature = signature
         self.fee = fee
@@ -9,6 +22,69 @@ class Transaction:
         self.contract_address = contract_address
         self.contract_method = contract_method
         self.contract_args = contract_args
+        self._payload = None
+        self._txid = None
 
     def __str__(self):
-        return "{}{}{}{}".format(self.sender, self.recipient, self.amount, self.fee)
+        # Addresses are written in canonical hex so the text is the same on every node
+        return "{}{}{}{}".format(to_address(self.sender).hex(), to_address(self.recipient).hex(), self.amount, self.fee)
+
+    def signing_payload(self):
+        # The message the sender signs: the canonical encoding itself
+        return self.payload()
+
+    def payload(self):
+        # Canonical bytes of every field except the signature. Built once and
+        # cached, as a transaction is not modified after it is created; a decoded
+        # transaction keeps a view of the bytes it was decoded from.
+        if self._payload is None:
+            self._payload = self.encode_payload()
+        return self._payload
+
+    def encode_payload(self):
+        return b''.join([
+            bytes([TX_FORMAT_VERSION]),
+            pack_bytes(self.tx_type.encode()),
+            pack_address(self.sender),
+            pack_address(self.recipient),
+            pack_number(self.amount),
+            pack_number(self.fee),
+            pack_optional_text(self.contract_address),
+            pack_optional_text(self.contract_method),
+            pack_json(self.contract_args),
+        ])
+
+    def txid(self):
+        # Like a segwit txid, the signature is not part of it
+        if self._txid is None:
+            self._txid = hashlib.sha256(self.payload()).digest()
+        return self._txid
+
+    def compute_txid(self):
+        # Recomputed from the current fields, bypassing the caches (for validation)
+        return hashlib.sha256(self.encode_payload()).digest()
+
+    def serialize(self):
+        return b''.join([self.payload(), pack_optional_bytes(self.signature)])
+
+    @classmethod
+    def deserialize(cls, data, offset=0):
+        # Returns (transaction, next offset). `data` may be any bytes-like object;
+        # it is read through a memoryview, and addresses come back in canonical bytes form.
+        data = memoryview(data)
+        start = offset
+        if data[offset] != TX_FORMAT_VERSION:
+            raise ValueError(f"Unsupported transaction format version {data[offset]}")
+        tx_type, offset = unpack_text(data, offset + 1)
+        sender, offset = unpack_bytes(data, offset)
+        recipient, offset = unpack_bytes(data, offset)
+        amount, offset = unpack_number(data, offset)
+        fee, offset = unpack_number(data, offset)
+        contract_address, offset = unpack_optional_text(data, offset)
+        contract_method, offset = unpack_optional_text(data, offset)
+        contract_args, offset = unpack_json(data, offset)
+        payload = data[start:offset]
+        signature, offset = unpack_optional_bytes(data, offset)
+        transaction = cls(sender, recipient, amount, signature, fee, tx_type, contract_address, contract_method, contract_args)
+        transaction._payload = payload
+        return transaction, offset
@@ -0,0 +1,155 @@
+from concurrent.futures import ProcessPoolExecutor
+from block import Block
+from wallet import Wallet
+from constants import DIFFICULTY, MINING_REWARD, VALIDATION_BATCH_SIZE, VALIDATION_WORKERS
+
+# Sender of block rewards; it has no key, so its transactions carry no signature
+NETWORK = b"Network"
+
+
+class ValidationResult:
+    def __init__(self, valid, invalid_height=None, reason=None):
+        self.valid = valid
+        self.invalid_height = invalid_height  # First height that failed, if any
+        self.reason = reason
+
+    def __bool__(self):
+        return self.valid
+
+
+class ChainValidator:
+    # Validates a chain past its last verified checkpoint. Linkage is checked in
+    # order; hash, Proof-of-Work, Merkle root and signature checks run per block
+    # and are spread over a process pool in batches when workers > 1.
+    def __init__(self, workers=VALIDATION_WORKERS, batch_size=VALIDATION_BATCH_SIZE):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.checkpoint_height = 0
+        self.checkpoint_hash = None
+        self.executor = None  # Process pool kept between validations, started on first use
+
+    def validate(self, chain, full=False):
+        start = 1
+        if not full and self.checkpoint_hash is not None and self.checkpoint_height < len(chain) \
+                and chain[self.checkpoint_height].hash == self.checkpoint_hash:
+            start = self.checkpoint_height + 1
+
+        result = self._check_blocks(chain, start)
+        previous_hash = chain[start - 1].hash
+        for height in range(start, len(chain)):
+            if result.invalid_height is not None and height >= result.invalid_height:
+                break
+            block = chain[height]
+            if block.previous_hash != previous_hash:
+                result = ValidationResult(False, height, "previous hash mismatch")
+                break
+            previous_hash = block.hash
+        if result.valid:
+            self.checkpoint_height = len(chain) - 1
+            self.checkpoint_hash = chain[-1].hash
+        return result
+
+    def _check_blocks(self, chain, start):
+        if self.workers <= 1:
+            for height in range(start, len(chain)):
+                reason = check_stored_block(chain[height], chain[height].hash, height)
+                if reason:
+                    return ValidationResult(False, height, reason)
+            return ValidationResult(True)
+        batches = []
+        for batch_start in range(start, len(chain), self.batch_size):
+            heights = range(batch_start, min(batch_start + self.batch_size, len(chain)))
+            batches.append((batch_start, [(chain[height].hash, chain[height].serialize()) for height in heights]))
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.workers)
+        # Batches come back in order, so the first failure is the lowest height
+        for failure in self.executor.map(_check_batch, batches):
+            if failure:
+                return ValidationResult(False, *failure)
+        return ValidationResult(True)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+def check_header(block, claimed_hash):
+    # Returns the reason the header is invalid, or None
+    if claimed_hash != block.compute_hash():
+        return "hash mismatch"
+    if not claimed_hash.startswith('0' * DIFFICULTY):
+        return "insufficient proof of work"
+    return None
+
+
+def block_reward(height):
+    # Reward paid by the block at `height`; it shrinks by 10% with every block,
+    # rounded down to whole coins
+    reward = MINING_REWARD
+    for _ in range(height - 1):
+        if not reward:
+            break
+        reward = reward * 9 // 10
+    return reward
+
+
+def check_transaction(transaction):
+    # Returns the reason a transaction may not go into a block as is, or None.
+    # Block rewards are created by the block's miner and are checked by check_block.
+    if transaction.tx_type == "reward":
+        return "reward outside its block"
+    if type(transaction.amount) is not int:
+        return "amount is not a whole number of coins"
+    if transaction.amount < 0:
+        return "negative amount"
+    if transaction.signature is None:
+        return "unsigned transaction"
+    if not Wallet.verify_signature(transaction.sender, transaction.signature, transaction.signing_payload()):
+        return "invalid transaction signature"
+    return None
+
+
+def check_block(block, claimed_hash, height):
+    # Returns the reason the block at `height` is invalid, or None
+    if block.transactions is None:
+        return "missing block body"
+    if block.merkle_root != block.compute_merkle_root(cached=False):
+        return "merkle root mismatch"
+    reason = check_header(block, claimed_hash)
+    if reason:
+        return reason
+    # Every transaction is signed by its sender, except for at most one reward
+    # from the network of exactly the block reward
+    rewards = 0
+    txids = set()
+    for transaction in block.transactions:
+        txid = transaction.compute_txid()
+        if txid in txids:
+            return "repeated transaction"
+        txids.add(txid)
+        if transaction.tx_type == "reward":
+            rewards += 1
+            if rewards > 1 or transaction.sender != NETWORK or transaction.amount != block_reward(height):
+                return "invalid block reward"
+        else:
+            reason = check_transaction(transaction)
+            if reason:
+                return reason
+    return None
+
+
+def check_stored_block(block, claimed_hash, height):
+    # Blocks whose bodies were pruned are checked by their header alone
+    if block.transactions is None:
+        return check_header(block, claimed_hash)
+    return check_block(block, claimed_hash, height)
+
+
+def _check_batch(batch):
+    start, blocks = batch
+    for offset, (claimed_hash, data) in enumerate(blocks):
+        reason = check_stored_block(Block.deserialize(data), claimed_hash, start + offset)
+        if reason:
+            return start + offset, reason
+    return None
@@ -1,15 +1,81 @@
 import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from cryptography.exceptions import InvalidSignature
 from cryptography.hazmat.primitives.asymmetric import ec
 from cryptography.hazmat.primitives import serialization, hashes
+from address import intern_address, to_public_key
+from sigcache import signature_cache
 
 class Wallet:
     def __init__(self):
         self.private_key = ec.generate_private_key(ec.SECP256R1())
         self.public_key = self.private_key.public_key()
+        self.address = intern_address(self.public_key)
 
-    def sign_transaction(sEmailMessage
-        return self.private_key.sign(transaction.encode(), ec.ECDSA(hashes.SHA256()))
+    def sign_transaction(self, transaction):
+        return self.private_key.sign(_payload(transaction), ec.ECDSA(hashes.SHA256()))
 
     @staticmethod
     def verify_signature(public_key, signature, transaction):
-        return public_key.verify(signature, transaction.encode(), ec.ECDSA(hashes.SHA256()))
+        payload = _payload(transaction)
+        key = signature_cache.key(public_key, signature, payload)
+        if key in signature_cache:
+            return True
+        if not _verify(public_key, signature, payload):
+            return False
+        signature_cache.add(key)
+        return True
+
+    @staticmethod
+    def verify_signatures(items, workers=1, executor=None):
+        # Verify (public_key, signature, transaction) tuples, spreading the ones not
+        # already in the signature cache over a process pool. Pass a long-lived
+        # executor with `workers` processes to avoid starting one per batch.
+        # Returns a list of bools.
+        results = [True] * len(items)
+        keys = {}
+        for index, (public_key, signature, transaction) in enumerate(items):
+            key = signature_cache.key(public_key, signature, _payload(transaction))
+            if key not in signature_cache:
+                keys[index] = key
+        # Keys travel to the workers as compressed points, which unlike key objects pickle
+        jobs = [(keys[index][0], items[index][1], bytes(_payload(items[index][2]))) for index in keys]
+        if workers > 1 and len(jobs) > 1:
+            chunksize = max(1, len(jobs) // (workers * 4))
+            if executor is None:
+                with ProcessPoolExecutor(workers) as executor:
+                    outcomes = list(executor.map(_verify_encoded, jobs, chunksize=chunksize))
+            else:
+                outcomes = list(executor.map(_verify_encoded, jobs, chunksize=chunksize))
+        else:
+            outcomes = [_verify(items[index][0], items[index][1], _payload(items[index][2])) for index in keys]
+        for (index, key), valid in zip(keys.items(), outcomes):
+            results[index] = valid
+            if valid:
+                signature_cache.add(key)
+        return results
+
+
+def _payload(transaction):
+    # Signed messages are a transaction's signing payload, bytes or text
+    if isinstance(transaction, (bytes, bytearray, memoryview)):
+        return transaction
+    if isinstance(transaction, str):
+        return transaction.encode()
+    return transaction.signing_payload()
+
+
+def _verify(public_key, signature, payload):
+    # Accepts key objects or compressed-point addresses
+    public_key = to_public_key(public_key)
+    if public_key is None:
+        return False
+    try:
+        public_key.verify(signature, payload, ec.ECDSA(hashes.SHA256()))
+    except (InvalidSignature, TypeError):
+        return False
+    return True
+
+
+def _verify_encoded(job):
+    return _verify(*job)
@@ -1,51 +1,70 @@
 import time
-import smtplib
-from email.message import EmailMessage
+import heapq
 from constants import TIME_LOCK_PERIOD
+from notifications import EmailNotifier
 
 
 class Watchtower:
-    def __init__(self):
+    # Channels report close requests and challenges through their listeners, and
+    # close deadlines wait in a heap, so a check only touches channels that
+    # changed since the last one or whose time lock has run out.
+    def __init__(self, notifier=None):
         self.monitored_channels = {}  # Key: channel_id, Value: channel_record
+        self.notifier = notifier if notifier is not None else EmailNotifier()
+        self.deadlines = []  # Heap of (close deadline, channel_id); stale entries are skipped
+        self.changed_channels = set()  # channel_ids that fired an event since the last check
 
     def monitor_channel(self, channel, latest_transaction, signatures):
+        if channel.id not in self.monitored_channels:
+            channel.add_listener(self.on_channel_event)
         self.monitored_channels[channel.id] = {
             'channel': channel,
             'latest_transaction': latest_transaction,
-            'signatures': signatures
+            'signatures': signatures,
+            'deadline': None
         }
+        if channel.close_requested:
+            self.changed_channels.add(channel.id)
 
-    def check_channels(self):
-        current_time = time.time()
-        for channel_id, record in self.monitored_channels.items():
+    def on_channel_event(self, channel, event):
+        if channel.id in self.monitored_channels:
+            self.changed_channels.add(channel.id)
+
+    def check_channels(self, current_time=None):
+        if current_time is None:
+            current_time = time.time()
+        changed, self.changed_channels = self.changed_channels, set()
+        for channel_id in changed:
+            record = self.monitored_channels[channel_id]
             channel = record['channel']
-            if channel.close_requested:
-                time_since_request = current_time - channel.close_request_time
-                if time_since_request < TIME_LOCK_PERIOD:
-                    if record['latest_transaction'].index > channel.last_transaction_index:
-                        self.challenge_close(channel, record['latest_transaction'], record['signatures'])
-                else:
-                    self.notify_user_of_close(channel)
+            if not channel.close_requested:
+                record['deadline'] = None
+                continue
+            if current_time - channel.close_request_time < TIME_LOCK_PERIOD:
+                if record['latest_transaction'].number > channel.last_transaction_index:
+                    self.challenge_close(channel, record['latest_transaction'], record['signatures'])
+            # A challenge restarts the time lock, so read the deadline afterwards
+            record['deadline'] = channel.close_request_time + TIME_LOCK_PERIOD
+            heapq.heappush(self.deadlines, (record['deadline'], channel_id))
+        while self.deadlines and self.deadlines[0][0] <= current_time:
+            deadline, channel_id = heapq.heappop(self.deadlines)
+            record = self.monitored_channels.get(channel_id)
+            if record is None or record['deadline'] != deadline:
+                continue
+            record['deadline'] = None
+            self.notify_user_of_close(record['channel'])
 
     def challenge_close(self, channel, latest_transaction, signatures):
         # In a real-world scenario, this would involve submitting the challenge to the blockchain
-        # Here, we'll just update the channel directly and print a message
-        channel.challenge_close(latest_transaction.index)
-        print(f"Challenged close for channel {channel.id} with transaction {latest_transaction.index}")
+        # Here, we'll just update the channel directly and print a message. The
+        # channel itself penalizes a requester that claimed a state it had revoked.
+        channel.challenge_close(latest_transaction.number)
+        print(f"Challenged close for channel {channel.id} with state {latest_transaction.number}")
 
     def notify_user_of_close(self, channel):
         # Send an email notification to the user
         self.send_email_notification(f"Channel {channel.id} Closed", f"Channel {channel.id} has been closed.")
 
     def send_email_notification(self, subject, body):
-        # This is a basic implementation using smtplib; you'd need to set up your SMTP server details
-        msg = EmailMessage()
-        msg.set_content(body)
-        msg['Subject'] = subject
-        msg['From'] = 'watchtower@example.com'
-        msg['To'] = 'user@example.com'  # This should be the user's email address
-
-        # Connect to the SMTP server and send the email
-        with smtplib.SMTP('smtp.example.com', 587) as server:
-            server.login('watchtower@example.com', 'password')  # Use your SMTP server credentials
-            server.send_message(msg)
\ No newline at end of file
+        # Queued for the notifier's background sender, so checks never wait on SMTP
+        self.notifier.notify(subject, body)